@@ -0,0 +1,182 @@
+import collections
+import logging
+from typing import Any, Collection, Dict, Iterable, List, NamedTuple, Tuple
+
+from sqlalchemy import and_, bindparam, case, func
+from sqlalchemy.exc import IntegrityError
+
+import adstxt.models as models
+
+
+LOG = logging.getLogger(__name__)
+
+RELATIONSHIPS = ('direct', 'reseller')
+
+# (supplier_domain, supplier_relationship) of an active record.
+Authorisation = Tuple[str, str]
+# (supplier_domain, supplier_relationship, file_type)
+SupplierKey = Tuple[str, str, str]
+
+
+class Mismatch(NamedTuple):
+    """An aggregate which disagreed with records.
+
+    Counts are (domains,) for supplier_counts and (direct, reseller) for
+    domain_record_counts, a missing row counts as all zeros.
+    """
+    table: str
+    key: Tuple[Any, ...]
+    stored: Tuple[int, ...]
+    expected: Tuple[int, ...]
+
+
+def ensure_supplier_counts(session, keys: Iterable[SupplierKey]) -> None:
+    """Create any missing supplier_counts rows with a count of zero.
+
+    Rows are created up front in their own short transactions, the same as
+    suppliers, so crawls only ever update them.
+    """
+    for supplier_domain, relationship, file_type in keys:
+        session.add(models.SupplierCount(supplier_domain=supplier_domain,
+                                         supplier_relationship=relationship,
+                                         file_type=file_type,
+                                         domains=0))
+        try:
+            session.commit()
+        # Already there, or another writer got there first.
+        except IntegrityError:
+            session.rollback()
+
+
+def apply(session, domain_id: int, file_type: str,
+          before: Collection[Authorisation],
+          after: Collection[Authorisation]) -> None:
+    """Update the aggregates with the change to a domains active records.
+
+    Runs in the session writing the records, so the aggregates commit with
+    them.  Supplier counts need their rows to exist already, see
+    ensure_supplier_counts.
+
+    Args:
+        session (Session): session the records are being written in.
+        domain_id (int): domain whose records changed.
+        file_type (str): file the records are listed in.
+        before (Collection[Authorisation]): one for each record which was
+            active before the crawl.
+        after (Collection[Authorisation]): one for each record which is
+            active now.
+    """
+    before_set, after_set = set(before), set(after)
+    # Rows are always updated in the same order, so concurrent writers
+    # can't deadlock on them.
+    deltas = sorted([(key, 1) for key in after_set - before_set] +
+                    [(key, -1) for key in before_set - after_set])
+    if deltas:
+        table = models.SupplierCount.__table__
+        session.execute(
+            table.update().where(and_(
+                table.c.supplier_domain == bindparam('key_domain'),
+                table.c.supplier_relationship == bindparam(
+                    'key_relationship'),
+                table.c.file_type == file_type)).values(
+                    domains=table.c.domains + bindparam('delta')),
+            [{'key_domain': supplier_domain,
+              'key_relationship': relationship,
+              'delta': delta}
+             for (supplier_domain, relationship), delta in deltas])
+
+    counts = collections.Counter(relationship for _, relationship in after)
+    domain_count = session.query(models.DomainRecordCount).get(
+        (domain_id, file_type))
+    if domain_count is None:
+        domain_count = models.DomainRecordCount(domain_id=domain_id,
+                                                file_type=file_type)
+        session.add(domain_count)
+    domain_count.direct = counts['direct']
+    domain_count.reseller = counts['reseller']
+
+
+def _expected_supplier_counts(session) -> Dict[Tuple, Tuple[int, ...]]:
+    query = session.query(
+        models.Supplier.domain,
+        models.Record.supplier_relationship,
+        models.Record.file_type,
+        func.count(func.distinct(models.Record.domain_id))).select_from(
+            models.Record).join(models.Record.supplier).filter(
+                models.Record.active.is_(True)).group_by(
+                    models.Supplier.domain,
+                    models.Record.supplier_relationship,
+                    models.Record.file_type)
+    return {(supplier_domain, relationship, file_type): (int(domains),)
+            for supplier_domain, relationship, file_type, domains in query}
+
+
+def _expected_domain_counts(session) -> Dict[Tuple, Tuple[int, ...]]:
+    query = session.query(
+        models.Record.domain_id,
+        models.Record.file_type,
+        *[func.sum(case(
+            [(models.Record.supplier_relationship == relationship, 1)],
+            else_=0)) for relationship in RELATIONSHIPS]).filter(
+                models.Record.active.is_(True)).group_by(
+                    models.Record.domain_id, models.Record.file_type)
+    return {(domain_id, file_type): tuple(int(count) for count in counts)
+            for domain_id, file_type, *counts in query}
+
+
+def verify(session, repair: bool = True) -> List[Mismatch]:
+    """Rebuild the aggregates from records and compare them.
+
+    Only run this while nothing else is writing records, a domain written
+    part way through can show up as a mismatch.
+
+    Args:
+        session (Session): SQLAlchemy session to query with.
+        repair (bool): set mismatched aggregates to what they should be.
+
+    Returns:
+        List[Mismatch]: every aggregate which was wrong.
+    """
+    stored_suppliers = {
+        (row.supplier_domain, row.supplier_relationship, row.file_type):
+        (row.domains,)
+        for row in session.query(models.SupplierCount)}
+    stored_domains = {
+        (row.domain_id, row.file_type): (row.direct, row.reseller)
+        for row in session.query(models.DomainRecordCount)}
+
+    mismatches = []
+    for table, stored, expected, zero in (
+            (models.SupplierCount.__tablename__, stored_suppliers,
+             _expected_supplier_counts(session), (0,)),
+            (models.DomainRecordCount.__tablename__, stored_domains,
+             _expected_domain_counts(session), (0, 0))):
+        for key in sorted(set(stored) | set(expected)):
+            if stored.get(key, zero) != expected.get(key, zero):
+                mismatches.append(Mismatch(table=table, key=key,
+                                           stored=stored.get(key, zero),
+                                           expected=expected.get(key, zero)))
+
+    for mismatch in mismatches:
+        LOG.warning('%s %r is %r, should be %r.', *mismatch)
+        if not repair:
+            continue
+        if mismatch.table == models.SupplierCount.__tablename__:
+            supplier_domain, relationship, file_type = mismatch.key
+            session.merge(models.SupplierCount(
+                supplier_domain=supplier_domain,
+                supplier_relationship=relationship,
+                file_type=file_type,
+                domains=mismatch.expected[0]))
+        else:
+            domain_id, file_type = mismatch.key
+            direct, reseller = mismatch.expected
+            session.merge(models.DomainRecordCount(
+                domain_id=domain_id, file_type=file_type, direct=direct,
+                reseller=reseller))
+    if repair:
+        session.commit()
+
+    LOG.info('Verified aggregates, %d mismatches%s.', len(mismatches),
+             ' repaired' if repair and mismatches else '')
+    return mismatches
@@ -0,0 +1,135 @@
+import datetime
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Iterator, NamedTuple, Optional
+
+from adstxt.fetch import OK, FetchResponse
+
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bodies (
+    domain TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    scraped_at TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (domain, file_type)
+);
+"""
+
+_INDEX_FILE = 'index.sqlite'
+
+# Bodies are small text files which compress well, the default of 9 costs a
+# lot more time for very little.
+COMPRESS_LEVEL = 6
+
+
+class ArchivedBody(NamedTuple):
+    domain: str
+    file_type: str
+    scraped_at: datetime.datetime
+    digest: str
+
+
+class BlobArchive:
+    """Content addressed archive of fetched bodies.
+
+    Each body is gzipped into a blob named by the sha256 of its contents, so
+    a body which hasn't changed between crawls, or which is shared by many
+    domains, is only stored once.  A small SQLite index maps each domain and
+    file type to the digest of the body last fetched, which is what replay
+    pushes back through processing.
+
+    Bodies are stored as they were fetched.
+
+    Args:
+        path (str): directory to keep blobs and the index in, created if
+            missing.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Autocommit, every statement is its own transaction.
+        self._conn = sqlite3.connect(os.path.join(path, _INDEX_FILE),
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _blob_path(self, digest: str) -> str:
+        # Fan out on the first two characters to keep directories small.
+        return os.path.join(self.path, digest[:2], digest + '.gz')
+
+    def put(self, fetchdata: FetchResponse) -> Optional[str]:
+        """Archive a fetched body, if there is one.
+
+        Returns:
+            Optional[str]: digest of the body, None if there wasn't one.
+        """
+        if not fetchdata.adstxt_present or not fetchdata.has_lines():
+            return None
+
+        body = fetchdata.body
+        digest = hashlib.sha256(body).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # Write to a temporary file first so a blob is never torn.
+            tmp_path = '%s.%d.tmp' % (blob_path, threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(body, COMPRESS_LEVEL))
+            os.replace(tmp_path, blob_path)
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO bodies '
+                '(domain, file_type, scraped_at, digest) VALUES (?, ?, ?, ?)',
+                (fetchdata.domain, fetchdata.file_type,
+                 fetchdata.scraped_at.isoformat(), digest))
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """Read a body back by its digest."""
+        with open(self._blob_path(digest), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def bodies(self, domain: Optional[str] = None) -> Iterator[ArchivedBody]:
+        """Iterate over the latest body of each domain, ordered by domain."""
+        query = 'SELECT domain, file_type, scraped_at, digest FROM bodies'
+        params = ()  # type: tuple
+        if domain:
+            query += ' WHERE domain = ?'
+            params = (domain,)
+        with self._lock:
+            rows = self._conn.execute(
+                query + ' ORDER BY domain, file_type', params).fetchall()
+        for domain, file_type, scraped_at, digest in rows:
+            # isoformat leaves the microseconds off when there aren't any.
+            scraped_format = ('%Y-%m-%dT%H:%M:%S.%f' if '.' in scraped_at
+                              else '%Y-%m-%dT%H:%M:%S')
+            yield ArchivedBody(
+                domain=domain,
+                file_type=file_type,
+                scraped_at=datetime.datetime.strptime(scraped_at,
+                                                      scraped_format),
+                digest=digest)
+
+    def load(self, archived: ArchivedBody) -> FetchResponse:
+        """Rebuild the FetchResponse an archived body was fetched as."""
+        return FetchResponse(domain=archived.domain,
+                             scraped_at=archived.scraped_at,
+                             adstxt_present=True,
+                             body=self.get(archived.digest),
+                             outcome=OK,
+                             file_type=archived.file_type)
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,52 @@
+import collections
+import threading
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """Bounded mapping which drops the least recently used entry when full.
+
+    Domains are written from several threads, so the cache is locked.  Hits
+    and misses are counted as entries are looked up.
+
+    Args:
+        size (int): most entries held at once.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict(
+        )  # type: collections.OrderedDict
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Look up an entry, None if it isn't held."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def hit_rate(self) -> float:
+        """Share of lookups which were hits, 0 if there haven't been any."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
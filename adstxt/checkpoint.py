@@ -0,0 +1,109 @@
+import datetime
+import logging
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cycles (
+    id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    domain TEXT PRIMARY KEY,
+    done INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class Checkpoint:
+    """Local record of the crawl cycle in progress.
+
+    The domains making up a cycle are written to a small SQLite file when
+    the cycle starts, and each one is marked as done once it's been
+    persisted.  If the crawler dies part way through a cycle the domains
+    which haven't been persisted can be picked up again on restart.
+
+    Args:
+        path (str): path of the checkpoint file, created if missing.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # Autocommit, every statement is its own transaction.
+        self._conn = sqlite3.connect(path,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        # WAL survives the process being killed, which is what we're
+        # guarding against, without syncing on every mark.
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _unfinished_cycle(self) -> Optional[int]:
+        row = self._conn.execute(
+            'SELECT id FROM cycles WHERE finished_at IS NULL '
+            'ORDER BY id DESC LIMIT 1').fetchone()
+        return row[0] if row else None
+
+    def pending(self) -> Optional[List[str]]:
+        """Get the domains left from an unfinished cycle.
+
+        Returns:
+            Optional[List[str]]: domains not yet persisted in their original
+                order, or None if there's no cycle to resume.
+        """
+        with self._lock:
+            if self._unfinished_cycle() is None:
+                return None
+            return [domain for domain, in self._conn.execute(
+                'SELECT domain FROM frontier WHERE done = 0 ORDER BY rowid')]
+
+    def start(self, domains: List[str]) -> None:
+        """Start a new cycle, replacing whatever was left of the last one."""
+        now = datetime.datetime.utcnow().isoformat()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute(
+                'UPDATE cycles SET finished_at = ? WHERE finished_at IS NULL',
+                (now,))
+            self._conn.execute('DELETE FROM frontier')
+            self._conn.execute('INSERT INTO cycles (started_at) VALUES (?)',
+                               (now,))
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO frontier (domain) VALUES (?)',
+                ((domain,) for domain in domains))
+            self._conn.execute('COMMIT')
+
+    def mark_done(self, domain: str) -> None:
+        """Mark a domain as persisted."""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE frontier SET done = 1 WHERE domain = ?', (domain,))
+
+    def progress(self) -> Tuple[int, int]:
+        """Get (done, total) domains for the current cycle."""
+        with self._lock:
+            done, total = self._conn.execute(
+                'SELECT COALESCE(SUM(done), 0), COUNT(*) '
+                'FROM frontier').fetchone()
+        return done, total
+
+    def finish(self) -> None:
+        """Mark the current cycle as finished."""
+        now = datetime.datetime.utcnow().isoformat()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute(
+                'UPDATE cycles SET finished_at = ? WHERE finished_at IS NULL',
+                (now,))
+            self._conn.execute('DELETE FROM frontier')
+            self._conn.execute('COMMIT')
+
+    def close(self) -> None:
+        self._conn.close()
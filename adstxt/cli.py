@@ -1,35 +1,116 @@
 import asyncio
+import datetime
 import logging
 import os
 import sys
+import threading
 
 import click
-from raven import Client  # type: ignore
-from raven.handlers.logging import SentryHandler  # type: ignore
-from raven.conf import setup_logging  # type: ignore
 
-from adstxt.main import AdsTxtCrawler
+import adstxt.export as export
+import adstxt.models as models
 from adstxt.exceptions import ConfigurationError
 
+# Crawling pulls in aiohttp, elasticsearch and raven which are slow to
+# import, so the crawler and sentry are only imported by the commands which
+# use them.  python benchmarks/startup.py keeps an eye on this.
+
 
 log = logging.getLogger(__name__)
 
+# ISO 8601 forms accepted by --since, all taken as UTC.
+SINCE_FORMATS = ('%Y-%m-%d',
+                 '%Y-%m-%dT%H:%M:%S',
+                 '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def _parse_since(since):
+    # A trailing Z is common for UTC and is what we store anyway.
+    value = since[:-1] if since.endswith('Z') else since
+    for since_format in SINCE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, since_format)
+        except ValueError:
+            continue
+    raise ConfigurationError(
+        'Invalid configuration, since must be formatted as YYYY-MM-DD, '
+        'YYYY-MM-DDTHH:MM:SS or YYYY-MM-DDTHH:MM:SS.ffffff.')
+
 
-@click.command()
-@click.option('--db_uri', envvar='ADSTXT_DB_URI', required=True)
+@click.group(invoke_without_command=True)
+@click.option('--db_uri', envvar='ADSTXT_DB_URI')
 @click.option('--es_uri', envvar='ADSTXT_ES_URI')
 @click.option('--domain')
 @click.option('--es_query', envvar='ADSTXT_ES_QUERY')
 @click.option('--es_index', envvar='ADSTXT_ES_INDEX')
 @click.option('--file_path', envvar='ADSTXT_FILE_PATH')
-@click.option('--crawler_tag', envvar='ADSTXT_CRAWLER_TAG', required=True)
+@click.option('--crawler_tag', envvar='ADSTXT_CRAWLER_TAG')
 @click.option('--log_level', envvar='ADSTXT_LOG_LEVEL', default='INFO')
 @click.option('--log_formatter', envvar='ADSTXT_LOG_FORMATTER', default=None)
+@click.option('--events_path', envvar='ADSTXT_EVENTS_PATH', default=None)
+@click.option('--checkpoint_path', envvar='ADSTXT_CHECKPOINT_PATH',
+              default=None)
+@click.option('--spool_path', envvar='ADSTXT_SPOOL_PATH', default=None,
+              help='Directory to spool fetched domains to while they wait '
+              'to be written.')
+@click.option('--stream_path', envvar='ADSTXT_STREAM_PATH', default=None,
+              help='Crawl once without a database, writing NDJSON to this '
+              'directory or - for stdout.')
+@click.option('--trace_sample_rate', envvar='ADSTXT_TRACE_SAMPLE_RATE',
+              type=float, default=0.0,
+              help='Fraction of domains to keep per phase timings for.')
+@click.option('--continuous', envvar='ADSTXT_CONTINUOUS', is_flag=True,
+              help='Crawl domains as they come due rather than in cycles.')
+@click.option('--archive_path', envvar='ADSTXT_ARCHIVE_PATH', default=None,
+              help='Directory to archive fetched bodies in for replays.')
+@click.option('--file_types', envvar='ADSTXT_FILE_TYPES', default='ads.txt',
+              help='Comma separated files to fetch from each domain, any of '
+              'ads.txt and app-ads.txt.')
+@click.option('--archive_records_after_days',
+              envvar='ADSTXT_ARCHIVE_RECORDS_AFTER_DAYS', type=int,
+              default=None,
+              help='Move records inactive for this many days out of the '
+              'records table.')
+@click.option('--connect_timeout', envvar='ADSTXT_CONNECT_TIMEOUT',
+              type=float, default=None,
+              help='Seconds to resolve and connect to a domain, defaults to '
+              '5.')
+@click.option('--first_byte_timeout', envvar='ADSTXT_FIRST_BYTE_TIMEOUT',
+              type=float, default=None,
+              help='Seconds to wait for a response once connected, defaults '
+              'to 5.')
+@click.option('--read_timeout', envvar='ADSTXT_READ_TIMEOUT', type=float,
+              default=None,
+              help='Seconds to read a response body, defaults to 5.')
+@click.option('--domain_deadline', envvar='ADSTXT_DOMAIN_DEADLINE',
+              type=float, default=None,
+              help='Seconds allowed for everything fetched from a domain '
+              'including retries, defaults to 45.')
+@click.option('--cycle_budget', envvar='ADSTXT_CYCLE_BUDGET', type=float,
+              default=None,
+              help='Seconds allowed for each crawl cycle, domains not done '
+              'in time are left for the next one.')
+@click.option('--fetchers', envvar='ADSTXT_FETCHERS', type=int, default=0,
+              help='Fetch each cycle in this many processes of their own.')
+@click.option('--writers', envvar='ADSTXT_WRITERS', type=int, default=0,
+              help='Write each cycle in this many processes of their own.')
+@click.option('--parse_processes', envvar='ADSTXT_PARSE_PROCESSES', type=int,
+              default=0,
+              help='Parse large ads.txt files in this many processes rather '
+              'than in the writer.')
+@click.option('--sqlite_tuned', envvar='ADSTXT_SQLITE_TUNED', is_flag=True,
+              help='Run an SQLite database with WAL, a larger cache and '
+              'memory mapped reads.')
+@click.option('--batch', 'batch_path', default=None,
+              help='Crawl the domains in this file, or - for stdin, straight '
+              'away printing a line of JSON for each and exit.')
 @click.option('--es', is_flag=True)
 @click.option('--file', is_flag=True)
 @click.option('--cli', is_flag=True)
 @click.option('--domain')
-def cli(db_uri,
+@click.pass_context
+def cli(ctx,
+        db_uri,
         es_uri,
         es_query,
         es_index,
@@ -37,6 +118,25 @@ def cli(db_uri,
         crawler_tag,
         log_level,
         log_formatter,
+        events_path,
+        checkpoint_path,
+        spool_path,
+        stream_path,
+        trace_sample_rate,
+        continuous,
+        archive_path,
+        file_types,
+        archive_records_after_days,
+        connect_timeout,
+        first_byte_timeout,
+        read_timeout,
+        domain_deadline,
+        cycle_budget,
+        fetchers,
+        writers,
+        parse_processes,
+        sqlite_tuned,
+        batch_path,
         es,
         file,
         cli,
@@ -50,10 +150,26 @@ def cli(db_uri,
         level=log_level.upper(),
         format=formatter)
 
+    # Subcommands share the database configuration but do their own thing.
+    if ctx.invoked_subcommand is not None:
+        if not db_uri:
+            raise ConfigurationError(
+                'Invalid configuration, a database URI is required.')
+        ctx.obj = {'db_uri': db_uri, 'archive_path': archive_path,
+                   'parse_processes': parse_processes,
+                   'sqlite_tuned': sqlite_tuned}
+        return
+
     log.info('Launching CLI and validating configuration.')
 
     # Check that the config we've been provided works.
-    if not es and not file and not cli:
+    if not db_uri and not stream_path:
+        raise ConfigurationError(
+            'Invalid configuration, a database URI is required.')
+    if not crawler_tag:
+        raise ConfigurationError(
+            'Invalid configuration, a crawler tag is required.')
+    if not es and not file and not cli and not batch_path:
         raise ConfigurationError('Invalid configuration, no input given.')
     if file and not file_path:
         raise ConfigurationError(
@@ -65,7 +181,27 @@ def cli(db_uri,
         raise ConfigurationError(
             'Invalid configuration, es used but some configuration is '
             'missing. query=%r, index=%r, uri=%r', es_query, es_index, es_uri)
+    if (fetchers or writers) and (continuous or stream_path or batch_path or
+                                  checkpoint_path or spool_path):
+        raise ConfigurationError(
+            'Invalid configuration, fetcher and writer processes only crawl '
+            'in cycles without a checkpoint or spool.')
+    file_types = tuple(file_type.strip()
+                       for file_type in file_types.split(',')
+                       if file_type.strip())
+    unknown = set(file_types) - set(models.FILE_TYPES)
+    if not file_types or unknown:
+        raise ConfigurationError(
+            'Invalid configuration, unknown file types %r.' % sorted(unknown))
 
+    from adstxt.fetch import Timeouts
+    from adstxt.main import AdsTxtCrawler
+    # Anything not given keeps its default.
+    timeouts = Timeouts(**{
+        phase: seconds for phase, seconds in (
+            ('connect', connect_timeout), ('first_byte', first_byte_timeout),
+            ('read', read_timeout), ('domain', domain_deadline))
+        if seconds is not None})
     crawler = AdsTxtCrawler(es,
                             file,
                             db_uri,
@@ -73,27 +209,212 @@ def cli(db_uri,
                             es_query=es_query,
                             es_index=es_index,
                             file_uri=file_path,
-                            crawler_id=crawler_tag)
+                            crawler_id=crawler_tag,
+                            events_path=events_path,
+                            checkpoint_path=checkpoint_path,
+                            spool_path=spool_path,
+                            stream_path=stream_path,
+                            trace_sample_rate=trace_sample_rate,
+                            file_types=file_types,
+                            archive_path=archive_path,
+                            archive_records_after_days=(
+                                archive_records_after_days),
+                            timeouts=timeouts,
+                            cycle_budget=cycle_budget,
+                            fetcher_processes=fetchers,
+                            writer_processes=writers,
+                            parse_processes=parse_processes,
+                            sqlite_tuned=sqlite_tuned)
 
-    version_hash = os.environ.get('GIT_HASH')
-    sentry = Client(release=version_hash)
-    sentry_handler = SentryHandler(sentry, level=logging.WARNING)
-    setup_logging(sentry_handler)
+    if stream_path:
+        crawler.run_stream([domain] if cli else crawler.fetch_domains())
+        return
+
+    sentry = _setup_sentry()
+
+    if batch_path:
+        crawler._bootstrap_db()
+        try:
+            with click.open_file(batch_path) as f:
+                counts = crawler.run_batch(
+                    (line.strip() for line in f if line.strip()),
+                    sys.stdout)
+        finally:
+            crawler.close()
+        click.echo('%d files found, %d missing, %d domains errored and %d '
+                   'invalid.' % (counts.get('present', 0),
+                                 counts.get('missing', 0),
+                                 counts.get('errored', 0),
+                                 counts.get('invalid', 0)), err=True)
+        return
 
     if cli:
-        from adstxt.fetch import fetch
         crawler._bootstrap_db()
         crawler._check_viability(domain)
 
         loop = asyncio.get_event_loop()
-        fetchdata = loop.run_until_complete(fetch(domain, crawler_tag))
-
-        crawler.process_domain(fetchdata)
+        for fetchdata in loop.run_until_complete(
+                crawler._fetch_domain(domain)):
+            crawler.process_domain(fetchdata)
         log.info('Domain processed.  Exiting.')
         return
 
     try:
-        crawler.run()
+        crawler.run(continuous=continuous)
     except Exception as e:
-        sentry.captureException()
+        if sentry:
+            sentry.captureException()
         raise e
+
+
+def _setup_sentry():  # pragma: no cover
+    """Send warnings and exceptions to sentry when SENTRY_DSN is set."""
+    if not os.environ.get('SENTRY_DSN'):
+        return None
+
+    from raven import Client  # type: ignore
+    from raven.handlers.logging import SentryHandler  # type: ignore
+    from raven.conf import setup_logging  # type: ignore
+
+    version_hash = os.environ.get('GIT_HASH')
+    sentry = Client(release=version_hash)
+    sentry_handler = SentryHandler(sentry, level=logging.WARNING)
+    setup_logging(sentry_handler)
+    return sentry
+
+
+@cli.command(name='export')
+@click.option('--table', type=click.Choice(export.TABLES), default='records')
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS),
+              default='csv')
+@click.option('--output', default='-',
+              help='File to write to, defaults to stdout.')
+@click.option('--since', default=None,
+              help='Only records first seen after this UTC time, as '
+              'YYYY-MM-DD, YYYY-MM-DDTHH:MM:SS or YYYY-MM-DDTHH:MM:SS.ffffff '
+              'with an optional trailing Z.')
+@click.option('--domain', default=None)
+@click.option('--supplier', default=None)
+@click.option('--file_type', type=click.Choice(models.FILE_TYPES),
+              default=models.ADS_TXT,
+              help='Export rows listed in this file.')
+@click.pass_obj
+def export_command(obj, table, fmt, output, since, domain,
+                   supplier, file_type):  # pragma: no cover
+    """Stream active records or variables out of the database."""
+    since_at = _parse_since(since) if since else None
+    if fmt == 'parquet' and output == '-':
+        raise ConfigurationError(
+            'Invalid configuration, parquet exports need an output file.')
+
+    from adstxt.main import AdsTxtCrawler
+    crawler = AdsTxtCrawler(False, False, obj['db_uri'],
+                            sqlite_tuned=obj['sqlite_tuned'])
+    crawler._bootstrap_db()
+    session = crawler._session()
+
+    try:
+        if fmt == 'parquet':
+            export.export(session, output, table, fmt, since_at, domain,
+                          supplier, file_type=file_type)
+        else:
+            with click.open_file(output, 'w') as out:
+                export.export(session, out, table, fmt, since_at, domain,
+                              supplier, file_type=file_type)
+    finally:
+        session.close()
+
+
+@cli.command()
+@click.option('--domain', default=None, help='Only replay this domain.')
+@click.option('--workers', default=None, type=int,
+              help='Number of domains written at once.')
+@click.pass_obj
+def replay(obj, domain, workers):  # pragma: no cover
+    """Push archived bodies back through processing."""
+    if not obj['archive_path']:
+        raise ConfigurationError(
+            'Invalid configuration, replay needs an archive path.')
+
+    from adstxt.main import AdsTxtCrawler
+    crawler = AdsTxtCrawler(False, False, obj['db_uri'],
+                            archive_path=obj['archive_path'],
+                            parse_processes=obj['parse_processes'],
+                            sqlite_tuned=obj['sqlite_tuned'])
+    crawler._bootstrap_db()
+    try:
+        crawler.replay(domain, workers)
+    finally:
+        crawler.close()
+
+
+@cli.command()
+@click.option('--dry_run', is_flag=True,
+              help="Report mismatches without repairing them.")
+@click.pass_obj
+def verify(obj, dry_run):  # pragma: no cover
+    """Check the aggregate tables against records, repairing them."""
+    import adstxt.aggregates as aggregates
+    from adstxt.main import AdsTxtCrawler
+    crawler = AdsTxtCrawler(False, False, obj['db_uri'],
+                            sqlite_tuned=obj['sqlite_tuned'])
+    crawler._bootstrap_db()
+    session = crawler._session()
+    try:
+        mismatches = aggregates.verify(session, repair=not dry_run)
+    finally:
+        session.close()
+
+    click.echo('%d aggregates %s.' % (
+        len(mismatches), 'wrong' if dry_run else 'repaired'), err=True)
+    if dry_run and mismatches:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--host', envvar='ADSTXT_SERVE_HOST', default='127.0.0.1')
+@click.option('--port', envvar='ADSTXT_SERVE_PORT', default=8080, type=int)
+@click.option('--snapshot_path', envvar='ADSTXT_SNAPSHOT_PATH', default=None,
+              help='Reverse index snapshot to warm start from and update.')
+@click.pass_obj
+def serve(obj, host, port, snapshot_path):  # pragma: no cover
+    """Serve reverse authorisation lookups from an in memory index."""
+    import adstxt.service as service
+    from adstxt.main import AdsTxtCrawler
+    from adstxt.query import ReverseIndex
+    crawler = AdsTxtCrawler(False, False, obj['db_uri'],
+                            sqlite_tuned=obj['sqlite_tuned'])
+    crawler._bootstrap_db()
+
+    if snapshot_path and os.path.exists(snapshot_path):
+        index = ReverseIndex.load(snapshot_path)
+    else:
+        index = ReverseIndex()
+        session = crawler._session()
+        index.build(session)
+        session.close()
+        if snapshot_path:
+            index.save(snapshot_path)
+
+    # Catch up with whatever has changed since the snapshot, then keep
+    # tailing the record feed in the background.
+    session = crawler._session()
+    index.refresh(session)
+    session.close()
+
+    stop = threading.Event()
+    refresher = threading.Thread(
+        target=service.keep_fresh,
+        args=(index, crawler._session, stop, snapshot_path),
+        daemon=True)
+    refresher.start()
+
+    server = service.make_server(index, host, port)
+    log.info('Serving reverse lookups on %s:%d.', host, port)
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
+        if snapshot_path:
+            index.save(snapshot_path)
@@ -0,0 +1,157 @@
+import datetime
+import logging
+import threading
+import time
+from typing import Collection, Dict, Optional, Tuple
+
+from sqlalchemy import and_, literal, select
+from sqlalchemy.exc import SQLAlchemyError
+
+import adstxt.models as models
+
+
+LOG = logging.getLogger(__name__)
+
+# Records moved in each transaction, small enough that locks are brief.
+BATCH_SIZE = 1000
+# Seconds to wait between batches, to leave room for the crawlers writes.
+BATCH_PAUSE = 0.1
+
+# (supplier_id, pub_id, supplier_relationship)
+RecordKey = Tuple[int, str, str]
+
+# Columns copied across, everything but active.
+_COLUMNS = ('id', 'domain_id', 'supplier_id', 'pub_id',
+            'supplier_relationship', 'file_type', 'first_seen',
+            'deactivated_at')
+
+
+class RecordArchiver:
+    """Move records which have been inactive for a while to the archive.
+
+    Records are moved in batches, each in its own short transaction, so the
+    crawler is never held up for long.  A record reactivated while its
+    batch is being moved leaves the batch to be tried again on the next
+    pass.
+
+    Args:
+        session_factory (sessionmaker): makes sessions to move records in.
+        inactive_for (timedelta): how long records are inactive before
+            they're archived.
+        batch_size (int): records moved in each transaction.
+        pause (float): seconds between batches.
+    """
+
+    def __init__(self,
+                 session_factory,
+                 inactive_for: datetime.timedelta,
+                 batch_size: int = BATCH_SIZE,
+                 pause: float = BATCH_PAUSE) -> None:
+        self._session = session_factory
+        self.inactive_for = inactive_for
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def archive_batch(self, now: Optional[datetime.datetime] = None) -> int:
+        """Archive a single batch of records.
+
+        Returns:
+            int: records archived, 0 once there are none left or if the
+                batch raced with a reactivation.
+        """
+        now = now or datetime.datetime.utcnow()
+        records = models.Record.__table__
+        archive = models.ArchivedRecord.__table__
+        cutoff = now - self.inactive_for
+
+        session = self._session()
+        try:
+            ids = [record_id for record_id, in session.query(
+                models.Record.id).filter(
+                    models.Record.active.is_(False),
+                    models.Record.deactivated_at < cutoff).order_by(
+                        models.Record.id).limit(self.batch_size)]
+            if not ids:
+                return 0
+
+            # Check again as rows are moved, one may have been reactivated
+            # since they were picked out.
+            still_inactive = and_(records.c.id.in_(ids),
+                                  records.c.active.is_(False),
+                                  records.c.deactivated_at < cutoff)
+            copied = session.execute(archive.insert().from_select(
+                list(_COLUMNS) + ['archived_at'],
+                select([records.c[column] for column in _COLUMNS] +
+                       [literal(now, models.ArchivedRecord.archived_at.type)]
+                       ).where(still_inactive))).rowcount
+            deleted = session.execute(
+                records.delete().where(still_inactive)).rowcount
+            if copied != deleted:
+                LOG.info('Records changed while being archived, leaving '
+                         'them until next time.')
+                session.rollback()
+                return 0
+            session.commit()
+            return deleted
+        finally:
+            session.close()
+
+    def run_once(self, stop: Optional[threading.Event] = None,
+                 now: Optional[datetime.datetime] = None) -> int:
+        """Archive everything that's due, batch by batch.
+
+        Returns:
+            int: records archived.
+        """
+        archived = 0
+        while not (stop and stop.is_set()):
+            moved = self.archive_batch(now)
+            archived += moved
+            if not moved:
+                break
+            time.sleep(self.pause)
+        LOG.info('Archived %d records inactive for over %s.', archived,
+                 self.inactive_for)
+        return archived
+
+    def run(self, stop: threading.Event, interval: float) -> None:
+        """Archive records every interval seconds until stop is set."""
+        while not stop.is_set():
+            try:
+                self.run_once(stop)
+            # The database may be down, carry on with the next pass.
+            except SQLAlchemyError:
+                LOG.exception('Unable to archive records.')
+            stop.wait(interval)
+
+
+def restore(session, domain_id: int, file_type: str,
+            keys: Collection[RecordKey]) -> Dict[RecordKey, models.Record]:
+    """Move archived records which are listed again back into records.
+
+    Runs in the session writing the domain, records come back inactive with
+    their original ids to be reactivated like any other.
+
+    Returns:
+        Dict[RecordKey, Record]: the restored records.
+    """
+    if not keys:
+        return {}
+
+    restored = {}  # type: Dict[RecordKey, models.Record]
+    for archived in session.query(models.ArchivedRecord).filter(
+            models.ArchivedRecord.domain_id == domain_id,
+            models.ArchivedRecord.file_type == file_type,
+            models.ArchivedRecord.supplier_id.in_(
+                {supplier_id for supplier_id, _, _ in keys})):
+        key = (archived.supplier_id, archived.pub_id,
+               archived.supplier_relationship)
+        if key not in keys or key in restored:
+            continue
+        record = models.Record(**{column: getattr(archived, column)
+                                  for column in _COLUMNS})
+        record.active = False
+        session.add(record)
+        session.delete(archived)
+        restored[key] = record
+    return restored
@@ -0,0 +1,161 @@
+import datetime
+import logging
+from typing import Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import func
+
+import adstxt.models as models
+from adstxt.ndjson import RotatingWriter
+
+
+LOG = logging.getLogger(__name__)
+
+INSERT = 'insert'
+REACTIVATE = 'reactivate'
+DEACTIVATE = 'deactivate'
+VARIABLE_INSERT = 'variable_insert'
+VARIABLE_UPDATE = 'variable_update'
+
+# Event ids are handed out when a row is inserted but only become visible
+# when its transaction commits, so with more than one writer a lower id can
+# turn up after higher ones have been read.  Readers go back over this many
+# ids behind the newest they've seen to pick up stragglers.
+SETTLE_WINDOW = 1000
+
+
+class ChangeEvent(NamedTuple):
+    cursor: int
+    event: str
+    domain: str
+    occurred_at: datetime.datetime
+    supplier_domain: Optional[str] = None
+    pub_id: Optional[str] = None
+    supplier_relationship: Optional[str] = None
+    cert_authority: Optional[str] = None
+    key: Optional[str] = None
+    value: Optional[str] = None
+    file_type: Optional[str] = None
+
+
+def read_since(session, cursor: int = 0,
+               limit: int = 10000) -> List[ChangeEvent]:
+    """Read change events after a cursor, oldest first.
+
+    Args:
+        session (Session): SQLAlchemy session to query with.
+        cursor (int): last cursor consumed, 0 reads from the start.
+        limit (int): maximum number of events to return.
+
+    Returns:
+        List[ChangeEvent]: events in id order.  With concurrent writers
+            ids can become visible out of order, use FeedCursor to tail the
+            feed without missing any.
+    """
+    event = models.RecordEvent
+    record, archived = models.Record, models.ArchivedRecord
+    query = session.query(
+        event.id,
+        event.event,
+        models.Domain.name,
+        event.occurred_at,
+        models.Supplier.domain,
+        func.coalesce(record.pub_id, archived.pub_id),
+        func.coalesce(record.supplier_relationship,
+                      archived.supplier_relationship),
+        models.Supplier.cert_authority,
+        models.Variable.key,
+        event.value,
+        func.coalesce(record.file_type, archived.file_type,
+                      models.Variable.file_type)).select_from(event)
+
+    query = query.join(models.Domain, event.domain_id == models.Domain.id)
+    # Events are for either a record or a variable, records may since have
+    # been archived.
+    query = query.outerjoin(record, event.record_id == record.id)
+    query = query.outerjoin(archived, event.record_id == archived.id)
+    query = query.outerjoin(models.Supplier, func.coalesce(
+        record.supplier_id, archived.supplier_id) == models.Supplier.id)
+    query = query.outerjoin(models.Variable,
+                            event.variable_id == models.Variable.id)
+    query = query.filter(event.id > cursor).order_by(event.id).limit(limit)
+
+    return [ChangeEvent(*row) for row in query]
+
+
+class FeedCursor:
+    """Gap safe position in the change feed.
+
+    Every id at or below the watermark has been read, ids above it which
+    have been read are remembered individually.  Each read goes back to the
+    watermark and skips ids already seen, so an event committed out of order
+    is still returned as long as it becomes visible within SETTLE_WINDOW ids
+    of the newest event read.  Events are returned at most once per cursor,
+    though not necessarily in id order.
+
+    Args:
+        watermark (int): id at or below which everything has been read.
+        seen (Iterable[int]): ids above the watermark already read.
+        window (int): how many ids behind the newest to keep re-reading.
+    """
+
+    def __init__(self,
+                 watermark: int = 0,
+                 seen: Iterable[int] = (),
+                 window: int = SETTLE_WINDOW) -> None:
+        self.watermark = watermark
+        self.seen = set(seen)  # type: Set[int]
+        self.window = window
+
+    @property
+    def position(self) -> int:
+        """Newest id read."""
+        return max(self.seen) if self.seen else self.watermark
+
+    def read(self, session, limit: int = 10000) -> List[ChangeEvent]:
+        """Read every event not yet seen.
+
+        Args:
+            session (Session): SQLAlchemy session to query with.
+            limit (int): events fetched from the database at a time.
+
+        Returns:
+            List[ChangeEvent]: unseen events, oldest first within each read.
+        """
+        unseen = []
+        after = self.watermark
+        while True:
+            batch = read_since(session, after, limit)
+            for event in batch:
+                if event.cursor not in self.seen:
+                    self.seen.add(event.cursor)
+                    unseen.append(event)
+            if len(batch) < limit:
+                break
+            after = batch[-1].cursor
+
+        # Anything further back than the window is assumed to be settled.
+        settled = self.position - self.window
+        if settled > self.watermark:
+            self.seen = {cursor for cursor in self.seen if cursor > settled}
+            self.watermark = settled
+
+        return unseen
+
+
+class NDJSONEventSink:
+    """Write change events to rotating NDJSON files.
+
+    Args:
+        path (str): directory to write event files to.
+        prefix (str): prefix of each file name, several writers sharing a
+            directory need their own.
+    """
+
+    def __init__(self, path: str, prefix: str = 'events') -> None:
+        self._writer = RotatingWriter(path, prefix)
+
+    def emit(self, events: Iterable[ChangeEvent]) -> None:
+        self._writer.write(event._asdict() for event in events)
+
+    def close(self) -> None:
+        self._writer.close()
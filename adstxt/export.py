@@ -0,0 +1,206 @@
+import csv
+import datetime
+import logging
+from typing import Any, IO, Iterable, Iterator, Optional, Sequence, Tuple
+
+import adstxt.models as models
+from adstxt.exceptions import ConfigurationError
+from adstxt.ndjson import dumps
+
+
+LOG = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+TABLES = ('records', 'variables')
+
+RECORD_FIELDS = ('domain', 'supplier_domain', 'pub_id',
+                 'supplier_relationship', 'cert_authority', 'first_seen')
+VARIABLE_FIELDS = ('domain', 'key', 'value')
+
+# Rows are pulled from the database and written out in batches of this
+# size, this bounds memory use regardless of how big the export is.
+BATCH_SIZE = 10000
+
+
+def query_records(session,
+                  since: Optional[datetime.datetime] = None,
+                  domain: Optional[str] = None,
+                  supplier: Optional[str] = None,
+                  file_type: str = models.ADS_TXT):
+    """Build a query of active records, in RECORD_FIELDS order.
+
+    Args:
+        session (Session): SQLAlchemy session to query with.
+        since (Optional[datetime]): only records first seen after this.
+        domain (Optional[str]): only records listed by this domain.
+        supplier (Optional[str]): only records for this supplier domain.
+        file_type (str): only records listed in this file.
+    """
+    query = session.query(
+        models.Domain.name,
+        models.Supplier.domain,
+        models.Record.pub_id,
+        models.Record.supplier_relationship,
+        models.Supplier.cert_authority,
+        models.Record.first_seen).select_from(models.Record).join(
+            models.Record.domain).join(models.Record.supplier).filter(
+                models.Record.file_type == file_type,
+                models.Record.active.is_(True))
+
+    if since:
+        query = query.filter(models.Record.first_seen > since)
+    if domain:
+        query = query.filter(models.Domain.name == domain)
+    if supplier:
+        query = query.filter(models.Supplier.domain == supplier)
+
+    # Ordering by id keeps incremental exports stable and uses the primary
+    # key rather than a sort.
+    return query.order_by(models.Record.id)
+
+
+def query_variables(session, domain: Optional[str] = None,
+                    file_type: str = models.ADS_TXT):
+    """Build a query of variables, in VARIABLE_FIELDS order."""
+    query = session.query(
+        models.Domain.name,
+        models.Variable.key,
+        models.Variable.value).select_from(models.Variable).join(
+            models.Variable.domain).filter(
+                models.Variable.file_type == file_type)
+
+    if domain:
+        query = query.filter(models.Domain.name == domain)
+
+    return query.order_by(models.Variable.id)
+
+
+def stream(query, batch_size: int = BATCH_SIZE) -> Iterator[Tuple]:
+    """Stream rows from a query using a server side cursor.
+
+    MySQL otherwise buffers the whole result set client side before
+    returning the first row.
+    """
+    return iter(query.execution_options(
+        stream_results=True).yield_per(batch_size))
+
+
+def _batches(rows: Iterable[Tuple],
+             batch_size: int) -> Iterator[Sequence[Tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_csv(rows: Iterable[Tuple], fields: Sequence[str],
+              out: IO[str]) -> int:
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_ndjson(rows: Iterable[Tuple], fields: Sequence[str],
+                 out: IO[str]) -> int:
+    count = 0
+    for row in rows:
+        out.write(dumps(dict(zip(fields, row))) + '\n')
+        count += 1
+    return count
+
+
+def write_parquet(rows: Iterable[Tuple], fields: Sequence[str], path: str,
+                  batch_size: int = BATCH_SIZE) -> int:
+    """Write rows as parquet, one row group per batch.
+
+    This needs pyarrow which is an optional dependency.
+    """
+    try:
+        import pyarrow  # type: ignore
+        import pyarrow.parquet  # type: ignore
+    except ImportError:
+        raise ConfigurationError(
+            'Parquet exports need pyarrow, install adstxt[parquet].')
+
+    writer = None
+    count = 0
+    try:
+        for batch in _batches(rows, batch_size):
+            columns = list(zip(*batch))
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(column) for column in columns],
+                names=list(fields))
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return count
+
+
+def export(session,
+           out: Any,
+           table: str = 'records',
+           fmt: str = 'csv',
+           since: Optional[datetime.datetime] = None,
+           domain: Optional[str] = None,
+           supplier: Optional[str] = None,
+           batch_size: int = BATCH_SIZE,
+           file_type: str = models.ADS_TXT) -> int:
+    """Export active records or variables.
+
+    Args:
+        session (Session): SQLAlchemy session to query with.
+        out (Union[IO[str], str]): file object for csv and ndjson, a path
+            for parquet.
+        table (str): one of TABLES.
+        fmt (str): one of FORMATS.
+        since (Optional[datetime]): only records first seen after this.
+        domain (Optional[str]): only rows for this domain.
+        supplier (Optional[str]): only records for this supplier domain.
+        batch_size (int): rows fetched from the database at a time.
+        file_type (str): export rows listed in this file, one of
+            models.FILE_TYPES.
+
+    Returns:
+        int: number of rows exported.
+    """
+    if fmt not in FORMATS:
+        raise ConfigurationError('Unknown export format %r.' % fmt)
+
+    if table == 'records':
+        query = query_records(session, since, domain, supplier,
+                              file_type)
+        fields = RECORD_FIELDS
+    elif table == 'variables':
+        # Variables are updated in place, so there's nothing to base
+        # incremental exports on.
+        if since or supplier:
+            raise ConfigurationError(
+                'Variables can only be filtered by domain.')
+        query = query_variables(session, domain, file_type)
+        fields = VARIABLE_FIELDS
+    else:
+        raise ConfigurationError('Unknown export table %r.' % table)
+
+    rows = stream(query, batch_size)
+    if fmt == 'csv':
+        count = write_csv(rows, fields, out)
+    elif fmt == 'ndjson':
+        count = write_ndjson(rows, fields, out)
+    else:
+        count = write_parquet(rows, fields, out, batch_size)
+
+    LOG.info('Exported %d %s as %s.', count, table, fmt)
+    return count
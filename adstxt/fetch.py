@@ -1,139 +1,547 @@
-from asyncio import TimeoutError, sleep, BoundedSemaphore
+import asyncio
+from asyncio import (
+    CancelledError, TimeoutError, sleep, BoundedSemaphore, get_event_loop)
+import collections
 import datetime
 import logging
-from typing import Optional, NamedTuple, Tuple
+import time
+import weakref
+from typing import (
+    Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence,
+    Tuple)
 
-import async_timeout  # type: ignore
-from aiohttp import ClientSession, client_exceptions as exceptions
-import tldextract
+from aiohttp import (
+    ClientSession, TCPConnector, TraceConfig, client_exceptions as exceptions)
+
+from adstxt.models import ADS_TXT
 
 
 log = logging.getLogger(__name__)
 
 MAX_CONCURRENT_REQUESTS = 100
+# Default seconds allowed for each phase of an attempt.
 TIMEOUT = 5
-_SEMAPHORE = BoundedSemaphore(value=MAX_CONCURRENT_REQUESTS)
+# Default seconds allowed for everything fetched from a domain, across
+# retries and backing off.
+DOMAIN_DEADLINE = 45
+# Attempts at each file before giving up.
+ATTEMPTS = 5
+# Each crawl cycle runs on a new event loop and a semaphore only works on
+# the loop it was first used from, so there's one for each loop.
+_SEMAPHORES = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+
+# Files fetched from each domain unless told otherwise.
+DEFAULT_FILE_TYPES = (ADS_TXT,)
+
+# Seconds spent in each phase of a fetch, summed over retries and redirects.
+# `connect` includes the TLS handshake, aiohttp doesn't time it separately.
+Timings = Dict[str, float]
+PHASES = ('dns', 'connect', 'first_byte', 'body', 'total')
+
+# Why a fetch ended up the way it did.  Where retries ran out, the outcome is
+# the reason the last attempt failed.
+OK = 'ok'
+HTTP_ERROR = 'http_error'
+CONNECT_TIMEOUT = 'connect_timeout'
+FIRST_BYTE_TIMEOUT = 'first_byte_timeout'
+READ_TIMEOUT = 'read_timeout'
+# The domain ran out of time with attempts left.
+DEADLINE_EXCEEDED = 'deadline_exceeded'
+# The crawl cycle ran out of time before the domain was done, the caller
+# leaves it for the next cycle.
+CYCLE_BUDGET_EXCEEDED = 'cycle_budget_exceeded'
+DISCONNECTED = 'disconnected'
+CONNECT_ERROR = 'connect_error'
+CLIENT_ERROR = 'client_error'
+UNICODE_ERROR = 'unicode_error'
+BAD_REDIRECT = 'bad_redirect'
+BAD_CONTENT_TYPE = 'bad_content_type'
+HTML_CONTENT = 'html_content'
+# Raised out of fetch altogether, set by the caller.
+FETCH_ERROR = 'fetch_error'
+
+# Phases of an attempt which are timed out on their own.
+CONNECT = 'connect'
+FIRST_BYTE = 'first_byte'
+READ = 'read'
+PHASE_TIMEOUTS = {CONNECT: CONNECT_TIMEOUT,
+                  FIRST_BYTE: FIRST_BYTE_TIMEOUT,
+                  READ: READ_TIMEOUT}
+
+
+class Timeouts(NamedTuple):
+    """Seconds allowed for each phase of an attempt and for a whole domain.
+
+    connect covers DNS, connecting and the TLS handshake, first_byte waiting
+    for the response headers once connected and read downloading the body.
+    domain bounds every file fetched from a domain including retries and
+    backing off between them.
+    """
+    connect: float = TIMEOUT
+    first_byte: float = TIMEOUT
+    read: float = TIMEOUT
+    domain: float = DOMAIN_DEADLINE
+
+
+def body_lines(body: bytes) -> Iterator[str]:
+    """Iterate over the non blank lines of a body, with returns stripped."""
+    start = 0
+    # Newlines and returns never turn up inside multibyte utf-8 characters,
+    # so each line can be split out before decoding.
+    while start < len(body):
+        end = body.find(b'\n', start)
+        if end == -1:
+            end = len(body)
+        line = body[start:end].strip(b'\r')
+        if line:
+            yield line.decode('utf-8')
+        start = end + 1
+
+
+class FetchResponse:
+    """Result of fetching a file from a domain.
+
+    Responses can wait a while to be written, so the body is held once as
+    utf-8 bytes and only split into lines as they're iterated with lines().
+    This otherwise behaves like the NamedTuple it replaced, response still
+    gives a tuple of the non blank lines but builds it on every access.
+
+    Either the lines or the body can be given, body wins if both are.
+    """
+    __slots__ = ('domain', 'scraped_at', 'adstxt_present', 'body', 'timings',
+                 'outcome', 'file_type')
+    _fields = ('domain', 'scraped_at', 'adstxt_present', 'response',
+               'timings', 'outcome', 'file_type')
+
+    def __init__(self,
+                 domain: str,
+                 scraped_at: datetime.datetime,
+                 adstxt_present: Optional[bool],
+                 response: Iterable[str] = (),
+                 timings: Optional[Timings] = None,
+                 outcome: Optional[str] = None,
+                 file_type: str = ADS_TXT,
+                 body: Optional[bytes] = None) -> None:
+        self.domain = domain
+        self.scraped_at = scraped_at
+        self.adstxt_present = adstxt_present
+        self.body = (body if body is not None
+                     else '\n'.join(response).encode('utf-8'))
+        self.timings = timings
+        self.outcome = outcome
+        self.file_type = file_type
+
+    def lines(self) -> Iterator[str]:
+        """Iterate over the non blank lines, with returns stripped."""
+        return body_lines(self.body)
+
+    def has_lines(self) -> bool:
+        # Anything other than newlines and returns makes a line.
+        return bool(self.body.strip(b'\r\n'))
+
+    @property
+    def response(self) -> Tuple[str, ...]:
+        return tuple(self.lines())
+
+    def __iter__(self) -> Iterator[Any]:
+        return (getattr(self, field) for field in self._fields)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FetchResponse):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return 'FetchResponse(%s)' % ', '.join(
+            '%s=%r' % (field, getattr(self, field))
+            for field in self._fields)
+
+    def _asdict(self) -> Dict[str, Any]:
+        return collections.OrderedDict(zip(self._fields, self))
+
+    def _replace(self, **changes: Any) -> 'FetchResponse':
+        fields = {field: getattr(self, field) for field in self.__slots__}
+        if 'response' in changes:
+            del fields['body']
+        fields.update(changes)
+        return FetchResponse(**fields)
+
+
+def _current_task() -> asyncio.Task:
+    try:
+        return asyncio.current_task()
+    # Python 3.6.
+    except AttributeError:
+        return asyncio.Task.current_task()
+
+
+class _PhaseTimer:
+    """Time out the phase of an attempt in progress.
+
+    Used as `with timer:` around an attempt, this works like
+    async_timeout.timeout re-armed with the next phase's timeout as the
+    attempt moves on.  Every phase is cut short by the domain's deadline,
+    itself cut short by the end of the crawl cycle.  Which of these ran out
+    is kept in expired.
+
+    Args:
+        timeouts (Timeouts): seconds allowed for each phase and the domain.
+        cycle_deadline (Optional[float]): event loop time the crawl cycle
+            has to be done by.
+    """
+
+    def __init__(self, timeouts: Timeouts,
+                 cycle_deadline: Optional[float] = None) -> None:
+        self.timeouts = timeouts
+        self._loop = get_event_loop()
+        self.deadline = self._loop.time() + timeouts.domain
+        self.deadline_outcome = DEADLINE_EXCEEDED
+        if cycle_deadline is not None and cycle_deadline < self.deadline:
+            self.deadline = cycle_deadline
+            self.deadline_outcome = CYCLE_BUDGET_EXCEEDED
+        self.current = CONNECT
+        self.expired = None  # type: Optional[str]
+        self._task = None  # type: Optional[asyncio.Task]
+        self._handle = None  # type: Optional[asyncio.Handle]
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline."""
+        return self.deadline - self._loop.time()
+
+    def phase(self, name: str) -> None:
+        """Start timing out a phase, replacing the one in progress."""
+        self.current = name
+        if self._task is None:
+            return
+        self._disarm()
+        expires_at = self._loop.time() + getattr(self.timeouts, name)
+        outcome = PHASE_TIMEOUTS[name]
+        if expires_at >= self.deadline:
+            expires_at, outcome = self.deadline, self.deadline_outcome
+        self._handle = self._loop.call_at(expires_at, self._expire, outcome)
+
+    def timed_out(self) -> str:
+        """Outcome of the last attempt timing out.
+
+        Timeouts raised by something other than this timer are put down to
+        the phase in progress.
+        """
+        return self.expired or PHASE_TIMEOUTS[self.current]
 
+    def __enter__(self) -> '_PhaseTimer':
+        self._task = _current_task()
+        self.expired = None
+        self.phase(CONNECT)
+        return self
 
-class FetchResponse(NamedTuple):
-    domain: str
-    scraped_at: datetime.datetime
-    adstxt_present: Optional[bool]
-    response: Tuple[str, ...]
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._disarm()
+        task, self._task = self._task, None
+        if exc_type is CancelledError and self.expired:
+            # Let the task be cancelled again, on Python 3.11 and up.
+            if hasattr(task, 'uncancel'):
+                task.uncancel()
+            raise TimeoutError from None
 
+    def _disarm(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
 
-async def fetch(domain: str, user_agent: str) -> FetchResponse:
+    def _expire(self, outcome: str) -> None:
+        self._handle = None
+        self.expired = outcome
+        if self._task is not None:
+            self._task.cancel()
+
+
+class _RequestTimings(collections.defaultdict):
+    """Seconds spent in each phase, with the timer to move phases on.
+
+    This is what's passed as each request's trace_request_ctx.
+    """
+
+    def __init__(self, timer: Optional[_PhaseTimer] = None) -> None:
+        super().__init__(float)
+        self.timer = timer
+
+
+def _entered(phase: str):
+    async def on_event(session, trace_config_ctx, params):
+        timer = getattr(trace_config_ctx.trace_request_ctx, 'timer', None)
+        if timer is not None:
+            timer.phase(phase)
+    return on_event
+
+
+def _started(key: str):
+    async def on_start(session, trace_config_ctx, params):
+        trace_config_ctx.started[key] = time.monotonic()
+    return on_start
+
+
+def _ended(key: str, phase: str):
+    async def on_end(session, trace_config_ctx, params):
+        started = trace_config_ctx.started.pop(key, None)
+        if started is not None:
+            trace_config_ctx.trace_request_ctx[phase] += (
+                time.monotonic() - started)
+    return on_end
+
+
+async def _on_connection_end(session, trace_config_ctx, params):
+    # Waiting for the first byte starts once we're connected.
+    trace_config_ctx.started['request'] = time.monotonic()
+
+
+def _trace_config() -> TraceConfig:
+    """Time the phases of each request into its trace_request_ctx."""
+    def context(trace_request_ctx):
+        ctx = TraceConfig().trace_config_ctx(trace_request_ctx)
+        ctx.started = {}
+        return ctx
+
+    trace_config = TraceConfig(trace_config_ctx_factory=context)
+    trace_config.on_request_start.append(_started('request'))
+    trace_config.on_dns_resolvehost_start.append(_started('dns'))
+    trace_config.on_dns_resolvehost_end.append(_ended('dns', 'dns'))
+    trace_config.on_connection_create_start.append(_started('connect'))
+    trace_config.on_connection_create_end.append(
+        _ended('connect', 'connect'))
+    trace_config.on_connection_create_end.append(_on_connection_end)
+    # Request end fires once the response headers are in.
+    trace_config.on_request_end.append(_ended('request', 'first_byte'))
+    # Move timeouts on from connecting to waiting for the response, and
+    # back again for each redirect.
+    trace_config.on_connection_create_end.append(_entered(FIRST_BYTE))
+    trace_config.on_connection_reuseconn.append(_entered(FIRST_BYTE))
+    trace_config.on_request_redirect.append(_entered(CONNECT))
+    return trace_config
+
+
+def _semaphore() -> BoundedSemaphore:
+    """Limit concurrent requests on the running event loop."""
+    loop = get_event_loop()
+    semaphore = _SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = _SEMAPHORES[loop] = BoundedSemaphore(
+            value=MAX_CONCURRENT_REQUESTS)
+    return semaphore
+
+
+def _client_session() -> ClientSession:
+    # A single connection per host, so every file fetched from a domain goes
+    # over the same keep-alive connection.
+    return ClientSession(connector=TCPConnector(limit_per_host=1),
+                         trace_configs=[_trace_config()])
+
+
+async def fetch_all(domain: str, user_agent: str,
+                    file_types: Sequence[str] = DEFAULT_FILE_TYPES,
+                    timeouts: Timeouts = Timeouts(),
+                    cycle_deadline: Optional[float] = None) -> List[
+                        FetchResponse]:
+    """Fetch several well known files from a domain over one connection.
+
+    Args
+        domain (str): string domain to fetch.
+        file_types (Sequence[str]): files to fetch, from models.FILE_TYPES.
+        timeouts (Timeouts): timeouts.domain is shared by every file type.
+        cycle_deadline (Optional[float]): event loop time the crawl cycle
+            has to be done by.
+
+    Returns
+        List[FetchResponse]: a response for each file type, in order.
+    """
+    async with _semaphore():
+        # The deadline starts once the domain gets its turn.
+        timer = _PhaseTimer(timeouts, cycle_deadline)
+        async with _client_session() as session:
+            return [await _timed_fetch(session, domain, user_agent,
+                                       file_type, timer)
+                    for file_type in file_types]
+
+
+async def fetch(domain: str,
+                user_agent: str,
+                file_type: str = ADS_TXT,
+                session: Optional[ClientSession] = None,
+                timeouts: Timeouts = Timeouts(),
+                cycle_deadline: Optional[float] = None) -> FetchResponse:
     """Fetch a domain over http, check for validity and return.
 
     Args
         Domain (str): string domain to fetch.
+        file_type (str): which of models.FILE_TYPES to fetch.
+        session (Optional[ClientSession]): session to fetch with, one is
+            opened for just this fetch if not given.
+        timeouts (Timeouts): seconds allowed for each phase and the domain.
+        cycle_deadline (Optional[float]): event loop time the crawl cycle
+            has to be done by.
 
     Returns
-        FetchResponse (NamedTuple): Reponse tuple with all data.
+        FetchResponse (NamedTuple): Reponse tuple with all data, timings
+            holds the seconds spent in each of PHASES.
 
     """
+    if session is None:
+        async with _semaphore():
+            async with _client_session() as session:
+                return await fetch(domain, user_agent, file_type, session,
+                                   timeouts, cycle_deadline)
+
+    return await _timed_fetch(session, domain, user_agent, file_type,
+                              _PhaseTimer(timeouts, cycle_deadline))
+
+
+async def _timed_fetch(session: ClientSession,
+                       domain: str,
+                       user_agent: str,
+                       file_type: str,
+                       timer: _PhaseTimer) -> FetchResponse:
+    timings = _RequestTimings(timer)
+    started = time.monotonic()
+    fetchdata = await _fetch(session, domain, user_agent, file_type, timings)
+    timings['total'] = time.monotonic() - started
+    return fetchdata._replace(timings=dict(timings))
+
+
+async def _fetch(session: ClientSession,
+                 domain: str,
+                 user_agent: str,
+                 file_type: str,
+                 timings: _RequestTimings) -> FetchResponse:
     unprocessable = FetchResponse(domain=domain,
                                   scraped_at=datetime.datetime.utcnow(),
                                   adstxt_present=False,
-                                  response=())
+                                  response=(),
+                                  file_type=file_type)
+    # Reason the latest attempt failed.
+    failure = HTTP_ERROR
 
     # TODO: Discuss making this HTTPS and fallback on HTTP.
-    url = 'http://' + domain + '/ads.txt'
+    url = 'http://' + domain + '/' + file_type
 
     # Don't put anything like a 'scraper' name in here, as people do silly
     # filtering on web pages for bots.  Yes, they even filter pages that
     # are supposed to be accessed by bots. If anything change it to chromes UA.
-    headers = {'User-Agent': user_agent}
+    headers = {'User-Agent': user_agent,
+               # aiohttp decompresses gzipped bodies for us.
+               'Accept-Encoding': 'gzip'}
 
-    async with _SEMAPHORE:
-        async with ClientSession() as session:
-            for attempt in range(5):
+    timer = timings.timer
+    for attempt in range(ATTEMPTS):
+        # Out of time for another attempt, as with running out of attempts
+        # the outcome is why the last one failed.
+        if timer.remaining() <= 0:
+            log.debug('%r ran out of time fetching %s.', domain, file_type)
+            return unprocessable._replace(
+                outcome=failure if attempt else timer.deadline_outcome)
+        try:
+            with timer:
                 try:
-                    async with async_timeout.timeout(TIMEOUT):
-                        try:
-                            async with session.get(
-                                    url, headers=headers) as response:
-                                if response.status == 200:
-                                    text = await response.text()
-                                    break
-                        # Frequently we're seeing redirects that pass through
-                        # invalid certificates on CDN/static servers.  The vast
-                        # majority of these exceptions are due to people having
-                        # a wildcard cert without the root.  Passing through
-                        # www.  subdomain normally resolves these issues.
-                        except exceptions.ClientConnectorCertificateError:
-                            url = 'http://www.' + domain + '/ads.txt'
-                        # This catches a whole bunch of low level things in
-                        # one. Sockets not being open as well as NXDOMAIN
-                        # responses.
-                        except exceptions.ClientConnectorError:
-                            log.debug('Domain not accepting connections.')
-                            return unprocessable
-                        # Remotes disconnect for a whole bunch of reasons.
-                        # Some instances this is retryable.
-                        except exceptions.ServerDisconnectedError:
-                            log.debug('Remote disconnected on us, retrying...')
-                        # Catch the base exception and log the specific reason.
-                        # Mostly here to see if we need to do anything
-                        # different.
-                        except exceptions.ClientError as excpt:
-                            log.warning(
-                                'Caught general exception %r on domain %r.',
-                                excpt, domain)
-                        # TODO: We can do better than just returning
-                        # unprocessable here.  Find the line with the bad
-                        # unicode and work round it?
-                        except UnicodeDecodeError:
-                            log.debug(
-                                'Invalid unicode found on %r, skipping.',
-                                domain)
-                            return unprocessable
-                except TimeoutError:
-                    log.debug('Fetch timeout, backing off and retrying.')
-                    await sleep(attempt ** 2)
-            # No break was caused, return unprocessable.
+                    async with session.get(
+                            url, headers=headers,
+                            trace_request_ctx=timings) as response:
+                        timer.phase(READ)
+                        if response.status == 200:
+                            body_started = time.monotonic()
+                            text = await response.text()
+                            timings['body'] += (time.monotonic() -
+                                                body_started)
+                            break
+                        failure = HTTP_ERROR
+                        # Read the error page so the connection is kept
+                        # alive for the next file.
+                        await response.read()
+                # Frequently we're seeing redirects that pass through
+                # invalid certificates on CDN/static servers.  The vast
+                # majority of these exceptions are due to people having
+                # a wildcard cert without the root.  Passing through
+                # www.  subdomain normally resolves these issues.
+                except exceptions.ClientConnectorCertificateError:
+                    url = 'http://www.' + domain + '/' + file_type
+                # This catches a whole bunch of low level things in
+                # one. Sockets not being open as well as NXDOMAIN
+                # responses.
+                except exceptions.ClientConnectorError:
+                    log.debug('Domain not accepting connections.')
+                    return unprocessable._replace(
+                        outcome=CONNECT_ERROR)
+                # Remotes disconnect for a whole bunch of reasons.
+                # Some instances this is retryable.
+                except exceptions.ServerDisconnectedError:
+                    log.debug('Remote disconnected on us, retrying...')
+                    failure = DISCONNECTED
+                # Catch the base exception and log the specific reason.
+                # Mostly here to see if we need to do anything
+                # different.
+                except exceptions.ClientError as excpt:
+                    log.warning(
+                        'Caught general exception %r on domain %r.',
+                        excpt, domain)
+                    failure = CLIENT_ERROR
+                # TODO: We can do better than just returning
+                # unprocessable here.  Find the line with the bad
+                # unicode and work round it?
+                except UnicodeDecodeError:
+                    log.debug(
+                        'Invalid unicode found on %r, skipping.',
+                        domain)
+                    return unprocessable._replace(
+                        outcome=UNICODE_ERROR)
+        except TimeoutError:
+            failure = timer.timed_out()
+            if attempt + 1 < ATTEMPTS:
+                log.debug('Fetch %s, backing off and retrying.', failure)
+                # Backing off never goes past the deadline.
+                await sleep(max(min(attempt ** 2, timer.remaining()), 0))
+    # No break was caused, return unprocessable.
+    else:
+        log.debug(
+            'Unable to fetch for %s due to max attempts reached.',
+            domain)
+        return unprocessable._replace(outcome=failure)
+
+    # Check to see if we're still on the right domain.
+    if len(response.history) != 0:
+        log.debug(
+            '%r domain used a redirect, validating this.', domain)
+        # tldextract is slow to import and only needed for redirects.
+        import tldextract
+        root_domain = tldextract.extract(domain).domain
+        log.debug('root domain found to be %r.', root_domain)
+        # Get the destination domain of the final location.
+        destination_location = tldextract.extract(
+            response.history[-1].url.host).domain
+        #  Multiple redirects are valid as long as each redirect
+        # location remains within the original root domain.  Check to
+        # see if where we are redirected to is the same domain as the
+        # fetched domain.
+        if root_domain != destination_location:
+            # Domain is found to not be the same as the one we tried
+            # (or www redirects which we ignore).
+            log.info('%r uses an off domain redirect %r',
+                     domain, destination_location)
+            # We only allow 1 hop when going off domain.  Get the last
+            # but one redirect and check to see if it's on the same
+            # domain.
+            redirection_domain = tldextract.extract(
+                response.history[-2].url.host).domain
+            if root_domain != redirection_domain:
+                log.info(
+                    '%r uses an invalid off domain redirect to %r',
+                    domain, destination_location)
+                return unprocessable._replace(outcome=BAD_REDIRECT)
             else:
-                log.debug(
-                    'Unable to fetch for %s due to max attempts reached.',
-                    domain)
-                return unprocessable
-
-            # Check to see if we're still on the right domain.
-            if len(response.history) != 0:
-                log.debug(
-                    '%r domain used a redirect, validating this.', domain)
-                root_domain = tldextract.extract(domain).domain
-                log.debug('root domain found to be %r.', root_domain)
-                # Get the destination domain of the final location.
-                destination_location = tldextract.extract(
-                    response.history[-1].url.host).domain
-                #  Multiple redirects are valid as long as each redirect
-                # location remains within the original root domain.  Check to
-                # see if where we are redirected to is the same domain as the
-                # fetched domain.
-                if root_domain != destination_location:
-                    # Domain is found to not be the same as the one we tried
-                    # (or www redirects which we ignore).
-                    log.info('%r uses an off domain redirect %r',
-                             domain, destination_location)
-                    # We only allow 1 hop when going off domain.  Get the last
-                    # but one redirect and check to see if it's on the same
-                    # domain.
-                    redirection_domain = tldextract.extract(
-                        response.history[-2].url.host).domain
-                    if root_domain != redirection_domain:
-                        log.info(
-                            '%r uses an invalid off domain redirect to %r',
-                            domain, destination_location)
-                        return unprocessable
-                    else:
-                        log.info('%r off domain redirect valid.', domain)
-                else:
-                    log.debug('%r uses on domain redirect.', domain)
-
-        # If the content type of the response isn't text, return unprocessable.
-        if 'text/plain' not in response.headers.get('Content-Type', ''):
-            return unprocessable
+                log.info('%r off domain redirect valid.', domain)
+        else:
+            log.debug('%r uses on domain redirect.', domain)
+
+    # If the content type of the response isn't text, return unprocessable.
+    if 'text/plain' not in response.headers.get('Content-Type', ''):
+        return unprocessable._replace(outcome=BAD_CONTENT_TYPE)
 
     # If we're getting a HTML page back then somethings fuckity.
     # We do this because sometimes 404 pages and the like don't have
@@ -143,14 +551,12 @@ async def fetch(domain: str, user_agent: str) -> FetchResponse:
         if element in text:
             log.debug(
                 'HTML elements found in %r domains adstxt.', domain)
-            return unprocessable
-
-    # Normalise to a tuple, split on new line and strip returns.
-    response = tuple(x.strip('\r') for x
-                     in text.split('\n')
-                     if x.strip('\r'))
+            return unprocessable._replace(outcome=HTML_CONTENT)
 
+    # Keep the body as it came, it's split into lines as it's processed.
     return FetchResponse(domain=domain,
                          scraped_at=datetime.datetime.utcnow(),
                          adstxt_present=True,
-                         response=response)
+                         body=text.encode('utf-8'),
+                         outcome=OK,
+                         file_type=file_type)
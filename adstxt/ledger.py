@@ -0,0 +1,107 @@
+import collections
+import datetime
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+import adstxt.events as events
+import adstxt.models as models
+
+
+LOG = logging.getLogger(__name__)
+
+
+class RunStats:
+    """Statistics for a single crawl cycle.
+
+    Fetch outcomes are counted from the event loop while writes are counted
+    from the writer thread, so updates are made under a lock.
+
+    Args:
+        crawler_tag (Optional[str]): tag of the crawler doing the run.
+    """
+
+    def __init__(self, crawler_tag: Optional[str] = None) -> None:
+        self.crawler_tag = crawler_tag
+        self.started_at = datetime.datetime.utcnow()
+        self._started = time.monotonic()
+        self.domains = 0
+        self.written = 0
+        self.outcomes = collections.Counter()  # type: collections.Counter
+        self.records_added = 0
+        self.records_removed = 0
+        self.queue_high_water = 0
+        self.parse_cache_hits = 0
+        self.parse_cache_misses = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Stats are sent back from crawler processes, without the lock.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def merge(self, other: 'RunStats') -> None:
+        """Add in the statistics of another part of the same run."""
+        with self._lock:
+            self.domains += other.domains
+            self.written += other.written
+            self.outcomes.update(other.outcomes)
+            self.records_added += other.records_added
+            self.records_removed += other.records_removed
+            self.queue_high_water = max(self.queue_high_water,
+                                        other.queue_high_water)
+            self.parse_cache_hits += other.parse_cache_hits
+            self.parse_cache_misses += other.parse_cache_misses
+
+    def dispatched(self, count: int) -> None:
+        with self._lock:
+            self.domains += count
+
+    def fetched(self, outcome: Optional[str]) -> None:
+        with self._lock:
+            self.outcomes[outcome or 'unknown'] += 1
+
+    def queued(self, size: int) -> None:
+        with self._lock:
+            self.queue_high_water = max(self.queue_high_water, size)
+
+    def parsed(self, cached: bool) -> None:
+        with self._lock:
+            if cached:
+                self.parse_cache_hits += 1
+            else:
+                self.parse_cache_misses += 1
+
+    def persisted(self, change_events: Iterable[events.ChangeEvent]) -> None:
+        with self._lock:
+            self.written += 1
+            for event in change_events:
+                if event.event in (events.INSERT, events.REACTIVATE):
+                    self.records_added += 1
+                elif event.event == events.DEACTIVATE:
+                    self.records_removed += 1
+
+    def finish(self) -> models.CrawlRun:
+        """Build the ledger row for the run."""
+        elapsed = time.monotonic() - self._started
+        with self._lock:
+            return models.CrawlRun(
+                crawler_tag=self.crawler_tag,
+                started_at=self.started_at,
+                finished_at=datetime.datetime.utcnow(),
+                domains=self.domains,
+                written=self.written,
+                outcomes=json.dumps(dict(self.outcomes), sort_keys=True),
+                records_added=self.records_added,
+                records_removed=self.records_removed,
+                queue_high_water=self.queue_high_water,
+                parse_cache_hits=self.parse_cache_hits,
+                parse_cache_misses=self.parse_cache_misses,
+                domains_per_second=self.written / elapsed if elapsed else 0.0)
@@ -1,26 +1,102 @@
 import asyncio
+import collections
+import concurrent.futures
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import datetime
+import hashlib
+import itertools
 import json
 import logging
+import multiprocessing
 import queue
+import random
+import signal
+import sys
 import threading
 import time
-from typing import List
+from typing import (
+    Any, Dict, IO, Iterable, List, Mapping, Optional, Set, Tuple)
 
-from elasticsearch import Elasticsearch
-
-from sqlalchemy import create_engine
-from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+from sqlalchemy import bindparam, create_engine, or_
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
-import validators
 
+import adstxt.aggregates as aggregates
+import adstxt.coldstore as coldstore
+import adstxt.events as events
 import adstxt.fetch as fetch
+import adstxt.ledger as ledger
 import adstxt.models as models
+import adstxt.scheduler as scheduler
+import adstxt.sqlite as sqlite
 import adstxt.transform as transform
+import adstxt.validate as validate
+from adstxt.archive import BlobArchive
+from adstxt.cache import LRUCache
+from adstxt.checkpoint import Checkpoint
+from adstxt.ndjson import RotatingWriter, dumps
+from adstxt.spool import Spool, decode, encode_payload
 
 
 LOG = logging.getLogger(__name__)
 
+# Continuous crawling limits how many domains are in flight at once, so load
+# stays smooth rather than everything due being started at once.
+MAX_IN_FLIGHT = 2 * fetch.MAX_CONCURRENT_REQUESTS
+# Seconds between handing due domains to the fetchers.
+DISPATCH_INTERVAL = 1
+# Seconds between merging in new domains from the domain source.
+SOURCE_REFRESH_INTERVAL = 900
+# Seconds between logging how fresh crawls are.
+FRESHNESS_REPORT_INTERVAL = 60
+# Seconds between attempts to write a spooled response while the database is
+# unavailable, doubling up to the maximum.
+DB_RETRY_INTERVAL = 1
+DB_RETRY_MAX_INTERVAL = 60
+# Number of domains fetched at once when streaming or running a batch, each
+# worker pulls the next domain as soon as it's done rather than everything
+# being started up front.
+STREAM_WORKERS = fetch.MAX_CONCURRENT_REQUESTS
+# Domains taking at least this many seconds to fetch are always traced,
+# whatever the sample rate.
+SLOW_TRACE_SECONDS = 10
+TRACE_PHASES = ('dns', 'connect', 'first_byte', 'body', 'parse', 'commit',
+                'total')
+# Number of threads writing archived bodies back to the database on replay.
+REPLAY_WORKERS = 8
+# Distinct bodies kept parsed.  Publisher networks serve the same ads.txt from
+# hundreds of domains, each body is only parsed again once it's dropped.
+PARSE_CACHE_SIZE = 4096
+# Bodies at least this many bytes are parsed in the parse processes, when
+# there are any, rather than holding the GIL in the writer.  Smaller ones
+# parse quicker than they can be sent over.
+PARSE_PROCESS_MIN_BYTES = 64 * 1024
+# Seconds between checking the aggregate tables against records.
+AGGREGATE_VERIFY_INTERVAL = 24 * 60 * 60
+# Seconds between reloading the invalid domain cache, dropping verdicts
+# which have expired.
+INVALID_DOMAIN_RELOAD_INTERVAL = 24 * 60 * 60
+# Seconds between passes archiving long inactive records.
+RECORD_ARCHIVE_INTERVAL = 60 * 60
+# Fetched responses waiting for a writer process, fetcher processes wait
+# once this many are queued.
+PROCESS_QUEUE_SIZE = 10 * fetch.MAX_CONCURRENT_REQUESTS
+# Seconds between checking on fetcher and writer processes.
+PROCESS_POLL_INTERVAL = 1
+# Seconds to wait for a finished process's statistics.
+PROCESS_REPORT_TIMEOUT = 10
+PROCESS_LOG_FORMAT = ('%(asctime)s - %(processName)s - %(name)s - '
+                      '%(levelname)s - %(message)s')
+
+# Domain column recording whether each file type was found.
+PRESENT_COLUMNS = {models.ADS_TXT: 'adstxt_present',
+                   models.APP_ADS_TXT: 'app_adstxt_present'}
+
+# Records are identified within a domain by (supplier_id, pub_id,
+# supplier_relationship).
+RecordKey = Tuple[int, str, str]
+
 
 class AdsTxtCrawler:
 
@@ -32,18 +108,96 @@ class AdsTxtCrawler:
                  es_query=None,
                  es_index=None,
                  file_uri=None,
-                 crawler_id=None):
+                 crawler_id=None,
+                 events_path=None,
+                 checkpoint_path=None,
+                 spool_path=None,
+                 stream_path=None,
+                 trace_sample_rate=0.0,
+                 file_types=fetch.DEFAULT_FILE_TYPES,
+                 archive_path=None,
+                 archive_records_after_days=None,
+                 timeouts=fetch.Timeouts(),
+                 cycle_budget=None,
+                 fetcher_processes=0,
+                 writer_processes=0,
+                 parse_processes=0,
+                 sqlite_tuned=False):
         self.es = es
         self.file = file
         self.db_uri = db_uri
+        # Run SQLite databases in files with WAL and a larger cache.
+        self.sqlite_tuned = sqlite_tuned
         self.es_uri = es_uri
         self.es_query = es_query
         self.es_index = es_index
         self.file_uri = file_uri
         self.crawler_id = crawler_id
+        self.trace_sample_rate = trace_sample_rate
+        self.file_types = tuple(file_types)
+        self.timeouts = timeouts
+        # Seconds each crawl cycle gets, domains not done in time are left
+        # for the next cycle.
+        self.cycle_budget = cycle_budget
+        # With either set, cycles are fetched and written by processes of
+        # their own.
+        self.fetcher_processes = fetcher_processes
+        self.writer_processes = writer_processes
+        # What crawlers in those processes need to fetch and write the same
+        # way as this one.
+        self._process_settings = {
+            'db_uri': db_uri,
+            'crawler_id': crawler_id,
+            'trace_sample_rate': trace_sample_rate,
+            'file_types': self.file_types,
+            'archive_path': archive_path,
+            'timeouts': timeouts,
+            'sqlite_tuned': sqlite_tuned}
+        self._events_path = events_path
+        self.parse_processes = parse_processes
+        # Started when the first large body is parsed.
+        self._parse_pool = None  # type: Optional[Executor]
+        self._parse_pool_lock = threading.Lock()
+        # Records inactive for longer than this are moved to the archive.
+        self.archive_records_after = (
+            datetime.timedelta(days=archive_records_after_days)
+            if archive_records_after_days else None)
         self._session = sessionmaker()
         self._testing = False
-        self.es = Elasticsearch(self.es_uri)
+        self._invalid_domains = set()  # type: Set[str]
+        self._invalid_domains_loaded_at = None  # type: Optional[float]
+        # Weight of each domain given one by the domain source when it was
+        # last read.
+        self._weights = {}  # type: Dict[str, int]
+        self._supplier_ids = {}  # type: Dict[Tuple[str, str], int]
+        self._suppliers = {}  # type: Dict[int, Tuple[str, str]]
+        # Parsed bodies keyed on their sha256.
+        self._parse_cache = LRUCache(PARSE_CACHE_SIZE)
+        # supplier_counts rows known to exist.
+        self._supplier_count_keys = set()  # type: Set[aggregates.SupplierKey]
+        self._aggregates_verified_at = None  # type: Optional[float]
+        self._event_sink = (events.NDJSONEventSink(events_path)
+                            if events_path else None)
+        self._checkpoint = (Checkpoint(checkpoint_path)
+                            if checkpoint_path else None)
+        self._spool = Spool(spool_path) if spool_path else None
+        self._archive = BlobArchive(archive_path) if archive_path else None
+        # Statistics of the crawl cycle in progress.
+        self._run_stats = None  # type: Optional[ledger.RunStats]
+        self._stream = (RotatingWriter(stream_path, 'crawl')
+                        if stream_path else None)
+        self._stop = threading.Event()
+        self._es_client = None
+
+    @property
+    def es_client(self):
+        """Elasticsearch client, created the first time it's used."""
+        if self._es_client is None:
+            # Only crawls reading domains from elasticsearch pay for the
+            # import.
+            from elasticsearch import Elasticsearch
+            self._es_client = Elasticsearch(self.es_uri)
+        return self._es_client
 
     def _get_engine(self):
         if 'mysql+pymysql' in self.db_uri:
@@ -54,7 +208,13 @@ class AdsTxtCrawler:
             return create_engine(self.db_uri,
                                  pool_size=40,
                                  connect_args=connect_args)
+        elif self.sqlite_tuned and sqlite.is_file(self.db_uri):
+            LOG.info('Using local sqlite with %s.', ', '.join(sqlite.PRAGMAS))
+            return sqlite.tuned_engine(self.db_uri)
         else:
+            if self.sqlite_tuned:
+                LOG.warning('Only SQLite databases in files can be tuned, '
+                            'using defaults.')
             LOG.info('Using local sqllite.')
             connect_args = {}
             return create_engine(self.db_uri,
@@ -75,23 +235,100 @@ class AdsTxtCrawler:
         LOG.debug('Built database.')
         # Share our root session object.
         self._session = session
+        self._load_invalid_domains()
 
-    def _last_updated_at(self, domain: str) -> datetime.datetime:
+    def _load_invalid_domains(self) -> None:
+        """Warm the in memory cache of known invalid domains.
+
+        Verdicts from an older validate.VERSION or past validate.VERDICT_TTL
+        are deleted first, so those domains are validated again.  Verdicts
+        from a newer version are left for the crawlers that wrote them.
+        """
+        expired_before = datetime.datetime.utcnow() - validate.VERDICT_TTL
         session = self._session()
+        try:
+            expired = session.query(models.InvalidDomain).filter(or_(
+                models.InvalidDomain.validator_version.is_(None),
+                models.InvalidDomain.validator_version < validate.VERSION,
+                models.InvalidDomain.first_seen.is_(None),
+                models.InvalidDomain.first_seen < expired_before)).delete(
+                    synchronize_session=False)
+            session.commit()
+            self._invalid_domains = {
+                name for name, in session.query(
+                    models.InvalidDomain.name).filter(
+                        models.InvalidDomain.validator_version ==
+                        validate.VERSION)}
+        finally:
+            session.close()
+        self._invalid_domains_loaded_at = time.monotonic()
+        LOG.debug('Loaded %d known invalid domains, %d expired.',
+                  len(self._invalid_domains), expired)
 
-        # Check to see if the domain is present in the domains table.
-        db_domain = session.query(
-            models.Domain).filter_by(name=domain).first()
+    def _reload_invalid_domains(self) -> None:
+        """Reload the invalid domain cache once a day, expiring verdicts."""
+        if (self._invalid_domains_loaded_at is not None and
+                time.monotonic() - self._invalid_domains_loaded_at <
+                INVALID_DOMAIN_RELOAD_INTERVAL):
+            return
+        self._load_invalid_domains()
 
-        if not db_domain:
-            # Write it with a min time so we update it this first session.
-            db_domain = models.Domain(name=domain,
-                                      last_updated=datetime.datetime.min)
-            session.add(db_domain)
+    def _mark_invalid(self, domains: Iterable[str]) -> None:
+        """Persist newly found invalid domains to the verdict cache."""
+        now = datetime.datetime.utcnow()
+        # Anything longer than a domain column is cheap to reject on length
+        # alone, so there's no point caching it.
+        new = [domain for domain in set(domains)
+               if domain not in self._invalid_domains and
+               len(domain) <= validate.MAX_DOMAIN_LENGTH]
+        if not new:
+            return
+
+        self._invalid_domains.update(new)
+        insert = models.InvalidDomain.__table__.insert()
+        session = self._session()
+        try:
+            session.execute(insert, [{'name': domain, 'first_seen': now,
+                                      'validator_version': validate.VERSION}
+                                     for domain in new])
             session.commit()
+        # Some of these are already cached, either another crawler got there
+        # first or two spellings collide under the databases collation.
+        # Fall back to inserting one at a time so the rest still persist.
+        except IntegrityError:
+            session.rollback()
+            for domain in new:
+                try:
+                    session.execute(insert, {
+                        'name': domain, 'first_seen': now,
+                        'validator_version': validate.VERSION})
+                    session.commit()
+                except IntegrityError:
+                    LOG.debug('%r already cached as invalid.', domain)
+                    session.rollback()
+        finally:
+            session.close()
+
+    def _last_updated_at(self, domain: str) -> datetime.datetime:
+        session = self._session()
+        try:
+            # Check to see if the domain is present in the domains table.
+            db_domain = session.query(
+                models.Domain).filter_by(name=domain).first()
+
+            if not db_domain:
+                # Write it with a min time so we update it this first
+                # session.
+                db_domain = models.Domain(name=domain,
+                                          last_updated=datetime.datetime.min)
+                session.add(db_domain)
+                session.commit()
 
-        # Return last updated at time.
-        return db_domain.last_updated
+            # Return last updated at time.
+            return db_domain.last_updated
+        # Hand the connection back, pooled connections are limited.
+        finally:
+            session.close()
 
     def _check_viability(self, domain: str) -> bool:
         """Check to see if a domain is viable to be crawled.
@@ -108,19 +345,23 @@ class AdsTxtCrawler:
                   Falsy if the domain has already been scanned or
                   does not pass validation.
         """
-        if not validators.domain(domain):
+        if (domain in self._invalid_domains or
+                not validate.is_valid(validate.normalise(domain) or '')):
             LOG.info('%r found to be an invalid domain.', domain)
+            self._mark_invalid([domain])
             return False
 
+        return self._is_due(domain)
+
+    def _is_due(self, domain: str) -> bool:
+        """Check to see if a valid domain hasn't been crawled recently."""
         # Check to see if the domain is present in the domains table.
         last_updated = self._last_updated_at(domain)
 
         # Check to see when we last updated the domains data.
         # If the last updated time was greater than an six hours ago, check.
-        # TODO: We should get the cache control headers back off the page
-        # and use that instead.  Set as 6 hours for the moment.
         if (datetime.datetime.utcnow() -
-                last_updated < datetime.timedelta(minutes=360)):
+                last_updated < scheduler.RECRAWL_INTERVAL):
             # Skip to next domain as this ones got new data.
             LOG.debug('Skipping %r domain due to recent update at %r',
                       domain, last_updated)
@@ -128,34 +369,116 @@ class AdsTxtCrawler:
 
         return True
 
-    def process_domain(self, fetchdata: fetch.FetchResponse) -> None:
+    def process_domain(
+            self, fetchdata: fetch.FetchResponse) -> List[events.ChangeEvent]:
         """Process a domains FetchResponse into inserted records and variables.
 
         Pipeline roughly goes as follows.
         1. Check FetchResponse data is valid, if not update scraped_at
             and return.  If it is valid, update the db_domain details we have.
-        2. Iterate through response tuple, checking what's currently in the
-            database so we don't insert duplicate records.
-        3. Try to commit
+        2. Transform the response tuple, resolving each records supplier to
+            its id through the in process supplier cache.
+        3. Compare against what's currently in the database so we don't
+            insert duplicate records, deactivating anything no longer listed.
+        4. Try to commit
         Args:
             fetchdata (FetchResponse): Named tuple of fetch data.
 
         Returns:
-            None
+            List[ChangeEvent]: changes made to the domains records.
         """
+        timings = dict(fetchdata.timings or {})
         # Setup a new SQL session.
         session = self._session(bind=self.engine)
+        try:
+            change_events = self._persist(session, fetchdata, timings)
+        finally:
+            session.close()
+
+        if self._event_sink and change_events:
+            self._event_sink.emit(change_events)
+
+        if self._run_stats:
+            self._run_stats.persisted(change_events)
+
+        if self._should_trace(timings):
+            self._record_trace(fetchdata, timings)
+
+        return change_events
+
+    def _should_trace(self, timings: fetch.Timings) -> bool:
+        # Slow domains are always kept, they're what traces are for.
+        if timings.get('total', 0) >= SLOW_TRACE_SECONDS:
+            return True
+        return random.random() < self.trace_sample_rate
+
+    def _record_trace(self, fetchdata: fetch.FetchResponse,
+                      timings: fetch.Timings) -> None:
+        session = self._session()
+        try:
+            session.add(models.CrawlTrace(
+                domain=fetchdata.domain,
+                traced_at=fetchdata.scraped_at,
+                file_type=fetchdata.file_type,
+                adstxt_present=fetchdata.adstxt_present,
+                **{phase: timings.get(phase) for phase in TRACE_PHASES}))
+            session.commit()
+        # Traces are nice to have, never lose a domain over one.
+        except SQLAlchemyError:
+            LOG.exception('Unable to record trace for %r.', fetchdata.domain)
+        finally:
+            session.close()
+
+    def _write(
+            self, fetchdata: fetch.FetchResponse) -> List[events.ChangeEvent]:
+        """Process a domain, waiting out database outages when spooling.
+
+        With a spool the response is safe on disk, so rather than dropping
+        it we keep retrying until the database is back.  Fetching carries on
+        into the spool meanwhile.  Bodies are archived first when there's an
+        archive.
+        """
+        if self._archive:
+            try:
+                self._archive.put(fetchdata)
+            # The archive is for replays later on, don't lose the write now.
+            except OSError:
+                LOG.exception('Unable to archive %r.', fetchdata.domain)
+
+        delay = DB_RETRY_INTERVAL
+        while True:
+            try:
+                return self.process_domain(fetchdata)
+            except OperationalError:
+                if not self._spool or self._stop.is_set():
+                    raise
+                LOG.warning('Database unavailable writing %r, retrying in '
+                            '%ss.', fetchdata.domain, delay)
+                self._stop.wait(delay)
+                delay = min(delay * 2, DB_RETRY_MAX_INTERVAL)
 
+    def _persist(self, session,
+                 fetchdata: fetch.FetchResponse,
+                 timings: fetch.Timings) -> List[events.ChangeEvent]:
+        """Write a domains FetchResponse in the given session.
+
+        Time spent parsing and committing is added to timings.
+
+        Returns:
+            List[ChangeEvent]: changes committed.
+        """
         # Fetch domain from database. This should always exist and will
         # raise an sqlalchemy.orm.exc.NoResultFound if nothing is found.
         db_domain = session.query(
             models.Domain).filter_by(name=fetchdata.domain).one()
 
-        LOG.debug('Processing fetchdata for %r', fetchdata.domain)
+        LOG.debug('Processing %s fetchdata for %r', fetchdata.file_type,
+                  fetchdata.domain)
         LOG.debug('Using %r as db_domain.', db_domain)
+        present_column = PRESENT_COLUMNS[fetchdata.file_type]
 
         # If we've got bad data from an endpoint, log this and return.
-        if not fetchdata.response or not fetchdata.adstxt_present:
+        if not fetchdata.has_lines() or not fetchdata.adstxt_present:
             # TODO: Passback more debug data on failure from fetches.
             LOG.debug('Bad AdsTxt file found, updating TTLs and returning.')
             # Update the last updated at row so we don't try and
@@ -163,127 +486,372 @@ class AdsTxtCrawler:
             db_domain.last_updated = fetchdata.scraped_at
             # This is set to null at creation, explicitly set to False as we
             # know that there is not one now.
-            db_domain.adstxt_present = False
+            setattr(db_domain, present_column, False)
             session.add(db_domain)
+            commit_started = time.monotonic()
             session.commit()
-            return
-        # Else we've got a valid record from Fetch.  Update the db_domain
+            timings['commit'] = time.monotonic() - commit_started
+            return []
+
+        # Transform the rows and resolve their suppliers before we write
+        # anything in this session.  Suppliers are written in their own short
+        # transactions which mustn't wait on this one.
+        parse_started = time.monotonic()
+        processed_records, processed_variables = self._parse_response(
+            fetchdata)
+        timings['parse'] = time.monotonic() - parse_started
+        self._ensure_supplier_counts(
+            (self._suppliers[supplier_id][0], relationship,
+             fetchdata.file_type)
+            for supplier_id, _, relationship in processed_records)
+
+        # We've got a valid record from Fetch.  Update the db_domain
         # details we hold locally but don't commit until the end.
-        else:
-            db_domain.last_updated = fetchdata.scraped_at
-            db_domain.adstxt_present = True
-            session.add(db_domain)
+        db_domain.last_updated = fetchdata.scraped_at
+        setattr(db_domain, present_column, True)
+        session.add(db_domain)
 
-        # We want to look back and verify that all of these exist.
-        processed_records = []
-        for row in fetchdata.response:
-            # Transform the rows and add them to a list to validate against.
-            processed_row = transform.process_row(row)
+        # Load what we already hold for the domain in one go, keyed on
+        # integer ids so checking each processed row is a dict lookup.
+        # Each file type is kept apart, so only rows from this file count.
+        existing_records = {
+            (record.supplier_id, record.pub_id,
+             record.supplier_relationship): record
+            for record in session.query(models.Record).filter_by(
+                domain_id=db_domain.id, file_type=fetchdata.file_type)}
+        # Records are (de)activated in place, so note which were active.
+        active_before = [key for key, record in existing_records.items()
+                         if record.active]
+        # Archived records which are listed again come back to be
+        # reactivated.
+        existing_records.update(coldstore.restore(
+            session, db_domain.id, fetchdata.file_type,
+            {key for key in processed_records if key not in existing_records}))
+        existing_variables = {
+            variable.key: variable
+            for variable in session.query(models.Variable).filter_by(
+                domain_id=db_domain.id, file_type=fetchdata.file_type)}
 
-            # Check to see what the row is returning and process.
-            if isinstance(processed_row, transform.AdsRecord):
+        # Keep track of every change made so it can go in the change feed.
+        changes = []  # type: List[Tuple[str, Any]]
 
-                # Keep a list of records to compare back with.
-                processed_records.append(processed_row)
+        for key in processed_records:
+            record_exists = existing_records.get(key)
 
-                # Check for presence of record in existing Record table.
-                # If if does then skip to the next record.
-                try:
-                    record_exists = session.query(
-                        models.Record).filter_by(
-                            domain=db_domain,
-                            supplier_domain=processed_row.supplier_domain,
-                            pub_id=processed_row.pub_id,
-                            supplier_relationship=processed_row.supplier_relationship,
-                            cert_authority=processed_row.cert_authority
-                    ).one_or_none()
-
-                # Something in the query was bad. Skip to the next record.
-                except SQLAlchemyError as excpt:
-                    LOG.exception('Unprocessible row. %r is bad due to %r',
-                                  processed_row, excpt)
-                    continue
+            # If the record isn't present insert with fetchdata.
+            if not record_exists:
+                supplier_id, pub_id, supplier_relationship = key
+                db_record = models.Record(
+                    domain_id=db_domain.id,
+                    supplier_id=supplier_id,
+                    pub_id=pub_id,
+                    supplier_relationship=supplier_relationship,
+                    file_type=fetchdata.file_type,
+                    first_seen=fetchdata.scraped_at,
+                    active=True)
+                LOG.debug('Adding new record to database, %r', db_record)
+                session.add(db_record)
+                changes.append((events.INSERT, db_record))
+            # If the record does exist check to ensure it's active.
+            elif not record_exists.active:
+                # It's not active so reactivate the record.
+                record_exists.active = True
+                record_exists.deactivated_at = None
+                changes.append((events.REACTIVATE, record_exists))
+                LOG.debug('Record was found to be inactive, reactivating...')
 
-                # If the record isn't present insert with fetchdata.
-                if not record_exists:
-                    db_record = models.Record(
-                        domain_id=db_domain.id,
-                        supplier_domain=processed_row.supplier_domain,
-                        pub_id=processed_row.pub_id,
-                        supplier_relationship=processed_row.supplier_relationship,
-                        cert_authority=processed_row.cert_authority,
-                        first_seen=fetchdata.scraped_at,
-                        active=True)
-                    LOG.debug('Adding new record to database, %r', db_record)
-                    try:
-                        session.add(db_record)
-                    except DBAPIError:
-                        LOG.error('Unable to insert... %r', db_record)
-                # If the record does exist check to ensure it's active.
-                else:
-                    # It's not active so reactivate the record.
-                    if not record_exists.active:
-                        record_exists.active = True
-                        session.commit()
-                        LOG.debug(
-                            'Record was found to be inactive, reactivating...')
-
-            elif isinstance(processed_row, transform.AdsVariable):
-                # Check for presence of variable in Variable table.
-                # If it does then skip to next record.
-                variable_exists = session.query(
-                    models.Variable).filter_by(
-                        domain=db_domain,
-                        key=processed_row.key).first()
-
-                if not variable_exists:
-                    LOG.debug('New variable %r inserted for %r',
-                              db_domain.name, processed_row.key)
-                    db_variable = models.Variable(
-                        domain_id=db_domain.id,
-                        key=processed_row.key,
-                        value=processed_row.value)
-                    session.add(db_variable)
-                elif variable_exists.value != processed_row.value:
-                    LOG.debug('Key %r for %r has been updated.',
-                              variable_exists.key, db_domain.name)
-                    variable_exists.value = processed_row.value
-                    session.add(variable_exists)
-                else:
-                    # Check is there and is up to date.
-                    continue
-            # Else it's nil, skip to next record.
-            else:
-                continue
+        for key, value in processed_variables.items():
+            variable_exists = existing_variables.get(key)
 
-        # Validate that evereything in the records table is also in our list
-        # of processed rows.  Run through the record table then variables.
-        active_records = session.query(
-            models.Record.supplier_domain,
-            models.Record.pub_id,
-            models.Record.supplier_relationship,
-            models.Record.cert_authority).filter_by(
-                domain_id=db_domain.id, active=True).all()
-
-        # Find what's in active_records but is not in processed_records.
-        active_records_not_seen = set(active_records).difference(
-            set(processed_records))
-        # Set all of these records as inactive.
-        for record in active_records_not_seen:
-            LOG.debug('%r was found to be inactive.', record)
-            session.query(
-                models.Record).filter_by(
+            if not variable_exists:
+                LOG.debug('New variable %r inserted for %r',
+                          db_domain.name, key)
+                db_variable = models.Variable(
                     domain_id=db_domain.id,
-                    supplier_domain=record.supplier_domain,
-                    pub_id=record.pub_id,
-                    supplier_relationship=record.supplier_relationship,
-                    cert_authority=record.cert_authority).one().active = False
+                    key=key,
+                    value=value,
+                    file_type=fetchdata.file_type)
+                session.add(db_variable)
+                changes.append((events.VARIABLE_INSERT, db_variable))
+            elif variable_exists.value != value:
+                LOG.debug('Key %r for %r has been updated.',
+                          variable_exists.key, db_domain.name)
+                variable_exists.value = value
+                changes.append((events.VARIABLE_UPDATE, variable_exists))
+
+        # Validate that everything active in the records table is also in our
+        # processed rows, set anything we didn't see as inactive.
+        for key, record in existing_records.items():
+            if record.active and key not in processed_records:
+                LOG.debug('%r was found to be inactive.', record)
+                record.active = False
+                record.deactivated_at = fetchdata.scraped_at
+                changes.append((events.DEACTIVATE, record))
+
+        if any(event in (events.INSERT, events.REACTIVATE, events.DEACTIVATE)
+               for event, _ in changes):
+            aggregates.apply(session, db_domain.id, fetchdata.file_type,
+                             self._authorisations(session, active_before),
+                             self._authorisations(session, processed_records))
+
+        change_events = self._record_changes(
+            session, db_domain, changes, fetchdata.scraped_at)
 
         # Domain is completely processed at this point.  Commit all records.
+        commit_started = time.monotonic()
         session.commit()
+        timings['commit'] = time.monotonic() - commit_started
         LOG.debug('Session commited and domain processed.')
 
+        return change_events
+
+    def _record_changes(self,
+                        session,
+                        db_domain: models.Domain,
+                        changes: List[Tuple[str, Any]],
+                        occurred_at: datetime.datetime) -> List[
+                            events.ChangeEvent]:
+        """Add changes to the record_events feed in the domains session.
+
+        Events are written in the same transaction as the changes they
+        describe, so the feed never disagrees with the records table.
+
+        Returns:
+            List[ChangeEvent]: events written, with their cursors.
+        """
+        if not changes:
+            return []
+
+        # Flush so new records and variables have their ids.
+        session.flush()
+        db_events = []
+        for event, row in changes:
+            if isinstance(row, models.Variable):
+                db_event = models.RecordEvent(domain_id=db_domain.id,
+                                              event=event,
+                                              variable_id=row.id,
+                                              value=row.value,
+                                              occurred_at=occurred_at)
+            else:
+                db_event = models.RecordEvent(domain_id=db_domain.id,
+                                              event=event,
+                                              record_id=row.id,
+                                              occurred_at=occurred_at)
+            db_events.append(db_event)
+        session.add_all(db_events)
+        # Flush again to get the cursors.
+        session.flush()
+
+        change_events = []
+        for db_event, (event, row) in zip(db_events, changes):
+            if isinstance(row, models.Variable):
+                change_events.append(events.ChangeEvent(
+                    cursor=db_event.id, event=event, domain=db_domain.name,
+                    occurred_at=occurred_at, key=row.key, value=row.value,
+                    file_type=row.file_type))
+            else:
+                supplier_domain, cert_authority = self._supplier(
+                    session, row.supplier_id)
+                change_events.append(events.ChangeEvent(
+                    cursor=db_event.id, event=event, domain=db_domain.name,
+                    occurred_at=occurred_at,
+                    supplier_domain=supplier_domain,
+                    pub_id=row.pub_id,
+                    supplier_relationship=row.supplier_relationship,
+                    cert_authority=cert_authority,
+                    file_type=row.file_type))
+        return change_events
+
+    def _authorisations(self, session, keys: Iterable[RecordKey]) -> List[
+            aggregates.Authorisation]:
+        return [(self._supplier(session, supplier_id)[0], relationship)
+                for supplier_id, _, relationship in keys]
+
+    def _ensure_supplier_counts(
+            self, keys: Iterable[aggregates.SupplierKey]) -> None:
+        """Make sure supplier_counts has a row for each key.
+
+        Rows known to exist are kept in an in process cache.
+        """
+        missing = set(keys).difference(self._supplier_count_keys)
+        if not missing:
+            return
+        session = self._session()
+        try:
+            aggregates.ensure_supplier_counts(session, sorted(missing))
+        finally:
+            session.close()
+        self._supplier_count_keys.update(missing)
+
+    def _verify_aggregates(self) -> None:
+        """Check the aggregate tables against records, at most once a day.
+
+        Mismatches are logged and repaired.  Only call this while nothing
+        else in the crawler is writing.
+        """
+        if (self._aggregates_verified_at is not None and
+                time.monotonic() - self._aggregates_verified_at <
+                AGGREGATE_VERIFY_INTERVAL):
+            return
+        self._aggregates_verified_at = time.monotonic()
+        session = self._session()
+        try:
+            aggregates.verify(session)
+        except SQLAlchemyError:
+            LOG.exception('Unable to verify aggregates.')
+        finally:
+            session.close()
+
+    def _start_archiver(self) -> None:
+        """Archive long inactive records in the background until stopped."""
+        if not self.archive_records_after:
+            return
+        archiver = coldstore.RecordArchiver(self._session,
+                                            self.archive_records_after)
+        thread = threading.Thread(
+            target=archiver.run, args=(self._stop, RECORD_ARCHIVE_INTERVAL),
+            name='adstxt-record-archiver', daemon=True)
+        thread.start()
+
+    def _parse_response(self, fetchdata: fetch.FetchResponse) -> Tuple[
+            Dict[RecordKey, transform.AdsRecord], Dict[str, str]]:
+        """Transform a FetchResponse into record keys and variables.
+
+        Args:
+            fetchdata (FetchResponse): Named tuple of fetch data.
+
+        Returns:
+            Tuple[Dict[RecordKey, AdsRecord], Dict[str, str]]: Records keyed
+                on (supplier_id, pub_id, supplier_relationship) and a dict of
+                variables, where later variables override earlier ones.  Both
+                keep the order rows were found in.
+        """
+        parsed_records, variables = self._parse(fetchdata)
+        records = {}  # type: Dict[RecordKey, transform.AdsRecord]
+
+        for processed_row in parsed_records:
+            try:
+                supplier_id = self._supplier_id(
+                    processed_row.supplier_domain,
+                    processed_row.cert_authority)
+            # Something about the supplier was bad. Skip to the next row.
+            except SQLAlchemyError as excpt:
+                LOG.exception('Unprocessible row. %r is bad due to %r',
+                              processed_row, excpt)
+                continue
+
+            records[(supplier_id,
+                     processed_row.pub_id,
+                     processed_row.supplier_relationship)] = processed_row
+
+        return records, variables
+
+    def _parse(self, fetchdata: fetch.FetchResponse) -> Tuple[
+            List[transform.AdsRecord], Dict[str, str]]:
+        """Parse a body, only once for all the domains serving it.
+
+        The result is shared, so mustn't be changed.
+        """
+        digest = hashlib.sha256(fetchdata.body).digest()
+        parsed = self._parse_cache.get(digest)
+        if self._run_stats:
+            self._run_stats.parsed(parsed is not None)
+        if parsed is None:
+            if (self.parse_processes and
+                    len(fetchdata.body) >= PARSE_PROCESS_MIN_BYTES):
+                parsed = self._parse_in_process(fetchdata)
+            else:
+                parsed = transform.parse(fetchdata.lines())
+            self._parse_cache.put(digest, parsed)
+        return parsed
+
+    def _parse_in_process(self, fetchdata: fetch.FetchResponse) -> Tuple[
+            List[transform.AdsRecord], Dict[str, str]]:
+        """Parse a large body in a parse process.
+
+        The writer waits without holding the GIL, so fetching and other
+        writes carry on meanwhile.  Falls back to parsing here if the parse
+        processes have died.
+        """
+        # Replays parse from several writers at once.
+        with self._parse_pool_lock:
+            if self._parse_pool is None:
+                self._parse_pool = _process_pool(self.parse_processes)
+        try:
+            records, variables = self._parse_pool.submit(
+                _parse_body, fetchdata.body).result()
+        except BrokenProcessPool:
+            LOG.exception('Parse processes have died, parsing %r in the '
+                          'writer.', fetchdata.domain)
+            return transform.parse(fetchdata.lines())
+        return ([transform.AdsRecord(*record.split(','))
+                 for record in records.split('\n')] if records else [],
+                variables)
+
+    def _supplier_id(self,
+                     supplier_domain: str,
+                     cert_authority: Optional[str]) -> int:
+        """Get the id of a supplier, creating the supplier if needed.
+
+        There are only a few thousand suppliers, so ids are kept in an in
+        process cache once resolved.
+
+        Args:
+            supplier_domain (str): domain of the advertising system.
+            cert_authority (Optional[str]): certification authority id.
+
+        Returns:
+            int: Suppliers primary key.
+        """
+        # A missing cert authority is stored as an empty string so it's
+        # covered by the suppliers unique constraint.
+        key = (supplier_domain, cert_authority or '')
+        supplier_id = self._supplier_ids.get(key)
+        if supplier_id is None:
+            supplier_id = self._resolve_supplier(*key)
+            self._supplier_ids[key] = supplier_id
+            self._suppliers[supplier_id] = key
+        return supplier_id
+
+    def _supplier(self, session, supplier_id: int) -> Tuple[str, str]:
+        """Get the (domain, cert_authority) of a supplier by id."""
+        supplier = self._suppliers.get(supplier_id)
+        if supplier is None:
+            db_supplier = session.query(models.Supplier).get(supplier_id)
+            supplier = (db_supplier.domain, db_supplier.cert_authority)
+            self._suppliers[supplier_id] = supplier
+            self._supplier_ids[supplier] = supplier_id
+        return supplier
+
+    def _resolve_supplier(self, supplier_domain: str,
+                          cert_authority: str) -> int:
+        session = self._session()
+        query = session.query(models.Supplier.id).filter_by(
+            domain=supplier_domain, cert_authority=cert_authority)
+        try:
+            supplier_id = query.scalar()
+            if supplier_id is not None:
+                return supplier_id
+
+            supplier = models.Supplier(domain=supplier_domain,
+                                       cert_authority=cert_authority)
+            session.add(supplier)
+            try:
+                session.commit()
+            # Another writer inserted the supplier since we looked.
+            except IntegrityError:
+                session.rollback()
+                return query.scalar()
+            return supplier.id
+        finally:
+            session.close()
+
     def fetch_domains(self) -> List[str]:
+        """Read the domains to crawl from the domain source.
+
+        Weights given by the source are kept in self._weights.
+        """
+        self._weights = {}
         if self.file:
             return self._fetch_from_file(self.file_uri)
         else:
@@ -296,21 +864,46 @@ class AdsTxtCrawler:
         domains = []
         for row in domain_file.split('\n'):
             if row:
-                domains.append(row)
+                # Rows can have a weight after the domain, `domain,weight`.
+                domain, _, weight = row.partition(',')
+                domains.append(domain)
+                if weight.strip():
+                    try:
+                        self._weights[domain] = int(weight)
+                    except ValueError:
+                        LOG.warning('Ignoring weight %r of %r, not a whole '
+                                    'number.', weight, domain)
 
         return domains
 
     def _query_for_domains(self, index, body) -> List[str]:
         query = json.loads(body)
-        res = self.es.search(index=index, body=query)
+        res = self.es_client.search(index=index, body=query)
 
-        # Return just the domains.
-        domains = [i['key'] for i
-                   in res['aggregations']['top_domains']['buckets']]
+        # Return just the domains, their doc_count is their weight.
+        buckets = res['aggregations']['top_domains']['buckets']
+        domains = [i['key'] for i in buckets]
+        self._weights.update((i['key'], i['doc_count']) for i in buckets
+                             if 'doc_count' in i)
         LOG.debug('Fetched total %s domains from ES.', len(domains))
 
         return domains
 
+    async def _fetch_domain(
+            self, domain: str,
+            cycle_deadline: Optional[float] = None) -> List[
+                fetch.FetchResponse]:
+        """Fetch each of the crawlers file types from a domain.
+
+        Several file types share one connection to the domain.
+        """
+        if self.file_types == fetch.DEFAULT_FILE_TYPES:
+            return [await fetch.fetch(domain, self.crawler_id,
+                                      timeouts=self.timeouts,
+                                      cycle_deadline=cycle_deadline)]
+        return await fetch.fetch_all(domain, self.crawler_id, self.file_types,
+                                     self.timeouts, cycle_deadline)
+
     def _run_once(self) -> None:
         """Query for domains and insert into database.
 
@@ -336,9 +929,19 @@ class AdsTxtCrawler:
         bootstrapped.  If you're manually running this please call
         self._bootstrap_db as well.
         """
-        # Query for domains and filter to see if theyt're checkable.
-        domains = [x for x in self.fetch_domains()
-                   if self._check_viability(x)]
+        stats = ledger.RunStats(self.crawler_id)
+        cycle_started = time.monotonic()
+        # Pick up where we left off if the last cycle didn't finish.
+        domains = self._checkpoint.pending() if self._checkpoint else None
+        if domains is not None:
+            LOG.info('Resuming an unfinished crawl cycle, %d domains left.',
+                     len(domains))
+        else:
+            domains = self._cycle_domains()
+            if self._checkpoint:
+                self._checkpoint.start(domains)
+        stats.dispatched(len(domains))
+        self._run_stats = stats
 
         def worker():
             while True:
@@ -351,17 +954,20 @@ class AdsTxtCrawler:
                 # Catch the top level exception and continue onto the next
                 # record.
                 try:
-                    self.process_domain(fetch_event)
+                    self._write(fetch_event)
                 except Exception as e:
                     LOG.exception(e)
-                    pass
+                else:
+                    if self._checkpoint:
+                        self._checkpoint.mark_done(fetch_event.domain)
                 # Ack that event as being done.
                 fetch_queue.task_done()
                 # Log this event as being processed.
                 LOG.debug('Task done %r', fetch_event)
 
-        # Setup a Queue and worker for processing fetch events.fetch
-        fetch_queue = queue.Queue()  # type: queue.Queue
+        # Setup a Queue and worker for processing fetch events.  The spool
+        # stands in for the in memory queue when there is one.
+        fetch_queue = self._spool or queue.Queue()  # type: Any
         thread = threading.Thread(target=worker)
         thread.start()
 
@@ -369,14 +975,30 @@ class AdsTxtCrawler:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
+        # Fetches still going when the budget runs out are cut short, the
+        # budget started with the cycle.
+        cycle_deadline = (
+            loop.time() + self.cycle_budget -
+            (time.monotonic() - cycle_started) if self.cycle_budget else None)
+
         async def fetcher(domain):
             try:
-                fetch_event = await fetch.fetch(domain, self.crawler_id)
+                fetch_events = await self._fetch_domain(domain,
+                                                        cycle_deadline)
             # Just crush exceptions here
             except Exception:
-                pass
-            else:
+                stats.fetched(fetch.FETCH_ERROR)
+                return
+            for fetch_event in fetch_events:
+                stats.fetched(fetch_event.outcome)
+            # Nothing's written for a domain the cycle ran out of time for,
+            # so it's still due next cycle.
+            if any(fetch_event.outcome == fetch.CYCLE_BUDGET_EXCEEDED
+                   for fetch_event in fetch_events):
+                return
+            for fetch_event in fetch_events:
                 fetch_queue.put(fetch_event)
+                stats.queued(fetch_queue.qsize())
 
         # Setup a list of function calls.
         fetches = [fetcher(x) for x in domains]
@@ -385,6 +1007,10 @@ class AdsTxtCrawler:
 
         # Close the loop once we're done.
         loop.close()
+        if stats.outcomes[fetch.CYCLE_BUDGET_EXCEEDED]:
+            LOG.warning('Cycle ran out of its %ss budget, %d fetches left '
+                        'for the next cycle.', self.cycle_budget,
+                        stats.outcomes[fetch.CYCLE_BUDGET_EXCEEDED])
 
         # Block until all tasks are done.
         fetch_queue.join()
@@ -392,19 +1018,743 @@ class AdsTxtCrawler:
         fetch_queue.put(None)
         # Close thread now we're done writing to the database.
         thread.join()
+        self._run_stats = None
+
+        if self._checkpoint:
+            self._checkpoint.finish()
+
+        self._record_run(stats)
+
+    def _run_processes(self) -> None:
+        """Crawl a cycle with fetching and writing in separate processes.
+
+        Fetcher processes share out the cycle's domains, in order so each
+        starts with the heaviest, and pass what they fetch to the writer
+        processes through a bounded queue.  Responses go over as spool
+        payloads.  Fetchers wait while the queue is full, so writers that
+        fall behind slow fetching down rather than responses piling up in
+        memory.  Each side is scaled to its own bottleneck, fetchers by the
+        network and writers by the database.
 
-    def run(self) -> None:
+        The checkpoint and spool aren't used here.
+
+        ATTENTION: This requires databases and connections to be
+        bootstrapped.
+        """
+        stats = ledger.RunStats(self.crawler_id)
+        cycle_started = time.monotonic()
+        domains = self._cycle_domains()
+        stats.dispatched(len(domains))
+        # Event loops keep time with time.monotonic, which every process on
+        # the machine shares.
+        cycle_deadline = (cycle_started + self.cycle_budget
+                          if self.cycle_budget else None)
+
+        # Processes are spawned rather than forked, this one has threads
+        # and database connections which a fork would copy.
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue(PROCESS_QUEUE_SIZE)
+        reports = context.Queue()
+        log_level = logging.getLogger().getEffectiveLevel()
+        fetcher_count = max(self.fetcher_processes, 1)
+        writers = [
+            context.Process(
+                target=_writer_process, name='adstxt-writer-%d' % index,
+                args=(self._process_settings, self._events_path, index,
+                      log_level, results, reports))
+            for index in range(max(self.writer_processes, 1))]
+        fetchers = [
+            context.Process(
+                target=_fetcher_process, name='adstxt-fetcher-%d' % index,
+                args=(self._process_settings, domains[index::fetcher_count],
+                      cycle_deadline, log_level, results, reports))
+            for index in range(fetcher_count)]
+        for process in writers + fetchers:
+            process.start()
+        LOG.info('Crawling %d domains with %d fetcher and %d writer '
+                 'processes.', len(domains), len(fetchers), len(writers))
+
+        # Fetchers would wait forever on a full queue with nothing writing.
+        while any(fetcher.is_alive() for fetcher in fetchers):
+            if not any(writer.is_alive() for writer in writers):
+                LOG.error('Every writer process has exited, stopping the '
+                          'fetchers.')
+                for fetcher in fetchers:
+                    fetcher.terminate()
+            for fetcher in fetchers:
+                fetcher.join(PROCESS_POLL_INTERVAL)
+        # Writers stop once everything before these has been written.
+        for writer in writers:
+            if writer.is_alive():
+                results.put(None)
+        for writer in writers:
+            writer.join()
+
+        for process in fetchers + writers:
+            if process.exitcode:
+                LOG.error('%s exited with %d, its statistics are missing.',
+                          process.name, process.exitcode)
+                continue
+            try:
+                stats.merge(reports.get(timeout=PROCESS_REPORT_TIMEOUT))
+            except queue.Empty:
+                LOG.error('Missing statistics from a crawler process.')
+                break
+
+        self._record_run(stats)
+
+    def _fetch_into(self, domains: List[str],
+                    cycle_deadline: Optional[float],
+                    results: Any, stats: ledger.RunStats) -> None:
+        """Fetch domains, putting spool payloads of the responses on results.
+
+        Runs in a fetcher process.  Only the event loop waits while results
+        is full, fetches in flight carry on.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        pending = iter(domains)
+
+        async def put(payload: bytes) -> None:
+            try:
+                results.put_nowait(payload)
+            except queue.Full:
+                await loop.run_in_executor(None, results.put, payload)
+            try:
+                stats.queued(results.qsize())
+            # Not implemented on macOS.
+            except NotImplementedError:
+                pass
+
+        async def worker():
+            for domain in pending:
+                try:
+                    fetch_events = await self._fetch_domain(domain,
+                                                            cycle_deadline)
+                except Exception:
+                    stats.fetched(fetch.FETCH_ERROR)
+                    continue
+                for fetch_event in fetch_events:
+                    stats.fetched(fetch_event.outcome)
+                # Left for the next cycle, as with _run_once.
+                if any(fetch_event.outcome == fetch.CYCLE_BUDGET_EXCEEDED
+                       for fetch_event in fetch_events):
+                    continue
+                for fetch_event in fetch_events:
+                    await put(encode_payload(fetch_event))
+
+        try:
+            loop.run_until_complete(asyncio.gather(
+                *[worker() for _ in range(STREAM_WORKERS)]))
+        finally:
+            loop.close()
+
+    def _write_from(self, results: Any, stats: ledger.RunStats) -> None:
+        """Write spool payloads from results until None is taken off it.
+
+        Runs in a writer process.
+        """
+        self._run_stats = stats
+        try:
+            while True:
+                payload = results.get()
+                if payload is None:
+                    break
+                fetchdata = decode(payload)
+                try:
+                    self._write(fetchdata)
+                except Exception as e:
+                    LOG.exception(e)
+        finally:
+            self._run_stats = None
+
+    def _record_run(self, stats: ledger.RunStats) -> None:
+        """Write a cycles statistics to the crawl_runs ledger."""
+        run = stats.finish()
+        LOG.info('Crawled %d domains, wrote %d at %.1f domains/s, %d records '
+                 'added and %d removed.  Outcomes %s.', run.domains,
+                 run.written, run.domains_per_second, run.records_added,
+                 run.records_removed, run.outcomes)
+        LOG.info('Parsed %d distinct bodies for %d domains, %d held in the '
+                 'parse cache.', run.parse_cache_misses,
+                 run.parse_cache_hits + run.parse_cache_misses,
+                 len(self._parse_cache))
+        session = self._session()
+        try:
+            session.add(run)
+            session.commit()
+        except SQLAlchemyError:
+            LOG.exception('Unable to record crawl run.')
+        finally:
+            session.close()
+
+    def _cycle_domains(self) -> List[str]:
+        """Get the domains to crawl this cycle, highest tier first."""
+        # Query for domains and reject invalid ones in a single pass, known
+        # invalid domains are dropped before any further work.
+        self._reload_invalid_domains()
+        validated = validate.validate_domains(self.fetch_domains(),
+                                              self._invalid_domains)
+        self._mark_invalid(validated.invalid)
+        LOG.info('Rejected %d invalid domains this cycle, %d of these '
+                 'were already known to be invalid.',
+                 len(validated.invalid) + validated.cached, validated.cached)
+
+        weights = {domain: self._weights.get(domain, 0)
+                   for domain in validated.valid}
+        last_updated = self._ensure_domains(validated.valid, weights)
+        tiers = scheduler.assign_tiers(weights)
+
+        # Filter to see if they're checkable, tiers are crawled at their own
+        # intervals.
+        now = datetime.datetime.utcnow()
+        due = [domain for domain in validated.valid
+               if now - (last_updated.get(domain) or datetime.datetime.min) >=
+               scheduler.tier_interval(
+                   tiers.get(domain, scheduler.LONG_TAIL))]
+        # Fetches start in this order, so heavier domains are done first.
+        return sorted(due, key=lambda domain: (
+            tiers.get(domain, scheduler.LONG_TAIL), -weights[domain]))
+
+    def _scheduled_domains(
+            self, schedule: scheduler.DueScheduler) -> Tuple[
+                List[Tuple[str, datetime.datetime]], Dict[str, int]]:
+        """Get every valid source domain with when it's next due.
+
+        Due times are only looked up for domains which aren't already
+        scheduled, anything new to the database is due straight away.
+
+        Returns:
+            Tuple[List[Tuple[str, datetime]], Dict[str, int]]: (domain,
+                due_at) pairs and the tier of each domain not in the long
+                tail, as taken by DueScheduler.sync.
+        """
+        previous_weights = self._weights
+        self._reload_invalid_domains()
+        validated = validate.validate_domains(self.fetch_domains(),
+                                              self._invalid_domains)
+        self._mark_invalid(validated.invalid)
+        weights = {domain: self._weights.get(domain, 0)
+                   for domain in validated.valid}
+        tiers = scheduler.assign_tiers(weights)
+        # Scheduled domains are only looked up again to store a new weight.
+        last_updated = self._ensure_domains(
+            [domain for domain in validated.valid
+             if domain not in schedule or
+             weights[domain] != previous_weights.get(domain, 0)],
+            weights)
+
+        return [(domain,
+                 (last_updated.get(domain) or datetime.datetime.min) +
+                 schedule.interval_of(tiers.get(domain, scheduler.LONG_TAIL)))
+                for domain in validated.valid], tiers
+
+    def _ensure_domains(
+            self, domains: List[str],
+            weights: Optional[Mapping[str, int]] = None) -> Dict[
+                str, datetime.datetime]:
+        """Get when domains were last updated, adding any which are missing.
+
+        Args:
+            domains (List[str]): domains to look up.
+            weights (Optional[Mapping[str, int]]): weights to store for the
+                domains, weights are left alone if not given.
+
+        Returns:
+            Dict[str, datetime]: last_updated of the domains which were
+                already in the database.
+        """
+        session = self._session()
+        last_updated = {}  # type: Dict[str, datetime.datetime]
+        stored_weights = {}  # type: Dict[str, Optional[int]]
+        # Look domains up in chunks to keep the IN clause a sensible size.
+        for pos in range(0, len(domains), 1000):
+            for name, updated, weight in session.query(
+                    models.Domain.name, models.Domain.last_updated,
+                    models.Domain.weight).filter(
+                        models.Domain.name.in_(domains[pos:pos + 1000])):
+                last_updated[name] = updated
+                stored_weights[name] = weight
+        missing = [domain for domain in domains if domain not in last_updated]
+        if missing:
+            session.execute(models.Domain.__table__.insert(),
+                            [{'name': domain,
+                              'last_updated': datetime.datetime.min,
+                              'weight': (weights or {}).get(domain) or None}
+                             for domain in missing])
+        if weights is not None:
+            # Only write the weights which have changed.
+            changed = [{'domain_name': domain,
+                        'domain_weight': weights.get(domain) or None}
+                       for domain, weight in stored_weights.items()
+                       if (weights.get(domain) or None) != weight]
+            if changed:
+                table = models.Domain.__table__
+                session.execute(
+                    table.update().where(
+                        table.c.name == bindparam('domain_name')).values(
+                            weight=bindparam('domain_weight')),
+                    changed)
+        session.commit()
+        session.close()
+        return last_updated
+
+    def _run_continuous(self) -> None:
+        """Crawl each domain as soon as it's due.
+
+        Rather than rebuilding the whole list of domains each cycle, domains
+        sit in a min heap keyed on when they're next due and are handed to
+        the fetchers as they come due.  The domain source is re-read
+        periodically with new domains merged in.  Runs until self._stop is
+        set.
+
+        The checkpoint isn't used here, due times come from each domain's
+        persisted last_updated so a restart carries on where it left off.
+
+        ATTENTION: This requires databases and connections to be
+        bootstrapped.
+        """
+        schedule = scheduler.DueScheduler()
+
+        def worker():
+            while True:
+                fetch_event = fetch_queue.get(block=True)
+                if fetch_event is None:
+                    break
+                try:
+                    self._write(fetch_event)
+                except Exception as e:
+                    LOG.exception(e)
+                    schedule.retry(fetch_event.domain,
+                                   datetime.datetime.utcnow())
+                else:
+                    schedule.reschedule(fetch_event.domain,
+                                        fetch_event.scraped_at)
+                fetch_queue.task_done()
+                # This is the only writer, so aggregates are checked here.
+                self._verify_aggregates()
+
+        fetch_queue = self._spool or queue.Queue()  # type: Any
+        thread = threading.Thread(target=worker, name='adstxt-writer')
+        thread.start()
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def fetcher(domain):
+            try:
+                fetch_events = await self._fetch_domain(domain)
+            except Exception:
+                schedule.retry(domain, datetime.datetime.utcnow())
+            else:
+                for fetch_event in fetch_events:
+                    fetch_queue.put(fetch_event)
+
+        async def refresh():
+            try:
+                added = schedule.sync(*await loop.run_in_executor(
+                    None, self._scheduled_domains, schedule))
+            # Carry on with what's already scheduled, the source is tried
+            # again on the next refresh.
+            except Exception:
+                LOG.exception('Unable to refresh domains to crawl.')
+            else:
+                LOG.info('Merged %d new domains, %d scheduled.',
+                         added, len(schedule))
+
+        async def dispatch():
+            in_flight = set()  # type: Set[asyncio.Future]
+            refreshed_at = reported_at = time.monotonic()
+            await refresh()
+
+            try:
+                while not self._stop.is_set():
+                    now = time.monotonic()
+                    if now - refreshed_at >= SOURCE_REFRESH_INTERVAL:
+                        await refresh()
+                        refreshed_at = now
+                    if now - reported_at >= FRESHNESS_REPORT_INTERVAL:
+                        for tier in range(len(scheduler.TIER_INTERVALS)):
+                            freshness = schedule.freshness(tier)
+                            LOG.info('Dispatched %d tier %d domains, lag '
+                                     'behind due time median %s, p95 %s, '
+                                     'max %s.', freshness.dispatched, tier,
+                                     *freshness[1:])
+                        reported_at = now
+
+                    # Don't run ahead of the database writer, unless there's
+                    # a spool to hold what it hasn't got to yet.
+                    capacity = MAX_IN_FLIGHT - len(in_flight)
+                    if not self._spool:
+                        capacity -= fetch_queue.qsize()
+                    for domain in schedule.pop_due(
+                            datetime.datetime.utcnow(), capacity):
+                        task = loop.create_task(fetcher(domain))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+
+                    await asyncio.sleep(DISPATCH_INTERVAL)
+            finally:
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+
+        try:
+            loop.run_until_complete(dispatch())
+        finally:
+            loop.close()
+            # The sentinel queues up behind anything already fetched, so the
+            # worker writes everything out before it quits.
+            fetch_queue.put(None)
+            thread.join()
+
+    def _stream_rows(self,
+                     fetchdata: fetch.FetchResponse) -> List[Dict[str, Any]]:
+        """Turn a FetchResponse into rows for the stream.
+
+        Each domain gets a fetch row with its outcome, followed by a row for
+        each of its unique records and variables.
+        """
+        records, variables = self._parse(fetchdata)
+        rows = [{'type': 'fetch',
+                 'domain': fetchdata.domain,
+                 'scraped_at': fetchdata.scraped_at,
+                 'file_type': fetchdata.file_type,
+                 'adstxt_present': bool(fetchdata.adstxt_present),
+                 'outcome': fetchdata.outcome,
+                 'records': len(records),
+                 'variables': len(variables)}]  # type: List[Dict[str, Any]]
+        for record in records:
+            row = {'type': 'record',
+                   'domain': fetchdata.domain,
+                   'file_type': fetchdata.file_type,
+                   'scraped_at': fetchdata.scraped_at}
+            row.update(record._asdict())
+            rows.append(row)
+        for key, value in variables.items():
+            rows.append({'type': 'variable',
+                         'domain': fetchdata.domain,
+                         'file_type': fetchdata.file_type,
+                         'scraped_at': fetchdata.scraped_at,
+                         'key': key,
+                         'value': value})
+        return rows
+
+    def run_stream(self, domains: Iterable[str]) -> int:
+        """Crawl domains once, streaming what's found as NDJSON.
+
+        Nothing touches the database, domains are validated, fetched and
+        parsed with the rows written straight to the stream.  There's no
+        viability window, every valid domain is fetched.
+
+        Args:
+            domains (Iterable[str]): domains to crawl.
+
+        Returns:
+            int: number of domains fetched.
+        """
+        validated = validate.validate_domains(domains, set())
+        LOG.info('Streaming %d domains, rejected %d invalid domains.',
+                 len(validated.valid), len(validated.invalid))
+        pending = iter(validated.valid)
+        counts = collections.Counter()  # type: collections.Counter
+
+        async def worker():
+            for domain in pending:
+                try:
+                    responses = await self._fetch_domain(domain)
+                except Exception:
+                    LOG.exception('Unable to fetch %r.', domain)
+                    counts['errored'] += 1
+                    continue
+                for fetchdata in responses:
+                    self._stream.write(self._stream_rows(fetchdata))
+                    if fetchdata.adstxt_present:
+                        counts['present'] += 1
+                counts['fetched'] += 1
+
+        started = time.monotonic()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(asyncio.gather(
+                *[worker() for _ in range(STREAM_WORKERS)]))
+        finally:
+            loop.close()
+            self._stream.close()
+
+        elapsed = time.monotonic() - started
+        LOG.info('Streamed %d domains, found %d files and %d errored in '
+                 '%.1fs, %.1f domains/s.', counts['fetched'],
+                 counts['present'], counts['errored'], elapsed,
+                 counts['fetched'] / elapsed if elapsed else 0)
+        return counts['fetched']
+
+    def replay(self, domain: Optional[str] = None,
+               workers: Optional[int] = None) -> int:
+        """Push archived bodies back through processing.
+
+        The latest archived body of each domain is processed as if it had
+        just been fetched, at the time it was originally fetched, so fixes
+        to parsing can be applied without crawling again.  Each domain is
+        handled by a single worker so its files are written in turn.
+
+        Args:
+            domain (Optional[str]): only replay this domain.
+            workers (Optional[int]): number of domains written at once,
+                REPLAY_WORKERS if not given.
+
+        Returns:
+            int: number of bodies replayed.
+
+        ATTENTION: This requires databases and connections to be
+        bootstrapped.
+        """
+        def replay_domain(archived_bodies):
+            replayed = 0
+            for archived in archived_bodies:
+                try:
+                    # Make sure the domain exists, the database may be new.
+                    self._last_updated_at(archived.domain)
+                    self.process_domain(self._archive.load(archived))
+                except Exception:
+                    LOG.exception('Unable to replay %r.', archived.domain)
+                else:
+                    replayed += 1
+            return replayed
+
+        started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(
+                workers or REPLAY_WORKERS) as executor:
+            futures = [
+                executor.submit(replay_domain, list(archived_bodies))
+                for _, archived_bodies in itertools.groupby(
+                    self._archive.bodies(domain),
+                    key=lambda archived: archived.domain)]
+            replayed = sum(future.result() for future in futures)
+
+        elapsed = time.monotonic() - started
+        LOG.info('Replayed %d bodies in %.1fs, %.1f bodies/s.', replayed,
+                 elapsed, replayed / elapsed if elapsed else 0)
+        return replayed
+
+    def run_batch(self, domains: Iterable[str], out: IO[str]) -> Dict[
+            str, int]:
+        """Crawl and write domains straight away, reporting on each one.
+
+        Domains are fetched whenever they were last crawled, and as each
+        one is written a line of JSON with its outcome and how many records
+        were added and removed is written to out.  The run goes in the
+        crawl_runs ledger like any other.
+
+        Args:
+            domains (Iterable[str]): domains to crawl.
+            out (IO[str]): where to write result lines.
+
+        Returns:
+            Dict[str, int]: counts of domains which were invalid or errored,
+                and of files which were present or missing.
+
+        ATTENTION: This requires databases and connections to be
+        bootstrapped.
+        """
+        stats = ledger.RunStats(self.crawler_id)
+        self._run_stats = stats
+        counts = collections.Counter()  # type: collections.Counter
+        out_lock = threading.Lock()
+
+        # Results come from both the fetchers and the writer.
+        def report(count: str, row: Dict[str, Any]) -> None:
+            with out_lock:
+                counts[count] += 1
+                out.write(dumps(row) + '\n')
+                out.flush()
+
+        # Known invalid domains are checked again, they're being asked about.
+        validated = validate.validate_domains(domains, set())
+        self._mark_invalid(validated.invalid)
+        for domain in validated.invalid:
+            report('invalid', {'domain': domain, 'outcome': 'invalid'})
+        self._ensure_domains(validated.valid)
+        stats.dispatched(len(validated.valid))
+
+        def worker():
+            while True:
+                fetchdata = fetch_queue.get()
+                if fetchdata is None:
+                    break
+                try:
+                    change_events = self._write(fetchdata)
+                except Exception:
+                    LOG.exception('Unable to write %r.', fetchdata.domain)
+                    report('errored', {'domain': fetchdata.domain,
+                                       'file_type': fetchdata.file_type,
+                                       'outcome': 'write_error'})
+                else:
+                    report('present' if fetchdata.adstxt_present
+                           else 'missing', {
+                        'domain': fetchdata.domain,
+                        'file_type': fetchdata.file_type,
+                        'outcome': fetchdata.outcome,
+                        'adstxt_present': bool(fetchdata.adstxt_present),
+                        'added': sum(
+                            event.event in (events.INSERT, events.REACTIVATE)
+                            for event in change_events),
+                        'removed': sum(event.event == events.DEACTIVATE
+                                       for event in change_events),
+                        'seconds': (fetchdata.timings or {}).get('total')})
+                fetch_queue.task_done()
+
+        fetch_queue = queue.Queue()  # type: queue.Queue
+        thread = threading.Thread(target=worker, name='adstxt-writer')
+        thread.start()
+        pending = iter(validated.valid)
+
+        async def fetcher():
+            for domain in pending:
+                try:
+                    responses = await self._fetch_domain(domain)
+                except Exception:
+                    LOG.exception('Unable to fetch %r.', domain)
+                    stats.fetched(fetch.FETCH_ERROR)
+                    report('errored', {'domain': domain,
+                                       'outcome': fetch.FETCH_ERROR})
+                    continue
+                for fetchdata in responses:
+                    stats.fetched(fetchdata.outcome)
+                    fetch_queue.put(fetchdata)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(asyncio.gather(
+                *[fetcher() for _ in range(STREAM_WORKERS)]))
+        finally:
+            loop.close()
+            fetch_queue.put(None)
+            thread.join()
+            self._run_stats = None
+
+        self._record_run(stats)
+        return dict(counts)
+
+    def _handle_signal(self, signum, frame) -> None:
+        LOG.info('Received signal %d, stopping once in flight domains are '
+                 'written.', signum)
+        self._stop.set()
+
+    def run(self, continuous: bool = False) -> None:
         LOG.info('Starting adstxt crawler...')
 
         self._bootstrap_db()
         LOG.info('Databases bootstrapped...')
+        self._start_archiver()
 
-        while True:
-            loop_start = time.time()
-            LOG.info('Searching for domains to crawl...')
-            self._run_once()
-            LOG.info('Done processing current available domains.')
-            # If the loop instantly returned, sleep for a while so
-            # we don't thrash the database.
-            if time.time() - loop_start < 60:
-                time.sleep(15)
+        try:
+            if continuous:
+                LOG.info('Crawling domains continuously as they come due...')
+                signal.signal(signal.SIGTERM, self._handle_signal)
+                signal.signal(signal.SIGINT, self._handle_signal)
+                self._run_continuous()
+                return
+
+            while True:
+                loop_start = time.time()
+                LOG.info('Searching for domains to crawl...')
+                if self.fetcher_processes or self.writer_processes:
+                    self._run_processes()
+                else:
+                    self._run_once()
+                LOG.info('Done processing current available domains.')
+                # Nothing is being written between cycles.
+                self._verify_aggregates()
+                # If the loop instantly returned, sleep for a while so
+                # we don't thrash the database.
+                if time.time() - loop_start < 60:
+                    time.sleep(15)
+        finally:
+            self._stop.set()
+            self.close()
+
+    def close(self) -> None:
+        """Flush and close the event sink, checkpoint, spool and archive.
+
+        Parse processes are shut down.
+        """
+        if self._event_sink:
+            self._event_sink.close()
+        if self._checkpoint:
+            self._checkpoint.close()
+        if self._spool:
+            self._spool.close()
+        if self._archive:
+            self._archive.close()
+        if self._parse_pool:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+
+
+def _process_crawler(settings: Dict[str, Any],
+                     log_level: int) -> AdsTxtCrawler:
+    # Spawned processes start without any logging set up.
+    logging.basicConfig(stream=sys.stderr, level=log_level,
+                        format=PROCESS_LOG_FORMAT)
+    return AdsTxtCrawler(False, False, **settings)
+
+
+def _fetcher_process(settings: Dict[str, Any],
+                     domains: List[str],
+                     cycle_deadline: Optional[float],
+                     log_level: int,
+                     results: Any,
+                     reports: Any) -> None:
+    """Entry point of a fetcher process, see _run_processes."""
+    # Fetchers don't write anything.
+    crawler = _process_crawler(dict(settings, archive_path=None), log_level)
+    stats = ledger.RunStats(crawler.crawler_id)
+    crawler._fetch_into(domains, cycle_deadline, results, stats)
+    reports.put(stats)
+
+
+def _writer_process(settings: Dict[str, Any],
+                    events_path: Optional[str],
+                    index: int,
+                    log_level: int,
+                    results: Any,
+                    reports: Any) -> None:
+    """Entry point of a writer process, see _run_processes."""
+    crawler = _process_crawler(settings, log_level)
+    crawler._bootstrap_db()
+    if events_path:
+        # Each writer has files of its own.
+        crawler._event_sink = events.NDJSONEventSink(events_path,
+                                                     'events-%d' % index)
+    stats = ledger.RunStats(crawler.crawler_id)
+    try:
+        crawler._write_from(results, stats)
+    finally:
+        crawler.close()
+    reports.put(stats)
+
+
+def _process_pool(processes: int) -> ProcessPoolExecutor:
+    # Spawned rather than forked from a process with threads running.
+    try:
+        return ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('spawn'))
+    # Python 3.6 can only fork.
+    except TypeError:
+        return ProcessPoolExecutor(processes)
+
+
+def _parse_body(body: bytes) -> Tuple[str, Dict[str, str]]:
+    """Parse a body in a parse process.
+
+    Records go back as a single string, quicker to send and split up again
+    than a list of them.  Each record is a line of its fields joined with
+    commas, without a cert authority if it has none.  Fields are split out
+    of a line on commas, so never hold commas or newlines.
+    """
+    records, variables = transform.parse(fetch.body_lines(body))
+    return '\n'.join(','.join(record if record.cert_authority is not None
+                               else record[:3])
+                      for record in records), variables
@@ -1,13 +1,19 @@
 from typing import Any
 
 from sqlalchemy import (
-    Column, ForeignKey, Integer, String, DateTime, Boolean, Text)
+    BigInteger, Column, ForeignKey, Index, Integer, String, DateTime, Boolean,
+    Float, Text, UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 
 Base = declarative_base()  # type: Any
 
+# Well known files records and variables can be listed in.
+ADS_TXT = 'ads.txt'
+APP_ADS_TXT = 'app-ads.txt'
+FILE_TYPES = (ADS_TXT, APP_ADS_TXT)
+
 
 class Domain(Base):
     __tablename__ = 'domains'
@@ -18,36 +24,99 @@ class Domain(Base):
     name = Column(String(255), nullable=False)
     last_updated = Column(DateTime)
     adstxt_present = Column(Boolean, nullable=True)
+    app_adstxt_present = Column(Boolean, nullable=True)
+    # Importance of the domain from the domain source, elasticsearch's
+    # doc_count or the weight column of a domain file.  Higher is more
+    # important, NULL if the source didn't give one.
+    weight = Column(BigInteger, nullable=True)
 
     def __repr__(self):  # pragma: no cover
         return ("<Domain(name='%s', last_updated='%s',"
-                "adstxt_present='%s')>") % (
-            self.name, self.last_updated, self.adstxt_present)
+                "adstxt_present='%s', app_adstxt_present='%s', "
+                "weight='%s')>") % (
+            self.name, self.last_updated, self.adstxt_present,
+            self.app_adstxt_present, self.weight)
+
+
+class Supplier(Base):
+    """Advertising systems referenced by records.
+
+    Tens of millions of records point at a few thousand suppliers, so these
+    are stored once and records reference them by id."""
+    __tablename__ = 'suppliers'
+    __table_args__ = (UniqueConstraint('domain', 'cert_authority'),)
+
+    id = Column(Integer, primary_key=True)
+    domain = Column(String(255), nullable=False)
+    # Cert authority is optional, an empty string stands in for a missing
+    # one so that it's covered by the unique constraint.
+    cert_authority = Column(String(255), nullable=False, default='')
+
+    def __repr__(self):  # pragma: no cover
+        return "<Supplier(domain='%s', cert_authority='%s')>" % (
+            self.domain, self.cert_authority)
 
 
 class Record(Base):
     __tablename__ = 'records'
+    __table_args__ = (Index('ix_records_domain_id_active',
+                            'domain_id', 'active'),
+                      Index('ix_records_deactivated_at', 'deactivated_at'))
 
     id = Column(Integer, primary_key=True)
     # Parent domain foreign key.
     domain_id = Column(Integer, ForeignKey('domains.id'))
     domain = relationship(Domain)
-    # Adstxt record fields.
-    supplier_domain = Column(String(255), nullable=False)
+    # Adstxt record fields, supplier_domain and cert_authority live on the
+    # supplier.
+    supplier_id = Column(Integer, ForeignKey('suppliers.id'),
+                         nullable=False, index=True)
+    supplier = relationship(Supplier)
     pub_id = Column(String(255), nullable=False)
     supplier_relationship = Column(String(30), nullable=False)
-    cert_authority = Column(String(255), nullable=True)
+    # Which file the record was listed in, ads.txt or app-ads.txt.
+    file_type = Column(String(20), nullable=False, default=ADS_TXT)
     # Keep track of the records state.
     first_seen = Column(DateTime, nullable=True)
     active = Column(Boolean, nullable=True)
+    # When an inactive record was deactivated, null while it's active.
+    deactivated_at = Column(DateTime, nullable=True)
 
     def __repr__(self):  # pragma: no cover
-        return ("<Record(domain_id='%s', supplier_domain='%s', "
-                "pub_id='%s', supplier_relationship='%s', "
-                "cert_authority='%s', first_seen='%s', active='%s')>") % (
-            self.domain_id, self.supplier_domain, self.pub_id,
-            self.supplier_relationship, self.cert_authority,
-            self.first_seen, self.active)
+        return ("<Record(domain_id='%s', supplier_id='%s', "
+                "pub_id='%s', supplier_relationship='%s', file_type='%s', "
+                "first_seen='%s', active='%s')>") % (
+            self.domain_id, self.supplier_id, self.pub_id,
+            self.supplier_relationship, self.file_type, self.first_seen,
+            self.active)
+
+
+class ArchivedRecord(Base):
+    """Records which had been inactive for a while, moved out of records.
+
+    Keeping these out of records keeps it and its indexes sized to live
+    data.  Rows keep their record id, so the change feed still describes
+    them, and move back to records if they're listed again."""
+    __tablename__ = 'records_archive'
+    __table_args__ = (Index('ix_records_archive_domain_id_file_type',
+                            'domain_id', 'file_type'),)
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    domain_id = Column(Integer, ForeignKey('domains.id'), nullable=False)
+    supplier_id = Column(Integer, ForeignKey('suppliers.id'),
+                         nullable=False)
+    pub_id = Column(String(255), nullable=False)
+    supplier_relationship = Column(String(30), nullable=False)
+    file_type = Column(String(20), nullable=False, default=ADS_TXT)
+    first_seen = Column(DateTime, nullable=True)
+    deactivated_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):  # pragma: no cover
+        return ("<ArchivedRecord(id='%s', domain_id='%s', "
+                "supplier_id='%s', pub_id='%s', archived_at='%s')>") % (
+            self.id, self.domain_id, self.supplier_id, self.pub_id,
+            self.archived_at)
 
 
 class Variable(Base):
@@ -61,7 +130,151 @@ class Variable(Base):
     key = Column(String(255), nullable=False)
     # Value can be arbitrarily long.
     value = Column(Text, nullable=False)
+    # Which file the variable was listed in, ads.txt or app-ads.txt.
+    file_type = Column(String(20), nullable=False, default=ADS_TXT)
+
+    def __repr__(self):  # pragma: no cover
+        return ("<Variable(domain='%s', key='%s', value='%s', "
+                "file_type='%s')>") % (
+            self.domain, self.key, self.value, self.file_type)
+
+
+class InvalidDomain(Base):
+    """Domains which have failed validation.
+
+    Validation is deterministic, so once a domain is found to be invalid
+    it's rejected on every later cycle before any other work is done.
+    Verdicts are trusted until the validation rules change, tracked by
+    validator_version, or they're older than validate.VERDICT_TTL."""
+    __tablename__ = 'invalid_domains'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False, unique=True)
+    first_seen = Column(DateTime)
+    # validate.VERSION the domain was found invalid by, NULL from before
+    # versions were tracked.
+    validator_version = Column(Integer)
+
+    def __repr__(self):  # pragma: no cover
+        return "<InvalidDomain(name='%s', first_seen='%s')>" % (
+            self.name, self.first_seen)
+
+
+class RecordEvent(Base):
+    """Append only feed of changes made to records and variables.
+
+    The primary key is an increasing cursor, consumers tail the feed with
+    events.FeedCursor which copes with ids committing out of order.  Record
+    and variable ids are deliberately not foreign keys, events outlive the
+    rows they describe."""
+    __tablename__ = 'record_events'
+
+    id = Column(Integer, primary_key=True)
+    domain_id = Column(Integer, ForeignKey('domains.id'), nullable=False)
+    event = Column(String(20), nullable=False)
+    record_id = Column(Integer, nullable=True)
+    variable_id = Column(Integer, nullable=True)
+    # Variables change in place, so keep the value as it was at the time.
+    value = Column(Text, nullable=True)
+    occurred_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):  # pragma: no cover
+        return ("<RecordEvent(id='%s', domain_id='%s', event='%s', "
+                "record_id='%s', variable_id='%s', occurred_at='%s')>") % (
+            self.id, self.domain_id, self.event, self.record_id,
+            self.variable_id, self.occurred_at)
+
+
+class CrawlTrace(Base):
+    """Sampled per phase timings of crawling a domain, in seconds.
+
+    Phases which didn't happen, like DNS on a reused connection or parsing
+    a failed fetch, are null.  Total is the whole fetch, parse and commit
+    come after it."""
+    __tablename__ = 'crawl_traces'
+
+    id = Column(Integer, primary_key=True)
+    domain = Column(String(255), nullable=False, index=True)
+    traced_at = Column(DateTime, nullable=False, index=True)
+    file_type = Column(String(20), nullable=False, default=ADS_TXT)
+    adstxt_present = Column(Boolean, nullable=True)
+    dns = Column(Float, nullable=True)
+    connect = Column(Float, nullable=True)
+    first_byte = Column(Float, nullable=True)
+    body = Column(Float, nullable=True)
+    parse = Column(Float, nullable=True)
+    commit = Column(Float, nullable=True)
+    total = Column(Float, nullable=True)
+
+    def __repr__(self):  # pragma: no cover
+        return "<CrawlTrace(domain='%s', traced_at='%s', total='%s')>" % (
+            self.domain, self.traced_at, self.total)
+
+
+class SupplierCount(Base):
+    """Domains authorising each supplier domain, by relationship.
+
+    Kept up to date as records change, so dashboards don't need to group
+    every record.  A domain listing a supplier under several publisher ids
+    or cert authorities is counted once.  aggregates.verify checks these
+    against records."""
+    __tablename__ = 'supplier_counts'
+
+    supplier_domain = Column(String(255), primary_key=True)
+    supplier_relationship = Column(String(30), primary_key=True)
+    file_type = Column(String(20), primary_key=True, default=ADS_TXT)
+    domains = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):  # pragma: no cover
+        return ("<SupplierCount(supplier_domain='%s', "
+                "supplier_relationship='%s', file_type='%s', "
+                "domains='%s')>") % (
+            self.supplier_domain, self.supplier_relationship,
+            self.file_type, self.domains)
+
+
+class DomainRecordCount(Base):
+    """Active records listed by each domain, by relationship.
+
+    Kept up to date as records change, aggregates.verify checks these
+    against records."""
+    __tablename__ = 'domain_record_counts'
+
+    domain_id = Column(Integer, ForeignKey('domains.id'), primary_key=True)
+    domain = relationship(Domain)
+    file_type = Column(String(20), primary_key=True, default=ADS_TXT)
+    direct = Column(Integer, nullable=False, default=0)
+    reseller = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):  # pragma: no cover
+        return ("<DomainRecordCount(domain_id='%s', file_type='%s', "
+                "direct='%s', reseller='%s')>") % (
+            self.domain_id, self.file_type, self.direct, self.reseller)
+
+
+class CrawlRun(Base):
+    """Ledger of crawl cycles, one row written as each cycle finishes."""
+    __tablename__ = 'crawl_runs'
+
+    id = Column(Integer, primary_key=True)
+    crawler_tag = Column(String(255), nullable=True, index=True)
+    started_at = Column(DateTime, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=False)
+    # Domains handed to the fetchers and written to the database.
+    domains = Column(Integer, nullable=False)
+    written = Column(Integer, nullable=False)
+    # JSON object of fetch outcome to count.
+    outcomes = Column(Text, nullable=False)
+    records_added = Column(Integer, nullable=False)
+    records_removed = Column(Integer, nullable=False)
+    queue_high_water = Column(Integer, nullable=False)
+    domains_per_second = Column(Float, nullable=False)
+    # Bodies found already parsed by another domain, and those parsed.
+    parse_cache_hits = Column(Integer, nullable=False, default=0)
+    parse_cache_misses = Column(Integer, nullable=False, default=0)
 
     def __repr__(self):  # pragma: no cover
-        return "<Variable(domain='%s', key='%s', value='%s')>" % (
-            self.domain, self.key, self.value)
+        return ("<CrawlRun(crawler_tag='%s', started_at='%s', domains='%s', "
+                "domains_per_second='%s')>") % (
+            self.crawler_tag, self.started_at, self.domains,
+            self.domains_per_second)
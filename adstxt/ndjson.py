@@ -0,0 +1,100 @@
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterable, IO, Optional
+
+
+LOG = logging.getLogger(__name__)
+
+# Files are rotated once they grow past this many bytes.
+MAX_FILE_BYTES = 64 * 1024 * 1024
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def dumps(row: Dict[str, Any]) -> str:
+    """Serialise a row as a single compact line of JSON."""
+    return json.dumps(row, default=_default, separators=(',', ':'))
+
+
+class RotatingWriter:
+    """Write newline delimited JSON to stdout or rotating files.
+
+    Files are written to a directory as `<prefix>-<sequence>.ndjson`, the
+    sequence carries on from whatever is already in the directory so file
+    names are always increasing.  Readers can safely consume every file but
+    the last one.
+
+    Args:
+        path (Optional[str]): directory to write to, `-` or None for stdout.
+        prefix (str): prefix of each file name.
+        max_bytes (int): size at which a file is rotated.
+    """
+
+    def __init__(self,
+                 path: Optional[str],
+                 prefix: str,
+                 max_bytes: int = MAX_FILE_BYTES) -> None:
+        self.path = None if path in (None, '-') else path
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None  # type: Optional[IO[str]]
+        self._written = 0
+        self._sequence = 0
+
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            self._sequence = self._last_sequence()
+
+    def _last_sequence(self) -> int:
+        sequences = [0]
+        for name in os.listdir(self.path):
+            stem, ext = os.path.splitext(name)
+            if ext == '.ndjson' and stem.startswith(self.prefix + '-'):
+                try:
+                    sequences.append(int(stem[len(self.prefix) + 1:]))
+                except ValueError:
+                    continue
+        return max(sequences)
+
+    def _rotate(self) -> None:
+        if self._file:
+            self._file.close()
+        self._sequence += 1
+        file_path = os.path.join(
+            self.path, '%s-%08d.ndjson' % (self.prefix, self._sequence))
+        LOG.debug('Rotating to %r.', file_path)
+        self._file = open(file_path, 'a', encoding='utf-8')
+        self._written = 0
+
+    def write(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Write rows, rotating once the current file is full."""
+        with self._lock:
+            if not self.path:
+                for row in rows:
+                    sys.stdout.write(dumps(row) + '\n')
+                sys.stdout.flush()
+                return
+
+            for row in rows:
+                if self._file is None or self._written >= self.max_bytes:
+                    self._rotate()
+                line = dumps(row) + '\n'
+                self._file.write(line)  # type: ignore
+                self._written += len(line)
+            if self._file:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
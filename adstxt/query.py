@@ -0,0 +1,195 @@
+import collections
+import gzip
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import func
+
+import adstxt.events as events
+import adstxt.models as models
+from adstxt.export import stream
+
+
+LOG = logging.getLogger(__name__)
+
+# (supplier_domain, pub_id)
+SellerKey = Tuple[str, str]
+# (domain, supplier_relationship)
+Authorisation = Tuple[str, str]
+
+
+def authorised_domains(session,
+                       supplier_domain: str,
+                       pub_id: str) -> List[Authorisation]:
+    """Find the domains which authorise a seller, straight from SQL.
+
+    Args:
+        session (Session): SQLAlchemy session to query with.
+        supplier_domain (str): domain of the advertising system.
+        pub_id (str): sellers publisher id within the advertising system.
+
+    Returns:
+        List[Authorisation]: sorted (domain, supplier_relationship) pairs.
+    """
+    query = session.query(
+        models.Domain.name,
+        models.Record.supplier_relationship).select_from(
+            models.Record).join(models.Record.domain).join(
+                models.Record.supplier).filter(
+                    models.Supplier.domain == supplier_domain,
+                    models.Record.pub_id == pub_id,
+                    models.Record.file_type == models.ADS_TXT,
+                    models.Record.active.is_(True)).distinct()
+
+    return sorted(tuple(row) for row in query)
+
+
+class ReverseIndex:
+    """In memory index of sellers to the domains which authorise them.
+
+    The index is built from active records and then kept up to date by
+    tailing the record_events feed.  Each authorisation is reference counted
+    as a domain may list the same seller more than once with different cert
+    authorities.
+    """
+
+    def __init__(self) -> None:
+        self.feed = events.FeedCursor()
+        self._index = collections.defaultdict(
+            collections.Counter)  # type: Dict[SellerKey, collections.Counter]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def cursor(self) -> int:
+        """Newest event applied."""
+        return self.feed.position
+
+    def _add(self, key: SellerKey, value: Authorisation, count: int) -> None:
+        counter = self._index[key]
+        counter[value] += count
+        # Counts can dip below zero while an out of order insert is still to
+        # arrive, so only drop them once they balance out.
+        if counter[value] == 0:
+            del counter[value]
+            if not counter:
+                del self._index[key]
+
+    def lookup(self, supplier_domain: str,
+               pub_id: str) -> List[Authorisation]:
+        """Find the domains which authorise a seller.
+
+        Returns:
+            List[Authorisation]: sorted (domain, supplier_relationship) pairs.
+        """
+        with self._lock:
+            counter = self._index.get((supplier_domain, pub_id))
+            if not counter:
+                return []
+            return sorted(value for value, count in counter.items()
+                          if count > 0)
+
+    def build(self, session) -> None:
+        """Build the index from the records table.
+
+        The feed position is read in the same transaction as the records.
+        Under MySQL's repeatable read this is a consistent snapshot, events
+        which were visible are already reflected in the scan and anything
+        still in flight is picked up by the feed afterwards.
+        """
+        newest = session.query(
+            func.max(models.RecordEvent.id)).scalar() or 0
+        watermark = max(newest - events.SETTLE_WINDOW, 0)
+        seen = [cursor for cursor, in session.query(
+            models.RecordEvent.id).filter(
+                models.RecordEvent.id > watermark)]
+        query = session.query(
+            models.Supplier.domain,
+            models.Record.pub_id,
+            models.Domain.name,
+            models.Record.supplier_relationship).select_from(
+                models.Record).join(models.Record.domain).join(
+                    models.Record.supplier).filter(
+                        models.Record.file_type == models.ADS_TXT,
+                        models.Record.active.is_(True))
+
+        with self._lock:
+            self._index.clear()
+            for supplier_domain, pub_id, domain, relationship in stream(
+                    query):
+                self._add((supplier_domain, pub_id), (domain, relationship), 1)
+            self.feed = events.FeedCursor(watermark, seen)
+
+        LOG.info('Built reverse index of %d sellers up to cursor %d.',
+                 len(self._index), self.cursor)
+
+    def apply(self, change_events: Iterable[events.ChangeEvent]) -> None:
+        """Apply change events from the record feed.
+
+        Events are reference counts so they can be applied in any order, but
+        each must only be applied once.
+        """
+        with self._lock:
+            for event in change_events:
+                # Only ads.txt authorises sellers for the domain itself.
+                if event.file_type not in (None, models.ADS_TXT):
+                    continue
+                if event.event in (events.INSERT, events.REACTIVATE):
+                    count = 1
+                elif event.event == events.DEACTIVATE:
+                    count = -1
+                else:
+                    continue
+                self._add((event.supplier_domain, event.pub_id),
+                          (event.domain, event.supplier_relationship),
+                          count)
+
+    def refresh(self, session, batch_size: int = 10000) -> int:
+        """Catch up with the record feed.
+
+        Returns:
+            int: number of events read.
+        """
+        change_events = self.feed.read(session, batch_size)
+        self.apply(change_events)
+        return len(change_events)
+
+    def save(self, path: str) -> None:
+        """Write a gzipped snapshot which a new index can warm start from."""
+        with self._lock:
+            snapshot = {
+                'watermark': self.feed.watermark,
+                'seen': sorted(self.feed.seen),
+                'entries': [
+                    [supplier_domain, pub_id, domain, relationship, count]
+                    for (supplier_domain, pub_id), counter
+                    in self._index.items()
+                    for (domain, relationship), count in counter.items()]}
+
+        # Write to one side and move into place so readers never see a
+        # partial snapshot.
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        LOG.info('Saved reverse index snapshot at cursor %d.', self.cursor)
+
+    @classmethod
+    def load(cls, path: str) -> 'ReverseIndex':
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+
+        index = cls()
+        for supplier_domain, pub_id, domain, relationship, count in snapshot[
+                'entries']:
+            index._add((supplier_domain, pub_id), (domain, relationship),
+                       count)
+        index.feed = events.FeedCursor(snapshot['watermark'],
+                                       snapshot['seen'])
+        LOG.info('Loaded reverse index snapshot at cursor %d.', index.cursor)
+        return index
@@ -0,0 +1,231 @@
+import collections
+import datetime
+import heapq
+import logging
+import math
+import threading
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+
+LOG = logging.getLogger(__name__)
+
+# How long after a crawl a domain is due again.
+# TODO: We should get the cache control headers back off the page and use
+# that instead.  Set as 6 hours for the moment.
+RECRAWL_INTERVAL = datetime.timedelta(minutes=360)
+# First retry of a failed crawl, doubling with each failure in a row up to
+# the recrawl interval.
+RETRY_INTERVAL = datetime.timedelta(minutes=5)
+
+# Domains are split into tiers by their weight in the domain source, heaviest
+# first.  Each tier takes this share of the weighted domains, anything after
+# them or without a weight is the long tail.
+TIER_SHARES = (0.01, 0.1)
+LONG_TAIL = len(TIER_SHARES)
+# How often each tier is crawled as a fraction of the recrawl interval, the
+# long tail last.
+TIER_INTERVALS = (1 / 6, 1 / 2, 1)
+
+
+class Freshness(NamedTuple):
+    dispatched: int
+    median_lag: datetime.timedelta
+    p95_lag: datetime.timedelta
+    max_lag: datetime.timedelta
+
+
+def assign_tiers(weights: Mapping[str, int]) -> Dict[str, int]:
+    """Tier weighted domains, anything not given a tier is the long tail.
+
+    Tiers go by rank rather than weight, so they hold the same share of
+    domains whatever the scale of the weights.
+    """
+    ranked = sorted((domain for domain, weight in weights.items() if weight),
+                    key=lambda domain: (-weights[domain], domain))
+    tiers = {}  # type: Dict[str, int]
+    start = 0
+    for tier, share in enumerate(TIER_SHARES):
+        end = start + int(math.ceil(len(ranked) * share))
+        for domain in ranked[start:end]:
+            tiers[domain] = tier
+        start = end
+    return tiers
+
+
+def tier_interval(tier: int, interval: Optional[datetime.timedelta] = None
+                  ) -> datetime.timedelta:
+    """Time between crawls of a tier, given the long tails interval."""
+    return (interval or RECRAWL_INTERVAL) * TIER_INTERVALS[tier]
+
+
+class DueScheduler:
+    """Min heaps of domains keyed on the time they're next due.
+
+    Domains are popped as soon as they're due rather than waiting for the
+    next full pass over every domain.  Entries are never removed from the
+    heap in place, instead the latest due time for each domain is tracked
+    and stale heap entries are skipped as they're popped.
+
+    There's a heap for each tier.  Higher tiers are crawled more often and
+    their due domains are always popped first, so when there isn't the
+    capacity to crawl everything on time it's the long tail that falls
+    behind.
+
+    Args:
+        interval (timedelta): time between crawls of a long tail domain,
+            higher tiers are crawled more often.
+        retry_interval (timedelta): time before the first retry of a failed
+            crawl.
+    """
+
+    def __init__(self,
+                 interval: datetime.timedelta = RECRAWL_INTERVAL,
+                 retry_interval: datetime.timedelta = RETRY_INTERVAL) -> None:
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self._heaps = [
+            [] for _ in TIER_INTERVALS
+        ]  # type: List[List[Tuple[datetime.datetime, str]]]
+        # Latest due time of each scheduled domain, None while in flight.
+        self._due = {}  # type: Dict[str, Optional[datetime.datetime]]
+        # Tier of each domain which isn't in the long tail.
+        self._tiers = {}  # type: Dict[str, int]
+        self._lags = collections.defaultdict(
+            list)  # type: Dict[int, List[datetime.timedelta]]
+        # Failures in a row of domains which are being retried.
+        self._failures = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, domain: str) -> bool:
+        return domain in self._due
+
+    def tier(self, domain: str) -> int:
+        return self._tiers.get(domain, LONG_TAIL)
+
+    def interval_of(self, tier: int) -> datetime.timedelta:
+        return tier_interval(tier, self.interval)
+
+    def _push(self, domain: str, due_at: datetime.datetime) -> None:
+        self._due[domain] = due_at
+        heapq.heappush(self._heaps[self.tier(domain)], (due_at, domain))
+
+    def sync(self, domains: Iterable[Tuple[str, datetime.datetime]],
+             tiers: Optional[Mapping[str, int]] = None) -> int:
+        """Merge in the latest domains from a domain source.
+
+        New domains are scheduled at their due time, domains which are
+        already scheduled keep their place (their due_at is ignored) and
+        anything no longer in the source is dropped.  Tiers are replaced
+        outright, a domain which changes tier moves once it's next
+        rescheduled.
+
+        Args:
+            domains (Iterable[Tuple[str, datetime]]): (domain, due_at) pairs.
+            tiers (Optional[Mapping[str, int]]): tier of each domain not in
+                the long tail.
+
+        Returns:
+            int: number of new domains scheduled.
+        """
+        added = 0
+        with self._lock:
+            self._tiers = dict(tiers or {})
+            current = set()
+            for domain, due_at in domains:
+                current.add(domain)
+                if domain not in self._due:
+                    self._push(domain, due_at)
+                    added += 1
+            # Dropped domains are left in the heap and skipped when popped.
+            for domain in set(self._due).difference(current):
+                del self._due[domain]
+                self._failures.pop(domain, None)
+        return added
+
+    def reschedule(self, domain: str,
+                   crawled_at: datetime.datetime) -> None:
+        """Schedule the next crawl of a domain that's finished crawling."""
+        with self._lock:
+            self._failures.pop(domain, None)
+            # Domain was dropped from the source while it was in flight.
+            if domain not in self._due:
+                return
+            self._push(domain,
+                       crawled_at + self.interval_of(self.tier(domain)))
+
+    def retry(self, domain: str, failed_at: datetime.datetime) -> None:
+        """Schedule a domain whose crawl failed to be tried again soon.
+
+        The delay doubles with each failure in a row, but never goes past
+        the domains recrawl interval.
+        """
+        with self._lock:
+            if domain not in self._due:
+                return
+            failures = self._failures.get(domain, 0)
+            self._failures[domain] = failures + 1
+            delay = min(self.retry_interval * 2 ** failures,
+                        self.interval_of(self.tier(domain)))
+            self._push(domain, failed_at + delay)
+
+    def pop_due(self, now: datetime.datetime, limit: int) -> List[str]:
+        """Pop up to limit domains which are due.
+
+        Domains come highest tier first and most overdue first within a
+        tier.  Popped domains are in flight until they're rescheduled.
+        """
+        domains = []
+        with self._lock:
+            for tier, heap in enumerate(self._heaps):
+                while heap and len(domains) < limit:
+                    due_at, domain = heap[0]
+                    if due_at > now:
+                        break
+                    heapq.heappop(heap)
+                    # Stale entry for a rescheduled or dropped domain.
+                    if self._due.get(domain) != due_at:
+                        continue
+                    self._due[domain] = None
+                    self._lags[tier].append(now - due_at)
+                    domains.append(domain)
+        return domains
+
+    def next_due(self) -> Optional[datetime.datetime]:
+        """Get when the next domain is due, None if nothing's scheduled."""
+        next_due = None
+        with self._lock:
+            for heap in self._heaps:
+                while heap:
+                    due_at, domain = heap[0]
+                    if self._due.get(domain) == due_at:
+                        if next_due is None or due_at < next_due:
+                            next_due = due_at
+                        break
+                    heapq.heappop(heap)
+        return next_due
+
+    def freshness(self, tier: Optional[int] = None) -> Freshness:
+        """Report how late domains were dispatched since the last report.
+
+        Args:
+            tier (Optional[int]): only report on this tier, every tier is
+                reported on if not given.
+        """
+        with self._lock:
+            if tier is None:
+                lags = sorted(lag for tier_lags in self._lags.values()
+                              for lag in tier_lags)
+                self._lags.clear()
+            else:
+                lags = sorted(self._lags.pop(tier, []))
+
+        if not lags:
+            zero = datetime.timedelta(0)
+            return Freshness(0, zero, zero, zero)
+        return Freshness(dispatched=len(lags),
+                         median_lag=lags[len(lags) // 2],
+                         p95_lag=lags[int(len(lags) * 0.95)],
+                         max_lag=lags[-1])
@@ -0,0 +1,97 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+from adstxt.query import ReverseIndex
+
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between catching the index up with the record feed.
+REFRESH_INTERVAL = 5
+# Refreshes between writing a warm start snapshot.
+SNAPSHOT_EVERY = 60
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    # Set on the subclass built by make_server.
+    index = None  # type: ReverseIndex
+
+    def _respond(self, status: int, body: Any) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self._respond(200, {'cursor': self.index.cursor,
+                                'sellers': len(self.index)})
+            return
+        if url.path != '/authorised':
+            self._respond(404, {'error': 'Unknown path.'})
+            return
+
+        params = parse_qs(url.query)
+        try:
+            supplier_domain = params['supplier_domain'][0].lower()
+            pub_id = params['pub_id'][0]
+        except KeyError:
+            self._respond(400, {'error': 'supplier_domain and pub_id are '
+                                         'required.'})
+            return
+
+        domains = self.index.lookup(supplier_domain, pub_id)
+        self._respond(200, {
+            'supplier_domain': supplier_domain,
+            'pub_id': pub_id,
+            'domains': [{'domain': domain, 'relationship': relationship}
+                        for domain, relationship in domains]})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        LOG.debug(format, *args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(index: ReverseIndex, host: str, port: int) -> HTTPServer:
+    """Build a HTTP server answering reverse lookups from an index.
+
+    `GET /authorised?supplier_domain=google.com&pub_id=pub-1` returns the
+    domains which list the seller as direct or reseller.
+    """
+    handler = type('Handler', (_Handler,), {'index': index})
+    return _ThreadingHTTPServer((host, port), handler)
+
+
+def keep_fresh(index: ReverseIndex,
+               session_factory: Callable,
+               stop: threading.Event,
+               snapshot_path: Optional[str] = None,
+               interval: float = REFRESH_INTERVAL) -> None:
+    """Tail the record feed into the index until stopped."""
+    refreshes = 0
+    while not stop.wait(interval):
+        session = session_factory()
+        try:
+            applied = index.refresh(session)
+            LOG.debug('Applied %d events, index at cursor %d.',
+                      applied, index.cursor)
+        except Exception:
+            LOG.exception('Unable to refresh reverse index.')
+        finally:
+            session.close()
+
+        refreshes += 1
+        if snapshot_path and refreshes % SNAPSHOT_EVERY == 0:
+            index.save(snapshot_path)
@@ -0,0 +1,248 @@
+import datetime
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import IO, List, Optional, Tuple
+
+from adstxt.fetch import ADS_TXT, FetchResponse
+
+
+LOG = logging.getLogger(__name__)
+
+# Segments are rolled over once they grow past this many bytes.
+SEGMENT_BYTES = 16 * 1024 * 1024
+
+# Each frame is the length and crc32 of its payload followed by the payload,
+# a zlib compressed JSON array of the FetchResponse fields with the body in
+# place of its lines.
+_HEADER = struct.Struct('>II')
+
+_OFFSET_FILE = 'offset'
+
+
+def encode_payload(fetchdata: FetchResponse) -> bytes:
+    """Serialise a response without framing, decode reads it back."""
+    return zlib.compress(json.dumps(
+        [fetchdata.domain,
+         fetchdata.scraped_at.isoformat(),
+         fetchdata.adstxt_present,
+         fetchdata.body.decode('utf-8'),
+         fetchdata.timings,
+         fetchdata.outcome,
+         fetchdata.file_type],
+        separators=(',', ':')).encode('utf-8'))
+
+
+def encode(fetchdata: FetchResponse) -> bytes:
+    payload = encode_payload(fetchdata)
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(payload: bytes) -> FetchResponse:
+    # Frames spooled before file types were added don't have one, they were
+    # all ads.txt.
+    (domain, scraped_at, adstxt_present, body, timings, outcome,
+     file_type) = (json.loads(zlib.decompress(payload).decode('utf-8')) +
+                   [ADS_TXT])[:7]
+    # Older frames hold a list of lines rather than the body.
+    if isinstance(body, list):
+        body = '\n'.join(body)
+    # isoformat leaves the microseconds off when there aren't any.
+    scraped_format = ('%Y-%m-%dT%H:%M:%S.%f' if '.' in scraped_at
+                      else '%Y-%m-%dT%H:%M:%S')
+    return FetchResponse(
+        domain=domain,
+        scraped_at=datetime.datetime.strptime(scraped_at, scraped_format),
+        adstxt_present=adstxt_present,
+        body=body.encode('utf-8'),
+        timings=timings,
+        outcome=outcome,
+        file_type=file_type)
+
+
+def _read_frame(f: IO[bytes]) -> Optional[bytes]:
+    """Read the next whole frame, None at the end or on a torn write."""
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    length, crc = _HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    return payload
+
+
+class Spool:
+    """Durable append only spool of fetched domains waiting to be written.
+
+    Fetchers append responses as fast as they come in while the database
+    writer takes them off at its own pace, so a slow or unavailable database
+    holds up writes rather than the crawl.  Responses are appended to
+    numbered segment files in a directory and the writers position is kept
+    in an offset file, segments are deleted once everything in them has been
+    written.  Anything left when the crawler stops is replayed on restart.
+
+    This follows the queue.Queue interface used by the crawl loop, put None
+    to have get return None once the spool is drained.  There should only
+    be one consumer.  Writes are flushed to the OS but not synced, so a
+    crashed process loses nothing but a crashed machine may.  A response can
+    be handed out twice if the crawler dies before its offset is saved,
+    which process_domain copes with.
+
+    Args:
+        path (str): directory to keep segments in, created if missing.
+        segment_bytes (int): size at which a segment is rolled over.
+    """
+
+    def __init__(self, path: str, segment_bytes: int = SEGMENT_BYTES) -> None:
+        self.path = path
+        self.segment_bytes = segment_bytes
+        os.makedirs(path, exist_ok=True)
+
+        self._cond = threading.Condition()
+        # Frames written but not yet handed out.
+        self._available = 0
+        # Frames not yet marked done.
+        self._unfinished = 0
+        self._closed = False
+
+        self._read_segment, self._read_offset = self._load_offset()
+        # Position of the frame last handed out, saved once it's done.
+        self._done_at = (self._read_segment, self._read_offset)
+        self._reader = None  # type: Optional[IO[bytes]]
+
+        segments = self._segments()
+        self._write_segment = max(segments + [self._read_segment])
+        self._recover(segments)
+        self._oldest_segment = self._read_segment
+        self._writer = open(self._segment_path(self._write_segment), 'ab')
+
+        if self._available:
+            LOG.info('Spool has %d responses left to write.',
+                     self._available)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, '%08d.spool' % segment)
+
+    def _segments(self) -> List[int]:
+        segments = []
+        for name in os.listdir(self.path):
+            stem, ext = os.path.splitext(name)
+            if ext == '.spool' and stem.isdigit():
+                segments.append(int(stem))
+        return sorted(segments)
+
+    def _load_offset(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.path, _OFFSET_FILE)) as f:
+                segment, offset = f.read().split()
+            return int(segment), int(offset)
+        except FileNotFoundError:
+            return 1, 0
+
+    def _save_offset(self, segment: int, offset: int) -> None:
+        offset_path = os.path.join(self.path, _OFFSET_FILE)
+        with open(offset_path + '.tmp', 'w') as f:
+            f.write('%d %d' % (segment, offset))
+        os.replace(offset_path + '.tmp', offset_path)
+
+    def _recover(self, segments: List[int]) -> None:
+        """Count what's left to replay and drop any torn trailing write."""
+        for segment in segments:
+            if segment < self._read_segment:
+                # Already replayed but not yet compacted.
+                os.remove(self._segment_path(segment))
+                continue
+            with open(self._segment_path(segment), 'r+b') as f:
+                if segment == self._read_segment:
+                    f.seek(self._read_offset)
+                while True:
+                    end = f.tell()
+                    if _read_frame(f) is None:
+                        break
+                    self._available += 1
+                f.truncate(end)
+        self._unfinished = self._available
+
+    def qsize(self) -> int:
+        """Responses waiting to be handed out."""
+        with self._cond:
+            return self._available
+
+    def put(self, fetchdata: Optional[FetchResponse]) -> None:
+        """Append a response, or None to signal nothing more is coming."""
+        with self._cond:
+            if fetchdata is None:
+                self._closed = True
+                self._cond.notify_all()
+                return
+
+            self._writer.write(encode(fetchdata))
+            self._writer.flush()
+            self._available += 1
+            self._unfinished += 1
+            if self._writer.tell() >= self.segment_bytes:
+                self._writer.close()
+                self._write_segment += 1
+                self._writer = open(
+                    self._segment_path(self._write_segment), 'ab')
+            self._cond.notify_all()
+
+    def get(self, block: bool = True) -> Optional[FetchResponse]:
+        """Take the oldest response off the spool.
+
+        Returns None once the spool is drained after None was put.
+        """
+        with self._cond:
+            while not self._available:
+                if self._closed:
+                    self._closed = False
+                    return None
+                self._cond.wait()
+
+            while True:
+                if self._reader is None:
+                    self._reader = open(
+                        self._segment_path(self._read_segment), 'rb')
+                    self._reader.seek(self._read_offset)
+                payload = _read_frame(self._reader)
+                if payload is not None:
+                    break
+                # End of this segment, move on to the next.
+                self._reader.close()
+                self._reader = None
+                self._read_segment += 1
+                self._read_offset = 0
+
+            self._read_offset = self._reader.tell()
+            self._available -= 1
+            self._done_at = (self._read_segment, self._read_offset)
+        return decode(payload)
+
+    def task_done(self) -> None:
+        """Mark the last response handed out as written."""
+        with self._cond:
+            segment, offset = self._done_at
+            self._save_offset(segment, offset)
+            # Compact segments which have been completely written.
+            while self._oldest_segment < segment:
+                os.remove(self._segment_path(self._oldest_segment))
+                self._oldest_segment += 1
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def join(self) -> None:
+        """Block until every response has been written."""
+        with self._cond:
+            while self._unfinished:
+                self._cond.wait()
+
+    def close(self) -> None:
+        with self._cond:
+            self._writer.close()
+            if self._reader:
+                self._reader.close()
+                self._reader = None
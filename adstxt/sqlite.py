@@ -0,0 +1,65 @@
+import logging
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+LOG = logging.getLogger(__name__)
+
+# Page cache for each connection, in KiB.
+CACHE_SIZE_KB = 64 * 1024
+# Bytes of the database file read through memory mapping.
+MMAP_SIZE = 256 * 1024 * 1024
+# Seconds a write waits for another connection's write lock before failing
+# with "database is locked".
+BUSY_TIMEOUT = 30
+# Connections kept open, each keeps its own page cache.
+POOL_SIZE = 20
+
+# WAL lets readers carry on while a write is in progress and turns commits
+# into appends.  With it synchronous=NORMAL only syncs on checkpoints, a
+# power cut can lose the last few commits but never corrupts the database.
+PRAGMAS = ('journal_mode=WAL',
+           'synchronous=NORMAL',
+           'cache_size=-%d' % CACHE_SIZE_KB,
+           'mmap_size=%d' % MMAP_SIZE)
+
+
+def is_file(db_uri: str) -> bool:
+    """Whether db_uri is an SQLite database in a file, not in memory."""
+    url = make_url(db_uri)
+    return (url.get_backend_name() == 'sqlite' and
+            url.database not in (None, '', ':memory:'))
+
+
+def _tune(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in PRAGMAS:
+            cursor.execute('PRAGMA ' + pragma)
+    finally:
+        cursor.close()
+
+
+def tuned_engine(db_uri: str, busy_timeout: float = BUSY_TIMEOUT) -> Engine:
+    """Create an engine for an SQLite file tuned for a crawler writing it.
+
+    Connections are pooled and shared between threads, rather than opened
+    for each session, so they keep their page cache.  Reads don't start a
+    transaction and a write takes the write lock with its first statement,
+    so concurrent writers queue on the busy timeout rather than
+    deadlocking.
+
+    Args:
+        db_uri (str): sqlite:/// URI of the database file.
+        busy_timeout (float): seconds to wait for the write lock.
+    """
+    engine = create_engine(db_uri,
+                           poolclass=QueuePool,
+                           pool_size=POOL_SIZE,
+                           connect_args={'timeout': busy_timeout,
+                                         'check_same_thread': False})
+    event.listen(engine, 'connect', _tune)
+    return engine
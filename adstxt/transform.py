@@ -1,5 +1,5 @@
 import logging
-from typing import NamedTuple, Optional, Union
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
 
 LOG = logging.getLogger(__name__)
@@ -9,7 +9,7 @@ class AdsRecord(NamedTuple):
     supplier_domain: str
     pub_id: str
     supplier_relationship: str
-    cert_authority: Optional[str]
+    cert_authority: Optional[str] = None
 
 
 class AdsVariable(NamedTuple):
@@ -98,3 +98,33 @@ def process_row(row: str) -> Union[AdsRecord, AdsVariable, None]:
 
     LOG.debug('Returning record... %r', ret_val)
     return ret_val
+
+
+def parse(rows: Iterable[str]) -> Tuple[List[AdsRecord], Dict[str, str]]:
+    """Process every row of an ads.txt file.
+
+    Args:
+        rows (Iterable[str]): Raw rows from the crawler.
+
+    Returns:
+        Tuple[List[AdsRecord], Dict[str, str]]: Unique records in the order
+            they were first found, and variables where later ones override
+            earlier ones.  Records differing only by a missing or empty cert
+            authority are the same record.
+    """
+    records = {}  # type: Dict[Tuple[str, str, str, str], AdsRecord]
+    variables = {}  # type: Dict[str, str]
+
+    for row in rows:
+        processed_row = process_row(row)
+
+        if isinstance(processed_row, AdsRecord):
+            records[(processed_row.supplier_domain,
+                     processed_row.cert_authority or '',
+                     processed_row.pub_id,
+                     processed_row.supplier_relationship)] = processed_row
+        elif isinstance(processed_row, AdsVariable):
+            variables[processed_row.key] = processed_row.value
+        # Else it's nil, skip to next row.
+
+    return list(records.values()), variables
@@ -0,0 +1,103 @@
+import datetime
+import logging
+import re
+from typing import Container, Iterable, List, NamedTuple, Optional
+
+
+LOG = logging.getLogger(__name__)
+
+# Full domain records may not exceed 255 chars.
+# https://tools.ietf.org/html/rfc1034#section-3.1
+MAX_DOMAIN_LENGTH = 255
+
+# Compiled once at import, this matches the ASCII (post IDNA) form of a
+# domain.  Labels may contain underscores as plenty of real hosts do.
+DOMAIN_PATTERN = re.compile(
+    r'^(?:[a-z0-9](?:[a-z0-9-_]{0,61}[a-z0-9])?\.)+'
+    r'[a-z0-9][a-z0-9-_]{0,61}[a-z]$')
+
+# Stored with each cached invalid verdict.  Bump it whenever normalise or
+# DOMAIN_PATTERN change what they reject, verdicts from older versions are
+# dropped and their domains validated again.
+VERSION = 1
+# Cached verdicts are dropped and checked again after this long regardless.
+VERDICT_TTL = datetime.timedelta(days=30)
+
+
+class ValidationResult(NamedTuple):
+    valid: List[str]
+    invalid: List[str]
+    cached: int
+
+
+def normalise(domain: str) -> Optional[str]:
+    """Normalise a domain to its lowercase ASCII form.
+
+    Args:
+        domain (str): domain as provided by a domain source.
+
+    Returns:
+        Optional[str]: Normalised domain, None if it can't be encoded.
+    """
+    domain = domain.strip().rstrip('.').lower()
+    if not domain or len(domain) > MAX_DOMAIN_LENGTH:
+        return None
+
+    # Only pay for IDNA encoding when there is something to encode.
+    try:
+        domain.encode('ascii')
+    except UnicodeEncodeError:
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+
+    return domain
+
+
+def is_valid(domain: str) -> bool:
+    """Check if an already normalised domain is valid."""
+    return (len(domain) <= MAX_DOMAIN_LENGTH and
+            DOMAIN_PATTERN.match(domain) is not None)
+
+
+def validate_domains(domains: Iterable[str],
+                     known_invalid: Container[str]) -> ValidationResult:
+    """Validate a batch of domains, rejecting known bad ones up front.
+
+    Domains are normalised and deduplicated, keeping their input order.
+    Anything found in known_invalid is rejected without being matched
+    again.
+
+    Args:
+        domains (Iterable[str]): raw domains from a domain source.
+        known_invalid (Container[str]): domains previously found invalid.
+
+    Returns:
+        ValidationResult: valid domains, newly invalid domains and a count
+            of domains rejected from the known invalid cache.
+    """
+    valid = []
+    invalid = []
+    cached = 0
+    seen_raw = set()
+    seen_valid = set()
+
+    for raw in domains:
+        if raw in known_invalid:
+            cached += 1
+            continue
+
+        if raw in seen_raw:
+            continue
+        seen_raw.add(raw)
+
+        domain = normalise(raw)
+        if domain is None or not is_valid(domain):
+            LOG.debug('%r found to be an invalid domain.', raw)
+            invalid.append(raw)
+        elif domain not in seen_valid:
+            seen_valid.add(domain)
+            valid.append(domain)
+
+    return ValidationResult(valid=valid, invalid=invalid, cached=cached)
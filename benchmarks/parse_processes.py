@@ -0,0 +1,128 @@
+#!/usr/bin/env python3.6
+"""Benchmark parsing large ads.txt files in parse processes.
+
+Synthetic ads.txt bodies, each different so none come from the parse cache,
+are parsed from several writer threads at once.  They're parsed first in the
+writer threads themselves and then with each number of parse processes.
+Reports for each
+* bodies/s: bodies parsed per second, and the speedup over the writers.
+* loop lag: the longest an event loop ticking alongside was held up, as
+    fetching is in the crawler.
+
+Run from the repository root, exits non zero if the most processes don't
+reach --min_speedup.
+
+    python benchmarks/parse_processes.py --lines 50000 --processes 1,2,4
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from adstxt.fetch import FetchResponse  # noqa: E402
+from adstxt.main import AdsTxtCrawler, PARSE_PROCESS_MIN_BYTES  # noqa: E402
+
+
+class Result(NamedTuple):
+    processes: int
+    seconds: float
+    bodies_per_second: float
+    loop_lag: float
+
+
+def make_body(number: int, lines: int) -> FetchResponse:
+    rows = ['exchange-%d.com, pub-%d-%d, %s, %x' % (
+        line % 97, number, line, 'DIRECT' if line % 3 else 'RESELLER',
+        line) for line in range(lines)]
+    rows.append('contact=ads@publisher-%d.com' % number)
+    return FetchResponse('publisher-%d.com' % number, None, True, rows)
+
+
+class LoopLag:
+    """Tick an event loop in a thread, keeping the worst delay to a tick."""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.worst = 0.0
+        self._loop = asyncio.new_event_loop()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    async def _tick(self) -> None:
+        while not self._stopped:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.worst = max(self.worst,
+                             time.monotonic() - started - self.interval)
+
+    def _run(self) -> None:
+        self._loop.run_until_complete(self._tick())
+
+    def __enter__(self) -> 'LoopLag':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stopped = True
+        self._thread.join()
+        self._loop.close()
+
+
+def run(processes: int, bodies: List[FetchResponse], writers: int) -> Result:
+    crawler = AdsTxtCrawler(False, False, None, parse_processes=processes)
+    try:
+        if processes:
+            # Start the parse processes before timing.
+            crawler._parse(make_body(-1, PARSE_PROCESS_MIN_BYTES // 20))
+        with LoopLag() as lag, concurrent.futures.ThreadPoolExecutor(
+                writers) as executor:
+            started = time.monotonic()
+            list(executor.map(crawler._parse, bodies))
+            seconds = time.monotonic() - started
+    finally:
+        crawler.close()
+    return Result(processes, seconds, len(bodies) / seconds, lag.worst)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=50000,
+                        help='lines in each body.')
+    parser.add_argument('--bodies', type=int, default=16)
+    parser.add_argument('--processes', default='1,2,4',
+                        help='comma separated numbers of parse processes.')
+    parser.add_argument('--writers', type=int, default=None,
+                        help='writer threads, defaults to the most parse '
+                        'processes.')
+    parser.add_argument('--min_speedup', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    counts = [int(count) for count in args.processes.split(',')]
+    writers = args.writers or max(counts)
+    bodies = [make_body(number, args.lines) for number in range(args.bodies)]
+    print('%d bodies of %d lines, %.1fMB each, %d writer threads, %d cores' %
+          (len(bodies), args.lines, len(bodies[0].body) / 1024 / 1024,
+           writers, os.cpu_count() or 1))
+
+    baseline = run(0, bodies, writers)
+    results = [run(count, bodies, writers) for count in counts]
+    for result in [baseline] + results:
+        print('%-12s %7.2fs %7.2f bodies/s %5.2fx, loop lag %.3fs' % (
+            '%d processes' % result.processes if result.processes
+            else 'writers', result.seconds, result.bodies_per_second,
+            result.bodies_per_second / baseline.bodies_per_second,
+            result.loop_lag))
+
+    speedup = results[-1].bodies_per_second / baseline.bodies_per_second
+    return 0 if args.min_speedup is None or speedup >= args.min_speedup else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
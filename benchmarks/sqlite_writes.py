@@ -0,0 +1,131 @@
+#!/usr/bin/env python3.6
+"""Benchmark writing crawled domains to SQLite, default against tuned.
+
+Synthetic domains, each listing its own ads.txt records, are written from
+several writer threads into a fresh database file, once with SQLite's
+defaults and once with --sqlite_tuned.  Reports for each
+* domains/s: domains written per second, and the speedup over the defaults.
+* read: how long a query counting records took while the writes were going.
+* errors: writes which failed, "database is locked" and the like.
+
+Run from the repository root, exits non zero if the tuned mode doesn't reach
+--min_speedup.
+
+    python benchmarks/sqlite_writes.py --domains 2000 --dir /var/lib/adstxt
+"""
+import argparse
+import concurrent.futures
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from sqlalchemy.exc import SQLAlchemyError  # noqa: E402
+
+from adstxt.fetch import FetchResponse  # noqa: E402
+from adstxt.main import AdsTxtCrawler  # noqa: E402
+import adstxt.models as models  # noqa: E402
+
+
+class Result(NamedTuple):
+    mode: str
+    seconds: float
+    domains_per_second: float
+    read_seconds: float
+    errors: int
+
+
+def make_domain(number: int, records: int) -> FetchResponse:
+    rows = ['exchange-%d.com, pub-%d-%d, %s' % (
+        line % 53, number, line, 'DIRECT' if line % 3 else 'RESELLER')
+        for line in range(records)]
+    return FetchResponse('publisher-%d.com' % number,
+                         datetime.datetime.utcnow(), True, rows)
+
+
+def run(tuned: bool, domains: List[FetchResponse], writers: int,
+        directory: Optional[str] = None) -> Result:
+    with tempfile.TemporaryDirectory(dir=directory) as path:
+        crawler = AdsTxtCrawler(
+            False, False, 'sqlite:///' + os.path.join(path, 'adstxt.sqlite'),
+            crawler_id='benchmark', sqlite_tuned=tuned)
+        crawler._bootstrap_db()
+        for fetchdata in domains:
+            crawler._last_updated_at(fetchdata.domain)
+        errors = []
+        reads = []
+        done = threading.Event()
+
+        def write(fetchdata: FetchResponse) -> None:
+            try:
+                crawler.process_domain(fetchdata)
+            except SQLAlchemyError as e:
+                errors.append(e)
+
+        def read() -> None:
+            # A dashboard polling while the crawler writes.
+            while not done.is_set():
+                started = time.monotonic()
+                session = crawler._session()
+                try:
+                    session.query(models.Record).count()
+                except SQLAlchemyError as e:
+                    errors.append(e)
+                finally:
+                    session.close()
+                reads.append(time.monotonic() - started)
+                done.wait(0.05)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(writers) as executor:
+            list(executor.map(write, domains))
+        seconds = time.monotonic() - started
+        done.set()
+        reader.join()
+        crawler.close()
+        crawler.engine.dispose()
+    return Result('tuned' if tuned else 'default', seconds,
+                  len(domains) / seconds, max(reads), len(errors))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--domains', type=int, default=2000)
+    parser.add_argument('--records', type=int, default=20,
+                        help='records in each domain.')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='writer threads.')
+    parser.add_argument('--dir', default=None,
+                        help='directory to write the databases in, on the '
+                        'disk deployments use.  Syncs to a tmpfs are free.')
+    parser.add_argument('--min_speedup', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    domains = [make_domain(number, args.records)
+               for number in range(args.domains)]
+    print('%d domains of %d records, %d writer threads' % (
+        len(domains), args.records, args.writers))
+
+    baseline = run(False, domains, args.writers, args.dir)
+    tuned = run(True, domains, args.writers, args.dir)
+    for result in (baseline, tuned):
+        print('%-8s %7.2fs %8.1f domains/s %5.2fx, slowest read %.3fs, '
+              '%d errors' % (
+                  result.mode, result.seconds, result.domains_per_second,
+                  result.domains_per_second / baseline.domains_per_second,
+                  result.read_seconds, result.errors))
+
+    speedup = tuned.domains_per_second / baseline.domains_per_second
+    return 0 if args.min_speedup is None or speedup >= args.min_speedup else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3.6
+"""Benchmark how quickly the CLI starts up.
+
+Measures, each in a fresh interpreter,
+* import: importing adstxt.cli, less the interpreter's own startup.
+* first request: from launching `adstxt --cli --domain` against a local
+    server until the server sees the request for ads.txt.
+
+Run from the repository root, exits non zero if a median is over budget.
+
+    python benchmarks/startup.py --runs 5 --max_import_seconds 0.5
+"""
+import argparse
+import http.server
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+
+class AdsTxtHandler(http.server.BaseHTTPRequestHandler):
+
+    requested_at = None  # type: Optional[float]
+    requested = threading.Event()
+
+    def do_GET(self):
+        AdsTxtHandler.requested_at = time.monotonic()
+        AdsTxtHandler.requested.set()
+        body = b'google.com, pub-1, DIRECT\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _run_python(code: str, *args: str) -> float:
+    started = time.monotonic()
+    subprocess.run([sys.executable, '-c', code] + list(args), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - started
+
+
+def time_import() -> float:
+    # Take off the interpreter starting up, that's not ours to fix.
+    return _run_python('import adstxt.cli') - _run_python('pass')
+
+
+def time_first_request(server: http.server.HTTPServer, db_path: str) -> float:
+    AdsTxtHandler.requested.clear()
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'from adstxt.cli import cli; cli()',
+         '--db_uri', 'sqlite:///' + db_path,
+         '--crawler_tag', 'startup_benchmark',
+         '--cli', '--domain', 'localhost:%d' % server.server_port],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not AdsTxtHandler.requested.wait(60):
+            raise RuntimeError('The crawler never made a request.')
+    finally:
+        process.wait()
+    return AdsTxtHandler.requested_at - started
+
+
+def _report(name: str, timings: List[float],
+            budget: Optional[float]) -> bool:
+    median = statistics.median(timings)
+    print('%-14s median %.3fs, min %.3fs, max %.3fs over %d runs%s' % (
+        name, median, min(timings), max(timings), len(timings),
+        ', budget %.3fs' % budget if budget else ''))
+    return budget is None or median <= budget
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max_import_seconds', type=float, default=None)
+    parser.add_argument('--max_first_request_seconds', type=float,
+                        default=None)
+    args = parser.parse_args()
+
+    server = http.server.HTTPServer(('localhost', 0), AdsTxtHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Warm the OS caches so the first run isn't an outlier.
+    time_import()
+    import_timings = [time_import() for _ in range(args.runs)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        request_timings = [
+            time_first_request(server,
+                               os.path.join(tmpdir, 'run%d.sqlite' % run))
+            for run in range(args.runs)]
+    server.shutdown()
+
+    within_budget = _report('import', import_timings,
+                            args.max_import_seconds)
+    within_budget &= _report('first request', request_timings,
+                             args.max_first_request_seconds)
+    return 0 if within_budget else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+-- Move records.supplier_domain and records.cert_authority into suppliers.
+--
+-- create_all only creates missing tables, it won't alter an existing
+-- records table.  Run this against MySQL/MariaDB with the crawler stopped,
+-- then start the new crawler which creates any other missing tables.
+--
+-- SQLite databases can't drop columns on older versions, recreate them
+-- instead.
+
+-- 1. Suppliers, as created by adstxt.models.Supplier.
+CREATE TABLE IF NOT EXISTS suppliers (
+    id INTEGER NOT NULL AUTO_INCREMENT,
+    domain VARCHAR(255) NOT NULL,
+    cert_authority VARCHAR(255) NOT NULL DEFAULT '',
+    PRIMARY KEY (id),
+    UNIQUE (domain, cert_authority)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 2. Backfill suppliers from the distinct values on records.  A missing cert
+-- authority is stored as an empty string.  Spellings which only differ in
+-- case collapse into one supplier under the case insensitive collation.
+INSERT IGNORE INTO suppliers (domain, cert_authority)
+SELECT DISTINCT supplier_domain, COALESCE(cert_authority, '')
+FROM records;
+
+-- 3. Populate supplier_id.  On large tables run the UPDATE in id ranges so
+-- each transaction stays short, e.g. add `AND r.id BETWEEN 1 AND 100000` and
+-- step the range until it passes MAX(records.id).
+ALTER TABLE records ADD COLUMN supplier_id INTEGER NULL;
+
+UPDATE records r
+JOIN suppliers s
+    ON s.domain = r.supplier_domain
+    AND s.cert_authority = COALESCE(r.cert_authority, '')
+SET r.supplier_id = s.id
+WHERE r.supplier_id IS NULL;
+
+-- This must return 0 before carrying on.
+SELECT COUNT(*) FROM records WHERE supplier_id IS NULL;
+
+-- 4. Constrain and index supplier_id, then drop the old columns.
+ALTER TABLE records
+    MODIFY supplier_id INTEGER NOT NULL,
+    ADD CONSTRAINT records_supplier_id_fk
+        FOREIGN KEY (supplier_id) REFERENCES suppliers (id),
+    ADD INDEX ix_records_supplier_id (supplier_id),
+    ADD INDEX ix_records_domain_id_active (domain_id, active),
+    DROP COLUMN supplier_domain,
+    DROP COLUMN cert_authority;
@@ -0,0 +1,17 @@
+-- Add the file type discriminator for app-ads.txt support.
+--
+-- create_all won't alter existing tables.  Run this against MySQL/MariaDB
+-- with the crawler stopped, then start the new crawler.  Everything already
+-- stored came from ads.txt, which is the column default.
+
+ALTER TABLE domains
+    ADD COLUMN app_adstxt_present BOOL NULL;
+
+ALTER TABLE records
+    ADD COLUMN file_type VARCHAR(20) NOT NULL DEFAULT 'ads.txt';
+
+ALTER TABLE variables
+    ADD COLUMN file_type VARCHAR(20) NOT NULL DEFAULT 'ads.txt';
+
+ALTER TABLE crawl_traces
+    ADD COLUMN file_type VARCHAR(20) NOT NULL DEFAULT 'ads.txt';
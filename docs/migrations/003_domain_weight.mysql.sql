@@ -0,0 +1,8 @@
+-- Store each domain's importance from the domain source for tiered crawling.
+--
+-- create_all won't alter existing tables.  Run this against MySQL/MariaDB
+-- with the crawler stopped, then start the new crawler.  Weights are filled
+-- in as the domain source is next read.
+
+ALTER TABLE domains
+    ADD COLUMN weight BIGINT NULL;
@@ -0,0 +1,10 @@
+-- Count parse cache hits and misses in the crawl_runs ledger.
+--
+-- create_all won't alter existing tables.  Run this against MySQL/MariaDB
+-- with the crawler stopped, then start the new crawler.
+
+ALTER TABLE crawl_runs
+    ADD COLUMN parse_cache_hits INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE crawl_runs
+    ADD COLUMN parse_cache_misses INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,23 @@
+-- Aggregate tables kept up to date by the crawler, as created by
+-- adstxt.models.SupplierCount and adstxt.models.DomainRecordCount.
+--
+-- The crawler creates these itself on start up, this is here for anyone
+-- managing the schema by hand.  Either way they start out empty, run
+-- `adstxt verify` once with the crawler stopped to fill them from records.
+
+CREATE TABLE IF NOT EXISTS supplier_counts (
+    supplier_domain VARCHAR(255) NOT NULL,
+    supplier_relationship VARCHAR(30) NOT NULL,
+    file_type VARCHAR(20) NOT NULL DEFAULT 'ads.txt',
+    domains INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (supplier_domain, supplier_relationship, file_type)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS domain_record_counts (
+    domain_id INTEGER NOT NULL,
+    file_type VARCHAR(20) NOT NULL DEFAULT 'ads.txt',
+    direct INTEGER NOT NULL DEFAULT 0,
+    reseller INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (domain_id, file_type),
+    FOREIGN KEY (domain_id) REFERENCES domains (id)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,37 @@
+-- Track when records were deactivated and add the archive long inactive
+-- records are moved to, as in adstxt.models.ArchivedRecord.
+--
+-- create_all won't alter existing tables.  Run this against MySQL/MariaDB
+-- with the crawler stopped, then start the new crawler.  Records which are
+-- already inactive get the time of their last deactivate event, records
+-- with no event are never archived.
+
+ALTER TABLE records
+    ADD COLUMN deactivated_at DATETIME NULL,
+    ADD INDEX ix_records_deactivated_at (deactivated_at);
+
+UPDATE records
+JOIN (
+    SELECT record_id, MAX(occurred_at) AS occurred_at
+    FROM record_events
+    WHERE event = 'deactivate' AND record_id IS NOT NULL
+    GROUP BY record_id
+) AS deactivations ON deactivations.record_id = records.id
+SET records.deactivated_at = deactivations.occurred_at
+WHERE records.active = 0;
+
+CREATE TABLE IF NOT EXISTS records_archive (
+    id INTEGER NOT NULL,
+    domain_id INTEGER NOT NULL,
+    supplier_id INTEGER NOT NULL,
+    pub_id VARCHAR(255) NOT NULL,
+    supplier_relationship VARCHAR(30) NOT NULL,
+    file_type VARCHAR(20) NOT NULL DEFAULT 'ads.txt',
+    first_seen DATETIME NULL,
+    deactivated_at DATETIME NULL,
+    archived_at DATETIME NOT NULL,
+    PRIMARY KEY (id),
+    INDEX ix_records_archive_domain_id_file_type (domain_id, file_type),
+    FOREIGN KEY (domain_id) REFERENCES domains (id),
+    FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,9 @@
+-- Track which version of the validation rules found each cached invalid
+-- domain, as in adstxt.models.InvalidDomain.
+--
+-- create_all won't alter existing tables.  Run this against MySQL/MariaDB
+-- with the crawler stopped, then start the new crawler.  Existing verdicts
+-- are left NULL and validated again on the next cycle.
+
+ALTER TABLE invalid_domains
+    ADD COLUMN validator_version INTEGER NULL;
@@ -38,6 +38,7 @@ setup(
     version='0.1',
     install_requires=REQUIREMENTS,
     tests_require=TEST_REQUIREMENTS,
+    extras_require={'parquet': ['pyarrow']},
     packages=find_packages(exclude=['tests']),
     entry_points={'console_scripts': 'adstxt=adstxt.cli:cli'},
 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3.6
+"""Load test full crawl cycles against a simulated internet.
+
+Runs the crawler in file mode over synthetic domains served by a stub
+server farm, writing to SQLite, and reports for each cycle
+* throughput: domains fetched and written per second.
+* memory: peak resident set size of the crawler process.
+* failures: outcomes in the crawl_runs ledger against what the profile
+    says each domain should end up as.
+
+Run from the repository root, exits non zero if the outcomes don't add up.
+
+    python -m tests.harness.driver --domains 100000 --cycles 2
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+from unittest import mock
+
+from aiohttp import TCPConnector
+
+from adstxt import fetch, models, scheduler
+from adstxt.main import AdsTxtCrawler
+from tests.harness import internet
+
+
+class CycleReport(NamedTuple):
+    cycle: int
+    domains: int
+    written: int
+    seconds: float
+    domains_per_second: float
+    peak_rss_mb: float
+    outcomes: Dict[str, int]
+    expected: Dict[str, int]
+
+    @property
+    def accounted(self) -> bool:
+        return self.outcomes == self.expected
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+async def _no_backoff(seconds: float) -> None:
+    pass
+
+
+@contextlib.contextmanager
+def simulated(farm: internet.ServerFarm,
+              backoff: bool = True) -> Iterator[None]:
+    """Point the crawlers fetches at the farm and make every domain due."""
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(
+            fetch, 'TCPConnector',
+            functools.partial(TCPConnector, resolver=farm.resolver())))
+        # Every cycle crawls everything again.
+        stack.enter_context(mock.patch.object(
+            scheduler, 'RECRAWL_INTERVAL', datetime.timedelta(0)))
+        if not backoff:
+            stack.enter_context(mock.patch.object(fetch, 'sleep',
+                                                  _no_backoff))
+        yield
+
+
+def run(farm: internet.ServerFarm,
+        domains: Sequence[str],
+        workdir: str,
+        cycles: int = 1,
+        file_types: Sequence[str] = fetch.DEFAULT_FILE_TYPES,
+        backoff: bool = True,
+        timeouts: fetch.Timeouts = fetch.Timeouts(),
+        cycle_budget: Optional[float] = None) -> List[CycleReport]:
+    """Crawl domains against a running farm for a number of cycles."""
+    domains_path = os.path.join(workdir, 'domains.txt')
+    with open(domains_path, 'w') as f:
+        f.write('\n'.join(domains) + '\n')
+
+    crawler = AdsTxtCrawler(
+        False, True, 'sqlite:///' + os.path.join(workdir, 'adstxt.sqlite'),
+        file_uri=domains_path, crawler_id='adstxt_harness',
+        file_types=file_types, timeouts=timeouts, cycle_budget=cycle_budget)
+    crawler._bootstrap_db()
+    expected = internet.expected_outcomes(farm, domains, file_types)
+
+    reports = []
+    try:
+        with simulated(farm, backoff):
+            for cycle in range(1, cycles + 1):
+                started = time.monotonic()
+                crawler._run_once()
+                seconds = time.monotonic() - started
+
+                session = crawler._session()
+                run = session.query(models.CrawlRun).order_by(
+                    models.CrawlRun.id.desc()).first()
+                session.close()
+                reports.append(CycleReport(
+                    cycle=cycle,
+                    domains=run.domains,
+                    written=run.written,
+                    seconds=seconds,
+                    domains_per_second=run.domains / seconds,
+                    peak_rss_mb=_peak_rss_mb(),
+                    outcomes=json.loads(run.outcomes),
+                    expected=expected))
+    finally:
+        crawler.close()
+    return reports
+
+
+def _print_report(report: CycleReport) -> None:
+    print('cycle %d: %d domains in %.1fs, %.1f domains/s, %d written, '
+          'peak rss %.0fMB' % (
+              report.cycle, report.domains, report.seconds,
+              report.domains_per_second, report.written,
+              report.peak_rss_mb))
+    for outcome in sorted(set(report.outcomes) | set(report.expected)):
+        got = report.outcomes.get(outcome, 0)
+        wanted = report.expected.get(outcome, 0)
+        print('  %-22s %8d%s' % (
+            outcome, got, '' if got == wanted else
+            '  expected %d' % wanted))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--domains', type=int, default=10000)
+    parser.add_argument('--cycles', type=int, default=1)
+    parser.add_argument('--servers', type=int, default=4)
+    parser.add_argument('--profile', choices=sorted(internet.PROFILES),
+                        default='default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=fetch.TIMEOUT,
+                        help='seconds allowed to connect, for the first '
+                        'byte and to read the body.')
+    parser.add_argument('--domain_deadline', type=float, default=math.inf,
+                        help='seconds allowed for each domain, by default '
+                        'every attempt is made so outcomes add up.')
+    parser.add_argument('--cycle_budget', type=float, default=None,
+                        help='seconds allowed for each cycle.')
+    parser.add_argument('--file_types', default=models.ADS_TXT,
+                        help='comma separated files to fetch.')
+    parser.add_argument('--no_backoff', action='store_true',
+                        help="don't sleep between timed out attempts.")
+    args = parser.parse_args(argv)
+
+    # Slow domains get in under the timeout, timing out ones don't.
+    profile = internet.PROFILES[args.profile]._replace(
+        slow_latency=args.timeout / 2, timeout_latency=args.timeout * 3)
+    domains = [internet.domain_name(number)
+               for number in range(args.domains)]
+
+    timeouts = fetch.Timeouts(connect=args.timeout,
+                              first_byte=args.timeout,
+                              read=args.timeout,
+                              domain=args.domain_deadline)
+
+    with internet.ServerFarm(profile, args.servers, args.seed) as farm, \
+            tempfile.TemporaryDirectory() as workdir:
+        reports = run(farm, domains, workdir, cycles=args.cycles,
+                      file_types=args.file_types.split(','),
+                      backoff=not args.no_backoff, timeouts=timeouts,
+                      cycle_budget=args.cycle_budget)
+
+    for report in reports:
+        _print_report(report)
+    return 0 if all(report.accounted for report in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
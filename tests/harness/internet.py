@@ -0,0 +1,252 @@
+"""A simulated internet of synthetic domains for load testing the crawler.
+
+A farm of stub HTTP servers runs in child processes and a fake resolver
+points every synthetic domain at one of them.  Each domain behaves the same
+way every time it's fetched, picked from a Profile by hashing its name, so
+a run knows up front which outcome each domain should end up with.
+"""
+import asyncio
+import multiprocessing
+import random
+import socket
+import zlib
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+
+from adstxt import fetch
+
+
+# What a domain does when its ads.txt is asked for.
+OK = 'ok'
+SLOW = 'slow'
+TIMEOUT = 'timeout'
+REDIRECT = 'redirect'
+OFF_DOMAIN_REDIRECT = 'off_domain_redirect'
+WRONG_CONTENT_TYPE = 'wrong_content_type'
+HTML_404 = 'html_404'
+HTML_BODY = 'html_body'
+DISCONNECT = 'disconnect'
+NXDOMAIN = 'nxdomain'
+
+# The fetch outcome each behaviour should end up recorded as.
+EXPECTED_OUTCOMES = {
+    OK: fetch.OK,
+    SLOW: fetch.OK,
+    TIMEOUT: fetch.FIRST_BYTE_TIMEOUT,
+    REDIRECT: fetch.OK,
+    OFF_DOMAIN_REDIRECT: fetch.BAD_REDIRECT,
+    WRONG_CONTENT_TYPE: fetch.BAD_CONTENT_TYPE,
+    HTML_404: fetch.HTTP_ERROR,
+    HTML_BODY: fetch.HTML_CONTENT,
+    DISCONNECT: fetch.DISCONNECTED,
+    NXDOMAIN: fetch.CONNECT_ERROR,
+}
+
+# Off domain redirects hop through this many other hosts before the file is
+# served, more than the crawler accepts.
+OFF_DOMAIN_HOPS = 3
+
+_HTML_PAGE = ('<!doctype html><html><body><div class="error">'
+              'Not found</div></body></html>')
+
+
+class Profile(NamedTuple):
+    """How the simulated internet behaves.
+
+    Args:
+        behaviours (Dict[str, float]): relative weight of each behaviour.
+        latency (Tuple[float, float]): median and sigma of the lognormal
+            delay, in seconds, before any response is started.
+        slow_latency (float): extra seconds taken by SLOW domains, keep
+            this under the first byte timeout.
+        timeout_latency (float): seconds TIMEOUT domains hang for, keep
+            this over the first byte timeout.
+        records (int): records in each ads.txt served.
+    """
+    behaviours: Dict[str, float]
+    latency: Tuple[float, float] = (0.02, 0.5)
+    slow_latency: float = 1.0
+    timeout_latency: float = 30.0
+    records: int = 20
+
+
+PROFILES = {
+    # Everything works, for a throughput ceiling.
+    'clean': Profile(behaviours={OK: 1.0}),
+    # Roughly the mix seen crawling the long tail.
+    'default': Profile(behaviours={
+        OK: 0.55, SLOW: 0.05, TIMEOUT: 0.02, REDIRECT: 0.08,
+        OFF_DOMAIN_REDIRECT: 0.02, WRONG_CONTENT_TYPE: 0.03,
+        HTML_404: 0.15, HTML_BODY: 0.04, DISCONNECT: 0.02,
+        NXDOMAIN: 0.04}),
+    # Every failure in equal measure.
+    'hostile': Profile(behaviours={behaviour: 1.0
+                                   for behaviour in EXPECTED_OUTCOMES}),
+}
+
+
+def domain_name(number: int) -> str:
+    return 'harness-%06d.com' % number
+
+
+def behaviour_of(domain: str, profile: Profile, seed: int = 0) -> str:
+    """Pick the behaviour of a domain, the same one every time."""
+    rng = random.Random(zlib.crc32(domain.encode('utf-8')) ^ seed)
+    behaviours = sorted(profile.behaviours)
+    return rng.choices(
+        behaviours, [profile.behaviours[b] for b in behaviours])[0]
+
+
+def _origin(host: str) -> Tuple[str, int]:
+    """Find the domain a request was made for and how far it's redirected.
+
+    On domain redirects go to www.<domain> and off domain ones through
+    hop<n>-<label>.net hosts.
+    """
+    host = host.split(':')[0]
+    if host.startswith('www.'):
+        return host[4:], 1
+    if host.startswith('hop') and host.endswith('.net'):
+        hop, _, label = host[3:-4].partition('-')
+        return label + '.com', int(hop)
+    return host, 0
+
+
+def _ads_txt(domain: str, records: int) -> str:
+    return ''.join('exchange-%d.com, pub-%s-%d, DIRECT\n' % (
+        i % 7, domain, i) for i in range(records)) + 'contact=ops@%s\n' % (
+            domain)
+
+
+def _application(profile: Profile, seed: int) -> web.Application:
+    async def handle(request: web.Request) -> web.StreamResponse:
+        domain, hops = _origin(request.host)
+        behaviour = behaviour_of(domain, profile, seed)
+        await asyncio.sleep(random.lognormvariate(0, profile.latency[1]) *
+                            profile.latency[0])
+
+        if behaviour == SLOW:
+            await asyncio.sleep(profile.slow_latency)
+        elif behaviour == TIMEOUT:
+            await asyncio.sleep(profile.timeout_latency)
+        elif behaviour == REDIRECT and not hops:
+            raise web.HTTPMovedPermanently(
+                'http://www.%s%s' % (domain, request.path))
+        elif behaviour == OFF_DOMAIN_REDIRECT and hops < OFF_DOMAIN_HOPS:
+            raise web.HTTPFound('http://hop%d-%s.net%s' % (
+                hops + 1, domain.rsplit('.', 1)[0], request.path))
+        elif behaviour == WRONG_CONTENT_TYPE:
+            return web.json_response({'error': 'Not found'})
+        elif behaviour == HTML_404:
+            return web.Response(status=404, text=_HTML_PAGE,
+                                content_type='text/html')
+        elif behaviour == HTML_BODY:
+            return web.Response(text=_HTML_PAGE, content_type='text/plain')
+        elif behaviour == DISCONNECT:
+            request.transport.close()
+            return web.Response()
+
+        return web.Response(text=_ads_txt(domain, profile.records),
+                            content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/{file_type}', handle)
+    return app
+
+
+def _serve(profile: Profile, seed: int, ports) -> None:
+    """Run a single stub server, reporting the port it bound to."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(_application(profile, seed), access_log=None)
+    loop.run_until_complete(runner.setup())
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    site = web.SockSite(runner, sock, backlog=1024)
+    loop.run_until_complete(site.start())
+    ports.put(sock.getsockname()[1])
+    loop.run_forever()
+
+
+class ServerFarm:
+    """Stub HTTP servers, each in its own process.
+
+    Use as a context manager, the servers are stopped on the way out.
+
+    Args:
+        profile (Profile): how the servers behave.
+        servers (int): number of server processes.
+        seed (int): varies which domains behave how.
+    """
+
+    def __init__(self, profile: Profile, servers: int = 4,
+                 seed: int = 0) -> None:
+        self.profile = profile
+        self.servers = servers
+        self.seed = seed
+        self.ports = []  # type: List[int]
+        self._processes = []  # type: List[multiprocessing.Process]
+
+    def __enter__(self) -> 'ServerFarm':
+        ports = multiprocessing.Queue()  # type: multiprocessing.Queue
+        for _ in range(self.servers):
+            process = multiprocessing.Process(
+                target=_serve, args=(self.profile, self.seed, ports),
+                daemon=True)
+            process.start()
+            self._processes.append(process)
+        self.ports = [ports.get(timeout=30) for _ in self._processes]
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+
+    def resolver(self) -> 'FakeResolver':
+        return FakeResolver(self)
+
+    def behaviour_of(self, domain: str) -> str:
+        return behaviour_of(domain, self.profile, self.seed)
+
+
+class FakeResolver(AbstractResolver):
+    """Resolve every synthetic domain to a server in the farm.
+
+    Hosts are spread over the servers by hash, NXDOMAIN domains fail to
+    resolve the same way a missing domain does.
+    """
+
+    def __init__(self, farm: ServerFarm) -> None:
+        self.farm = farm
+
+    async def resolve(self, host: str, port: int = 0,
+                      family: int = socket.AF_INET) -> List[Dict]:
+        domain, _ = _origin(host)
+        if self.farm.behaviour_of(domain) == NXDOMAIN:
+            raise OSError('Domain name not found')
+        server_port = self.farm.ports[
+            zlib.crc32(host.encode('utf-8')) % len(self.farm.ports)]
+        return [{'hostname': host, 'host': '127.0.0.1', 'port': server_port,
+                 'family': socket.AF_INET, 'proto': 0, 'flags': 0}]
+
+    async def close(self) -> None:
+        pass
+
+
+def expected_outcomes(farm: ServerFarm,
+                      domains: Sequence[str],
+                      file_types: Sequence[str] = fetch.DEFAULT_FILE_TYPES
+                      ) -> Dict[str, int]:
+    """Count the outcomes a crawl of domains should record.
+
+    Every file type fetched from a domain behaves the same.
+    """
+    counts = {}  # type: Dict[str, int]
+    for domain in domains:
+        outcome = EXPECTED_OUTCOMES[farm.behaviour_of(domain)]
+        counts[outcome] = counts.get(outcome, 0) + len(file_types)
+    return counts
@@ -0,0 +1,62 @@
+import pytest
+
+from adstxt import fetch, models
+from tests.harness import driver, internet
+
+
+TIMEOUTS = fetch.Timeouts(connect=0.5, first_byte=0.5, read=0.5)
+
+
+@pytest.fixture(scope='module')
+def farm():
+    profile = internet.PROFILES['hostile']._replace(
+        latency=(0.001, 0.5), slow_latency=0.2, timeout_latency=2)
+    with internet.ServerFarm(profile, servers=2) as farm:
+        yield farm
+
+
+def test_behaviour_is_stable(farm):
+    domains = [internet.domain_name(number) for number in range(200)]
+    behaviours = [farm.behaviour_of(domain) for domain in domains]
+    assert behaviours == [farm.behaviour_of(domain) for domain in domains]
+    # The hostile profile gets round to everything.
+    assert set(behaviours) == set(internet.EXPECTED_OUTCOMES)
+
+
+def test_cycles_account_for_every_domain(farm, tmpdir):
+    domains = [internet.domain_name(number) for number in range(200)]
+
+    # A second cycle runs on a new event loop.
+    reports = driver.run(farm, domains, str(tmpdir), cycles=2,
+                         backoff=False, timeouts=TIMEOUTS)
+
+    assert [report.cycle for report in reports] == [1, 2]
+    for report in reports:
+        assert report.domains == len(domains)
+        assert report.written == len(domains)
+        assert report.outcomes == report.expected
+        assert report.accounted
+
+
+def test_file_types_are_counted(farm, tmpdir):
+    domains = [internet.domain_name(number) for number in range(50)]
+
+    report, = driver.run(farm, domains, str(tmpdir),
+                         file_types=models.FILE_TYPES, backoff=False,
+                         timeouts=TIMEOUTS)
+
+    assert sum(report.outcomes.values()) == 2 * len(domains)
+    assert report.accounted
+
+
+def test_cycle_budget_bounds_cycles(farm, tmpdir):
+    domains = [internet.domain_name(number) for number in range(200)]
+
+    # Timing out domains would take 2.5 seconds over every attempt.
+    report, = driver.run(farm, domains, str(tmpdir), backoff=False,
+                         timeouts=TIMEOUTS, cycle_budget=0.5)
+
+    cut = report.outcomes[fetch.CYCLE_BUDGET_EXCEEDED]
+    assert cut
+    assert report.written == len(domains) - cut
+    assert report.seconds < 5 * TIMEOUTS.first_byte
@@ -0,0 +1,95 @@
+import datetime
+import logging
+import multiprocessing
+import os
+from unittest import mock
+
+import pytest
+
+import adstxt.main as main
+import adstxt.models as models
+from adstxt.fetch import FetchResponse
+
+
+DOMAINS = ['domain%d.com' % i for i in range(50)]
+# The crawler is killed after this many domains are persisted.
+KILL_AFTER = 20
+USER_AGENT = 'adstxt_integration_test'
+
+
+async def fake_fetch(domain, user_agent, **kwargs):
+    return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                         ('google.com, %s, DIRECT' % domain,
+                          'appnexus.com, 1004, RESELLER'))
+
+
+def build_crawler(tmpdir):
+    domains_file = tmpdir.join('domains')
+    domains_file.write('\n'.join(DOMAINS))
+    crawler = main.AdsTxtCrawler(
+        False, True, 'sqlite:///' + tmpdir.join('db.sqlite').strpath,
+        file_uri=domains_file.strpath,
+        crawler_id=USER_AGENT,
+        checkpoint_path=tmpdir.join('checkpoint.sqlite').strpath)
+    crawler._bootstrap_db()
+    return crawler
+
+
+def crash_part_way(tmpdir):
+    crawler = build_crawler(tmpdir)
+    process_domain = crawler.process_domain
+    processed = []
+
+    def process_then_die(fetchdata):
+        process_domain(fetchdata)
+        processed.append(fetchdata.domain)
+        # Die as hard as we can, after persisting but before the checkpoint
+        # is updated for the last domain.
+        if len(processed) == KILL_AFTER:
+            os._exit(1)
+
+    crawler.process_domain = process_then_die
+    with mock.patch.object(main.fetch, 'fetch', side_effect=fake_fetch):
+        crawler._run_once()
+
+
+@pytest.mark.integration
+def test_kill_and_restart(tmpdir, caplog):
+    caplog.set_level(logging.INFO)
+
+    child = multiprocessing.get_context('fork').Process(
+        target=crash_part_way, args=(tmpdir,))
+    child.start()
+    child.join(60)
+    assert child.exitcode == 1
+
+    crawler = build_crawler(tmpdir)
+    session = crawler._session()
+    persisted = {name for name, in session.query(models.Domain.name).filter(
+        models.Domain.adstxt_present.is_(True))}
+    assert len(persisted) == KILL_AFTER
+
+    fetched = []
+
+    async def tracked_fetch(domain, user_agent):
+        fetched.append(domain)
+        return await fake_fetch(domain, user_agent)
+
+    with mock.patch.object(main.fetch, 'fetch', side_effect=tracked_fetch):
+        crawler._run_once()
+
+    # The last domain before the crash was persisted but not checkpointed,
+    # that's the only one fetched again.  Everything else is either
+    # persisted or refetched exactly once.
+    assert len(fetched) == len(set(fetched))
+    assert set(fetched) | persisted == set(DOMAINS)
+    assert len(set(fetched) & persisted) <= 1
+
+    # Every domain is now present with its records, and nothing was
+    # duplicated by the refetch.
+    assert session.query(models.Domain).filter(
+        models.Domain.adstxt_present.is_(True)).count() == len(DOMAINS)
+    assert session.query(models.Record).count() == len(DOMAINS) * 2
+    assert session.query(models.Record).filter_by(
+        active=False).count() == 0
+    assert crawler._checkpoint.pending() is None
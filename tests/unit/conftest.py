@@ -0,0 +1,39 @@
+import logging
+import os
+
+import pytest
+
+import adstxt.main as main
+import adstxt.models as models
+
+
+@pytest.fixture(scope='function')
+def adstxtcrawler(request):
+    if os.environ.get('CI'):
+        # Setup crawler using Drone database.
+        # This is from http://docs.drone.io/mysql-example/
+        db_uri = ('mysql+pymysql://root:root@'
+                  'database:3306/adstxt?charset=utf8mb4')
+    else:
+        db_uri = "sqlite:///:memory:"
+    es_uri = 'localhost'
+    crawler = main.AdsTxtCrawler(True,
+                                 False,
+                                 db_uri,
+                                 es_uri=es_uri,
+                                 es_query='{"query": true}',
+                                 es_index='adstxt_testings',
+                                 crawler_id='unit_test_ua')
+    crawler._bootstrap_db()
+    crawler._testing = True
+
+    def clean_database():
+        logging.info("Removing fixture database.")
+        # Ensure all connections are closed first.
+        crawler._session.close_all()
+        # Drop all databases.
+        models.Base.metadata.drop_all(crawler.engine)
+
+    request.addfinalizer(clean_database)
+
+    return crawler
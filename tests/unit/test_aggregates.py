@@ -0,0 +1,73 @@
+import datetime
+
+import adstxt.aggregates as aggregates
+from adstxt.fetch import FetchResponse
+import adstxt.models as models
+
+
+SCRAPED_AT = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+
+
+def _crawl(crawler, domain, rows, scraped_at=SCRAPED_AT):
+    crawler._last_updated_at(domain)
+    crawler.process_domain(FetchResponse(domain, scraped_at, True, rows))
+
+
+def _supplier_counts(session):
+    return {(row.supplier_domain, row.supplier_relationship): row.domains
+            for row in session.query(models.SupplierCount) if row.domains}
+
+
+def _domain_counts(session):
+    return {(row.domain.name, row.direct, row.reseller)
+            for row in session.query(models.DomainRecordCount).join(
+                models.Domain)}
+
+
+def test_aggregates_follow_records(adstxtcrawler):
+    # Several publisher ids for a supplier only count the domain once.
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',
+                                          'google.com, pub-2, DIRECT',
+                                          'appnexus.com, 3, RESELLER'))
+    _crawl(adstxtcrawler, 'reddit.com', ('google.com, pub-3, DIRECT',
+                                         'google.com, pub-3, DIRECT, ca'))
+
+    session = adstxtcrawler._session()
+    assert _supplier_counts(session) == {('google.com', 'direct'): 2,
+                                         ('appnexus.com', 'reseller'): 1}
+    assert _domain_counts(session) == {('weather.com', 2, 1),
+                                       ('reddit.com', 2, 0)}
+
+    # Dropping a record only drops the domain once none are left.
+    later = SCRAPED_AT + datetime.timedelta(hours=6)
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',),
+           later)
+    _crawl(adstxtcrawler, 'reddit.com', ('appnexus.com, 3, DIRECT',), later)
+
+    session = adstxtcrawler._session()
+    assert _supplier_counts(session) == {('google.com', 'direct'): 1,
+                                         ('appnexus.com', 'direct'): 1}
+    assert _domain_counts(session) == {('weather.com', 1, 0),
+                                       ('reddit.com', 1, 0)}
+    assert aggregates.verify(session) == []
+
+
+def test_verify_repairs(adstxtcrawler):
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',
+                                          'appnexus.com, 3, RESELLER'))
+    session = adstxtcrawler._session()
+    session.query(models.SupplierCount).filter_by(
+        supplier_domain='google.com').update({'domains': 5})
+    session.query(models.DomainRecordCount).delete()
+    session.commit()
+
+    mismatches = aggregates.verify(session, repair=False)
+    assert [(mismatch.table, mismatch.stored, mismatch.expected)
+            for mismatch in mismatches] == [
+                ('supplier_counts', (5,), (1,)),
+                ('domain_record_counts', (0, 0), (1, 1))]
+    assert len(aggregates.verify(session, repair=False)) == 2
+
+    assert len(aggregates.verify(session)) == 2
+    assert aggregates.verify(session) == []
+    assert _domain_counts(session) == {('weather.com', 1, 1)}
@@ -0,0 +1,40 @@
+import datetime
+
+from adstxt.archive import BlobArchive
+from adstxt.fetch import FetchResponse
+
+
+SCRAPED_AT = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+ROWS = ('google.com, pub-1, DIRECT', 'contact=ads@weather.com')
+
+
+def test_archive_round_trip(tmpdir):
+    archive = BlobArchive(tmpdir.strpath)
+    digest = archive.put(FetchResponse('weather.com', SCRAPED_AT, True, ROWS))
+    # The same body from another domain is stored once.
+    assert archive.put(FetchResponse(
+        'reddit.com', SCRAPED_AT, True, ROWS)) == digest
+    assert len(tmpdir.listdir(lambda path: path.check(dir=1))) == 1
+    # Nothing to keep when there's no body.
+    assert archive.put(FetchResponse('ebay.co.uk', SCRAPED_AT, False,
+                                     ())) is None
+
+    archived = list(archive.bodies())
+    assert [body.domain for body in archived] == ['reddit.com',
+                                                  'weather.com']
+    fetchdata = archive.load(archived[1])
+    assert fetchdata.domain == 'weather.com'
+    assert fetchdata.scraped_at == SCRAPED_AT
+    assert fetchdata.response == ROWS
+    assert fetchdata.file_type == 'ads.txt'
+
+
+def test_archive_keeps_latest(tmpdir):
+    archive = BlobArchive(tmpdir.strpath)
+    archive.put(FetchResponse('weather.com', SCRAPED_AT, True, ROWS))
+    later = SCRAPED_AT + datetime.timedelta(hours=6)
+    archive.put(FetchResponse('weather.com', later, True, ROWS[:1]))
+    archive.close()
+
+    archived = list(BlobArchive(tmpdir.strpath).bodies('weather.com'))
+    assert [body.scraped_at for body in archived] == [later]
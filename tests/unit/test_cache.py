@@ -0,0 +1,20 @@
+from adstxt.cache import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    # b is now the least recently used.
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+    assert cache.hit_rate() == 0.75
+
+
+def test_lru_cache_empty_hit_rate():
+    assert LRUCache(1).hit_rate() == 0.0
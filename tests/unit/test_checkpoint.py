@@ -0,0 +1,28 @@
+from adstxt.checkpoint import Checkpoint
+
+
+def test_checkpoint(tmpdir):
+    path = tmpdir.join('checkpoint.sqlite').strpath
+    checkpoint = Checkpoint(path)
+    assert checkpoint.pending() is None
+
+    checkpoint.start(['ebay.co.uk', 'reddit.com', 'dailymail.co.uk'])
+    checkpoint.mark_done('reddit.com')
+    assert checkpoint.progress() == (1, 3)
+    checkpoint.close()
+
+    # Reopening, as we would after a crash, gives what's left in order.
+    checkpoint = Checkpoint(path)
+    assert checkpoint.pending() == ['ebay.co.uk', 'dailymail.co.uk']
+
+    checkpoint.finish()
+    assert checkpoint.pending() is None
+    assert checkpoint.progress() == (0, 0)
+
+
+def test_checkpoint_start_replaces_cycle(tmpdir):
+    checkpoint = Checkpoint(tmpdir.join('checkpoint.sqlite').strpath)
+    checkpoint.start(['ebay.co.uk', 'reddit.com'])
+    checkpoint.start(['dailymail.co.uk'])
+
+    assert checkpoint.pending() == ['dailymail.co.uk']
@@ -0,0 +1,156 @@
+"""Test the command line entry points."""
+import datetime
+import json
+import subprocess
+import sys
+
+from click.testing import CliRunner
+import pytest
+
+from adstxt.cli import _parse_since, cli
+from adstxt.exceptions import ConfigurationError
+from adstxt.fetch import FetchResponse
+import adstxt.main as main
+
+
+FIRST_CRAWL = datetime.datetime(2018, 3, 26, 10, 55, 59)
+SECOND_CRAWL = datetime.datetime(2018, 3, 27, 10, 55, 59)
+
+
+@pytest.fixture
+def db_uri(tmpdir):
+    # The CLI builds its own engine, so it needs a database it can share.
+    db_uri = 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath
+    crawler = main.AdsTxtCrawler(False, False, db_uri)
+    crawler._bootstrap_db()
+    crawler._check_viability('weather.com')
+    crawler.process_domain(FetchResponse(
+        'weather.com', FIRST_CRAWL, True,
+        ('google.com, pub-1, DIRECT, f08c47fec0942fa0',
+         'contact=ads@weather.com')))
+    crawler.process_domain(FetchResponse(
+        'weather.com', SECOND_CRAWL, True,
+        ('google.com, pub-1, DIRECT, f08c47fec0942fa0',
+         'openx.com, 5, DIRECT',
+         'contact=ads@weather.com')))
+    crawler._session.close_all()
+    return db_uri
+
+
+def test_export(db_uri):
+    result = CliRunner().invoke(cli, [
+        '--db_uri', db_uri, 'export', '--format', 'ndjson'])
+    assert result.exit_code == 0, result.output
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert [row['supplier_domain'] for row in rows] == [
+        'google.com', 'openx.com']
+
+
+def test_export_since(db_uri):
+    result = CliRunner().invoke(cli, [
+        '--db_uri', db_uri, 'export', '--since', '2018-03-27'])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[1:] == [
+        'weather.com,openx.com,5,direct,,2018-03-27 10:55:59']
+
+
+def test_export_variables_csv(db_uri, tmpdir):
+    output = tmpdir.join('variables.csv')
+    result = CliRunner().invoke(cli, [
+        '--db_uri', db_uri, 'export', '--table', 'variables',
+        '--output', output.strpath])
+    assert result.exit_code == 0, result.output
+    assert output.read().splitlines() == [
+        'domain,key,value', 'weather.com,contact,ads@weather.com']
+
+
+def test_export_parquet_needs_output(db_uri):
+    result = CliRunner().invoke(cli, [
+        '--db_uri', db_uri, 'export', '--format', 'parquet'])
+    assert isinstance(result.exception, ConfigurationError)
+
+
+def test_crawl_needs_crawler_tag(db_uri):
+    result = CliRunner().invoke(cli, [
+        '--db_uri', db_uri, '--cli', '--domain', 'weather.com'])
+    assert isinstance(result.exception, ConfigurationError)
+    assert 'crawler tag' in str(result.exception)
+
+
+@pytest.mark.parametrize('since,expected', [
+    ('2018-03-26', datetime.datetime(2018, 3, 26)),
+    ('2018-03-26T10:55:59', datetime.datetime(2018, 3, 26, 10, 55, 59)),
+    ('2018-03-26T10:55:59.661410Z',
+     datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)),
+])
+def test_parse_since(since, expected):
+    assert _parse_since(since) == expected
+
+
+def test_parse_since_invalid():
+    with pytest.raises(ConfigurationError):
+        _parse_since('26/03/2018')
+
+
+def test_stream_without_database(mocker, tmpdir):
+    domains = tmpdir.join('domains')
+    domains.write('reddit.com\n')
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        return FetchResponse(domain, FIRST_CRAWL, True,
+                             ('google.com, pub-1, DIRECT',))
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    result = CliRunner().invoke(cli, [
+        '--crawler_tag', 'unit_test_ua', '--file', '--file_path',
+        domains.strpath, '--stream_path', '-'])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)['type']
+            for line in result.output.splitlines()] == ['fetch', 'record']
+
+
+def test_crawl_needs_database():
+    result = CliRunner().invoke(cli, [
+        '--crawler_tag', 'unit_test_ua', '--cli', '--domain', 'reddit.com'])
+    assert isinstance(result.exception, ConfigurationError)
+
+
+def test_processes_only_crawl_in_cycles(db_uri):
+    result = CliRunner().invoke(cli, [
+        '--db_uri', db_uri, '--crawler_tag', 'unit_test_ua', '--file',
+        '--file_path', 'domains', '--continuous', '--fetchers', '4'])
+    assert isinstance(result.exception, ConfigurationError)
+    assert 'processes' in str(result.exception)
+
+def test_cli_imports_lazily():
+    # Crawling dependencies are only imported by the commands using them.
+    loaded = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, adstxt.cli; print(" ".join(sorted(module for module in '
+        '("aiohttp", "elasticsearch", "raven", "tldextract") '
+        'if module in sys.modules)))'])
+    assert loaded.decode().split() == []
+
+
+def test_batch_from_stdin(db_uri, mocker):
+    async def fake_fetch(domain, user_agent, **kwargs):
+        return FetchResponse(domain, SECOND_CRAWL, True,
+                             ('google.com, pub-1, DIRECT, f08c47fec0942fa0',
+                              'appnexus.com, 1, RESELLER'),
+                             outcome='ok')
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    # weather.com was crawled recently, batches crawl it anyway.
+    result = CliRunner().invoke(cli, [
+        '--db_uri', db_uri, '--crawler_tag', 'unit_test_ua',
+        '--batch', '-'], input='weather.com\nnot a domain\n')
+    assert result.exit_code == 0, result.output
+    rows = {row['domain']: row for row in (
+        json.loads(line) for line in result.output.splitlines()
+        if line.startswith('{'))}
+    assert rows['not a domain']['outcome'] == 'invalid'
+    assert rows['weather.com']['outcome'] == 'ok'
+    assert (rows['weather.com']['added'],
+            rows['weather.com']['removed']) == (1, 1)
+    assert '1 files found, 0 missing, 0 domains errored and 1 invalid.' in (
+        result.output)
@@ -0,0 +1,96 @@
+import datetime
+
+import adstxt.coldstore as coldstore
+import adstxt.events as events
+from adstxt.fetch import FetchResponse
+import adstxt.models as models
+
+
+SCRAPED_AT = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+LATER = SCRAPED_AT + datetime.timedelta(hours=6)
+# Well past the time records need to be inactive for.
+ARCHIVE_AT = LATER + datetime.timedelta(days=31)
+
+
+def _crawl(crawler, domain, rows, scraped_at=SCRAPED_AT):
+    crawler._last_updated_at(domain)
+    return crawler.process_domain(
+        FetchResponse(domain, scraped_at, True, rows))
+
+
+def _archiver(crawler, batch_size=coldstore.BATCH_SIZE):
+    return coldstore.RecordArchiver(crawler._session,
+                                    datetime.timedelta(days=30),
+                                    batch_size=batch_size, pause=0)
+
+
+def test_archive_and_restore(adstxtcrawler):
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',
+                                          'appnexus.com, 3, RESELLER'))
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',),
+           LATER)
+
+    session = adstxtcrawler._session()
+    inactive = session.query(models.Record).filter_by(active=False).one()
+    record_id = inactive.id
+    assert inactive.deactivated_at == LATER
+    session.close()
+
+    archiver = _archiver(adstxtcrawler)
+    # Not inactive for long enough yet.
+    assert archiver.run_once(now=LATER + datetime.timedelta(days=1)) == 0
+    assert archiver.run_once(now=ARCHIVE_AT) == 1
+
+    session = adstxtcrawler._session()
+    assert [record.pub_id for record in session.query(models.Record)] == [
+        'pub-1']
+    archived = session.query(models.ArchivedRecord).one()
+    assert (archived.id, archived.pub_id, archived.archived_at) == (
+        record_id, '3', ARCHIVE_AT)
+    session.close()
+
+    # Listing it again brings it back with the same id.
+    changes = _crawl(adstxtcrawler, 'weather.com',
+                     ('google.com, pub-1, DIRECT',
+                      'appnexus.com, 3, RESELLER'),
+                     ARCHIVE_AT)
+    assert [(change.event, change.pub_id) for change in changes] == [
+        (events.REACTIVATE, '3')]
+
+    session = adstxtcrawler._session()
+    assert session.query(models.ArchivedRecord).count() == 0
+    restored = session.query(models.Record).get(record_id)
+    assert (restored.active, restored.deactivated_at,
+            restored.first_seen) == (True, None, SCRAPED_AT)
+
+
+def test_archive_in_batches(adstxtcrawler):
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',
+                                          'google.com, pub-2, DIRECT',
+                                          'appnexus.com, 3, RESELLER'))
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',),
+           LATER)
+
+    archiver = _archiver(adstxtcrawler, batch_size=1)
+    assert archiver.archive_batch(ARCHIVE_AT) == 1
+    assert archiver.run_once(now=ARCHIVE_AT) == 1
+
+    session = adstxtcrawler._session()
+    assert session.query(models.Record).count() == 1
+    assert session.query(models.ArchivedRecord).count() == 2
+
+
+def test_feed_describes_archived_records(adstxtcrawler):
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',
+                                          'appnexus.com, 3, RESELLER'))
+    _crawl(adstxtcrawler, 'weather.com', ('google.com, pub-1, DIRECT',),
+           LATER)
+    _archiver(adstxtcrawler).run_once(now=ARCHIVE_AT)
+
+    session = adstxtcrawler._session()
+    assert [(change.event, change.supplier_domain, change.pub_id,
+             change.file_type)
+            for change in events.read_since(session)
+            if change.pub_id == '3'] == [
+                (events.INSERT, 'appnexus.com', '3', 'ads.txt'),
+                (events.DEACTIVATE, 'appnexus.com', '3', 'ads.txt')]
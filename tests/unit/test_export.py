@@ -0,0 +1,87 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+from adstxt.exceptions import ConfigurationError
+from adstxt.fetch import FetchResponse
+import adstxt.export as export
+
+
+FIRST_CRAWL = datetime.datetime(2018, 3, 26, 10, 55, 59)
+SECOND_CRAWL = datetime.datetime(2018, 3, 27, 10, 55, 59)
+
+
+@pytest.fixture
+def session(adstxtcrawler):
+    for domain in ('weather.com', 'reddit.com'):
+        adstxtcrawler._check_viability(domain)
+        adstxtcrawler.process_domain(FetchResponse(
+            domain, FIRST_CRAWL, True,
+            ('google.com, pub-1, DIRECT, f08c47fec0942fa0',
+             'appnexus.com, 1004, RESELLER',
+             'contact=ads@' + domain)))
+    # Drop appnexus and add openx to weather.com.
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', SECOND_CRAWL, True,
+        ('google.com, pub-1, DIRECT, f08c47fec0942fa0',
+         'openx.com, 5, DIRECT')))
+
+    return adstxtcrawler._session()
+
+
+def test_export_csv(session):
+    out = io.StringIO()
+    assert export.export(session, out, batch_size=2) == 4
+
+    out.seek(0)
+    rows = list(csv.reader(out))
+    assert rows[0] == list(export.RECORD_FIELDS)
+    assert [row[:2] for row in rows[1:]] == [
+        ['weather.com', 'google.com'],
+        ['reddit.com', 'google.com'],
+        ['reddit.com', 'appnexus.com'],
+        ['weather.com', 'openx.com']]
+
+
+def test_export_ndjson_filters(session):
+    out = io.StringIO()
+    export.export(session, out, fmt='ndjson', supplier='google.com')
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [row['domain'] for row in rows] == ['weather.com', 'reddit.com']
+    assert rows[0]['cert_authority'] == 'f08c47fec0942fa0'
+
+    out = io.StringIO()
+    export.export(session, out, fmt='ndjson', since=FIRST_CRAWL,
+                  domain='weather.com')
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert rows == [{'domain': 'weather.com',
+                     'supplier_domain': 'openx.com',
+                     'pub_id': '5',
+                     'supplier_relationship': 'direct',
+                     'cert_authority': '',
+                     'first_seen': SECOND_CRAWL.isoformat()}]
+
+
+def test_export_variables(session):
+    out = io.StringIO()
+    assert export.export(session, out, table='variables',
+                         domain='reddit.com') == 1
+    assert out.getvalue().splitlines()[1] == (
+        'reddit.com,contact,ads@reddit.com')
+
+    with pytest.raises(ConfigurationError):
+        export.export(session, out, table='variables', supplier='google.com')
+
+
+def test_export_parquet(session, tmpdir):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    path = tmpdir.join('records.parquet').strpath
+
+    assert export.export(session, path, fmt='parquet', batch_size=3) == 4
+
+    table = parquet.read_table(path)
+    assert table.column_names == list(export.RECORD_FIELDS)
+    assert table.num_rows == 4
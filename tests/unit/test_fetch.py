@@ -1,12 +1,14 @@
+import asyncio
 from asyncio import TimeoutError
 import logging
-from unittest.mock import call
+from unittest.mock import ANY, call
 
 import pytest
 import asynctest
 from aiohttp import client_exceptions
 
 import adstxt.fetch as fetch
+import adstxt.models as models
 
 
 DUMMY_FETCH_DATA_CR = "foo\n\rbar\n\rbaz\n\r"
@@ -55,6 +57,9 @@ class MockSession():
     async def text(self):
         return self._text
 
+    async def read(self):
+        return self._text.encode('utf-8')
+
     @property
     def history(self):
         return self._history
@@ -98,6 +103,7 @@ async def test_fetch_exceptions(mocker):
 
     assert test_fetch.response == EXPECTED_RESULTS
     assert test_fetch.domain == 'localhost'
+    assert test_fetch.outcome == fetch.OK
 
     # Check we've backed off.
     assert mock_sleep_coroutine_mock.call_count == 1
@@ -119,9 +125,13 @@ async def test_fetch_client_cert_invalid_retry_www(mocker):
 
     # Assert that we go away from localhost and check www.localhost
     expected_calls = [call('http://localhost/ads.txt',
-                           headers={'User-Agent': 'testings'}),
+                           headers={'User-Agent': 'testings',
+                                    'Accept-Encoding': 'gzip'},
+                           trace_request_ctx=ANY),
                       call('http://www.localhost/ads.txt',
-                           headers={'User-Agent': 'testings'})]
+                           headers={'User-Agent': 'testings',
+                                    'Accept-Encoding': 'gzip'},
+                           trace_request_ctx=ANY)]
 
     assert mock_get.mock_calls == expected_calls
 
@@ -137,6 +147,7 @@ async def test_fetch_unicode_decode_error(mocker):
     assert test_fetch.response == ()
     assert test_fetch.domain == 'localhost'
     assert test_fetch.adstxt_present is False
+    assert test_fetch.outcome == fetch.UNICODE_ERROR
 
 
 @pytest.mark.asyncio
@@ -149,6 +160,7 @@ async def test_fetch_bad_page(mocker):
     assert test_fetch.response is ()
     assert test_fetch.domain == 'localhost'
     assert test_fetch.adstxt_present is False
+    assert test_fetch.outcome == fetch.HTML_CONTENT
 
 
 @pytest.mark.asyncio
@@ -161,6 +173,7 @@ async def test_fetch_html_content(mocker):
     assert test_fetch.response is ()
     assert test_fetch.domain == 'localhost'
     assert test_fetch.adstxt_present is False
+    assert test_fetch.outcome == fetch.BAD_CONTENT_TYPE
 
 
 @pytest.mark.asyncio
@@ -173,6 +186,7 @@ async def test_fetch_404(mocker):
     assert test_fetch.response is ()
     assert test_fetch.domain == 'localhost'
     assert test_fetch.adstxt_present is False
+    assert test_fetch.outcome == fetch.HTTP_ERROR
 
 
 class History():
@@ -264,3 +278,192 @@ async def test_fetch_redirects_bad_redirection_two_hops_off_site(mocker):
     assert test_fetch.response is ()
     assert test_fetch.domain == 'bad-redirect-domain.co.uk'
     assert test_fetch.adstxt_present is False
+    assert test_fetch.outcome == fetch.BAD_REDIRECT
+
+
+@pytest.mark.asyncio
+async def test_trace_config_times_phases():
+    from collections import defaultdict
+
+    from aiohttp import ClientSession, web
+    from aiohttp.test_utils import TestServer
+
+    async def ads_txt(request):
+        return web.Response(text=DUMMY_FETCH_DATA_NL)
+
+    app = web.Application()
+    app.router.add_get('/ads.txt', ads_txt)
+    server = TestServer(app, host='localhost')
+    await server.start_server()
+    try:
+        timings = defaultdict(float)
+        async with ClientSession(
+                trace_configs=[fetch._trace_config()]) as session:
+            async with session.get(server.make_url('/ads.txt'),
+                                   trace_request_ctx=timings) as response:
+                await response.text()
+    finally:
+        await server.close()
+
+    assert set(timings) == {'dns', 'connect', 'first_byte'}
+    assert all(value > 0 for value in timings.values())
+
+
+@pytest.mark.asyncio
+async def test_fetch_all_reuses_connection(mocker):
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    async def ads_txt(request):
+        return web.Response(text=DUMMY_FETCH_DATA_NL)
+
+    app = web.Application()
+    app.router.add_get('/ads.txt', ads_txt)
+    server = TestServer(app, host='localhost')
+    await server.start_server()
+
+    # Count connections made alongside the usual phase timings.
+    connections = []
+    trace_config = fetch._trace_config
+
+    def counting_trace_config():
+        config = trace_config()
+
+        async def on_connection_create_end(session, context, params):
+            connections.append(params)
+        config.on_connection_create_end.append(on_connection_create_end)
+        return config
+    mocker.patch.object(fetch, '_trace_config',
+                        side_effect=counting_trace_config)
+
+    try:
+        ads, app_ads = await fetch.fetch_all(
+            'localhost:%d' % server.port, USER_AGENT, models.FILE_TYPES)
+    finally:
+        await server.close()
+
+    assert (ads.file_type, ads.response) == ('ads.txt', EXPECTED_RESULTS)
+    # The missing app-ads.txt went over the same connection.
+    assert (app_ads.file_type, app_ads.outcome) == (
+        'app-ads.txt', fetch.HTTP_ERROR)
+    assert len(connections) == 1
+
+
+
+async def _stalling_server(stall_before_headers):
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    async def ads_txt(request):
+        if stall_before_headers:
+            await asyncio.sleep(5)
+        response = web.StreamResponse(headers={'Content-Type': 'text/plain'})
+        await response.prepare(request)
+        await response.write(b'foo\n')
+        await asyncio.sleep(5)
+        return response
+
+    app = web.Application()
+    app.router.add_get('/ads.txt', ads_txt)
+    server = TestServer(app, host='localhost')
+    await server.start_server()
+    return server
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('stall_before_headers, outcome', [
+    (True, fetch.FIRST_BYTE_TIMEOUT),
+    (False, fetch.READ_TIMEOUT)])
+async def test_fetch_labels_phase_timeouts(mocker, stall_before_headers,
+                                           outcome):
+    mocker.patch.object(fetch, 'sleep', asynctest.CoroutineMock())
+    server = await _stalling_server(stall_before_headers)
+    try:
+        test_fetch = await fetch.fetch(
+            'localhost:%d' % server.port, USER_AGENT,
+            timeouts=fetch.Timeouts(connect=1, first_byte=0.05, read=0.05))
+    finally:
+        await server.close()
+
+    assert test_fetch.outcome == outcome
+    assert test_fetch.adstxt_present is False
+
+
+@pytest.mark.asyncio
+async def test_fetch_labels_connect_timeout(mocker):
+    class Hanging:
+        async def __aenter__(self):
+            await asyncio.sleep(5)
+
+        async def __aexit__(self, *args):
+            pass
+
+    mocker.patch.object(fetch.ClientSession, 'get', return_value=Hanging())
+    mocker.patch.object(fetch, 'sleep', asynctest.CoroutineMock())
+
+    test_fetch = await fetch.fetch('localhost', USER_AGENT,
+                                   timeouts=fetch.Timeouts(connect=0.01))
+
+    assert test_fetch.outcome == fetch.CONNECT_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_fetch_domain_deadline(mocker):
+    server = await _stalling_server(True)
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    try:
+        # The second attempt runs into the deadline.
+        test_fetch = await fetch.fetch(
+            'localhost:%d' % server.port, USER_AGENT,
+            timeouts=fetch.Timeouts(first_byte=0.2, domain=0.3))
+    finally:
+        await server.close()
+
+    assert test_fetch.outcome == fetch.DEADLINE_EXCEEDED
+    assert loop.time() - started < 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_cycle_budget(mocker):
+    mock_get = mocker.patch.object(fetch.ClientSession, 'get')
+    loop = asyncio.get_event_loop()
+
+    ads, app_ads = await fetch.fetch_all('localhost', USER_AGENT,
+                                         models.FILE_TYPES,
+                                         cycle_deadline=loop.time() - 1)
+
+    assert (ads.outcome, app_ads.outcome) == (
+        fetch.CYCLE_BUDGET_EXCEEDED, fetch.CYCLE_BUDGET_EXCEEDED)
+    assert mock_get.call_count == 0
+
+def test_fetch_response_lines():
+    fetchdata = fetch.FetchResponse('localhost', None, True,
+                                    body=b'foo\r\n\r\n\xc3\xa9\nbaz')
+    assert list(fetchdata.lines()) == ['foo', '\xe9', 'baz']
+    assert fetchdata.response == ('foo', '\xe9', 'baz')
+    assert fetchdata.has_lines()
+    # Built from lines it's equal to the same body fetched.
+    assert fetchdata == fetch.FetchResponse('localhost', None, True,
+                                            ('foo', '\xe9', 'baz'))
+
+    replaced = fetchdata._replace(response=(), outcome=fetch.HTTP_ERROR)
+    assert not replaced.has_lines()
+    assert replaced.response is ()
+    assert replaced.outcome == fetch.HTTP_ERROR
+    assert fetchdata.outcome is None
+
+
+def test_semaphore_for_each_loop():
+    async def semaphore():
+        return fetch._semaphore()
+
+    loops = [asyncio.new_event_loop() for _ in range(2)]
+    try:
+        first, second = [loop.run_until_complete(semaphore())
+                         for loop in loops]
+        assert first is not second
+        assert loops[0].run_until_complete(semaphore()) is first
+    finally:
+        for loop in loops:
+            loop.close()
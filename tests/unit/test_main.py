@@ -1,10 +1,15 @@
 """Test core crawler functionality."""
 import datetime
+import json
 import logging
-import os
+import multiprocessing.dummy
+import threading
 
 import pytest
 
+from adstxt.checkpoint import Checkpoint
+import adstxt.events as events
+import adstxt.fetch as fetch
 from adstxt.fetch import FetchResponse
 import adstxt.main as main
 import adstxt.models as models
@@ -39,38 +44,6 @@ dailymail.co.uk
 ebay.co.uk"""
 
 
-@pytest.fixture(scope='function')
-def adstxtcrawler(request):
-    if os.environ.get('CI'):
-        # Setup crawler using Drone database.
-        # This is from http://docs.drone.io/mysql-example/
-        db_uri = ('mysql+pymysql://root:root@'
-                  'database:3306/adstxt?charset=utf8mb4')
-    else:
-        db_uri = "sqlite:///:memory:"
-    es_uri = 'localhost'
-    crawler = main.AdsTxtCrawler(True,
-                                 False,
-                                 db_uri,
-                                 es_uri=es_uri,
-                                 es_query='{"query": true}',
-                                 es_index='adstxt_testings',
-                                 crawler_id='unit_test_ua')
-    crawler._bootstrap_db()
-    crawler._testing = True
-
-    def clean_database():
-        logging.info("Removing fixture database.")
-        # Ensure all connections are closed first.
-        crawler._session.close_all()
-        # Drop all databases.
-        models.Base.metadata.drop_all(crawler.engine)
-
-    request.addfinalizer(clean_database)
-
-    return crawler
-
-
 def test_filter_for_domain(adstxtcrawler, mocker):
     pass
 
@@ -103,7 +76,7 @@ def test_check_viability_true(adstxtcrawler, mocker):
 
 def test_check_viability_bad_domain(adstxtcrawler, mocker):
     mock_validators = mocker.patch.object(
-        main.validators, 'domain',)
+        main.validate, 'is_valid',)
     mock_validators.return_value = False
 
     bad_domain = ('fooooooooooooooooooooooooooooooooooooooo'
@@ -113,15 +86,49 @@ def test_check_viability_bad_domain(adstxtcrawler, mocker):
     assert result is False, "Domain validation failed."
 
 
+def test_check_viability_caches_bad_domain(adstxtcrawler, mocker):
+    assert adstxtcrawler._check_viability('not a domain') is False
+
+    # The verdict is persisted, a fresh crawler picks it up at bootstrap.
+    adstxtcrawler._invalid_domains = set()
+    adstxtcrawler._load_invalid_domains()
+    assert 'not a domain' in adstxtcrawler._invalid_domains
+
+    # Known invalid domains never make it to validation again.
+    mock_validators = mocker.patch.object(main.validate, 'is_valid')
+    assert adstxtcrawler._check_viability('not a domain') is False
+    assert mock_validators.call_count == 0
+
+
+def test_run_once_rejects_invalid_domains(adstxtcrawler, mocker, caplog):
+    caplog.set_level(logging.INFO)
+    adstxtcrawler._mark_invalid(['known..bad'])
+    mocker.patch.object(adstxtcrawler, 'fetch_domains',
+                        return_value=['known..bad', 'new bad', 'good.com'])
+    mock_fetch = mocker.patch.object(main.fetch, 'fetch')
+    mock_fetch.side_effect = Exception('Not crawling here.')
+
+    adstxtcrawler._run_once()
+
+    mock_fetch.assert_called_once_with(
+        'good.com', 'unit_test_ua', timeouts=fetch.Timeouts(),
+        cycle_deadline=None)
+    assert 'new bad' in adstxtcrawler._invalid_domains
+    assert ('Rejected 2 invalid domains this cycle, 1 of these '
+            'were already known to be invalid.') in caplog.text
+
+
 def test_query_domains(adstxtcrawler, mocker, caplog):
     caplog.set_level(logging.INFO)
 
-    mock_es = mocker.patch.object(adstxtcrawler.es, 'search')
+    mock_es = mocker.patch.object(adstxtcrawler.es_client, 'search')
     mock_es.return_value = {
-        'aggregations': {'top_domains': {'buckets': [{'key': 'foo.com'}]}}}
+        'aggregations': {'top_domains': {'buckets': [
+            {'key': 'foo.com', 'doc_count': 12}]}}}
 
     assert adstxtcrawler._query_for_domains(
         'index', '{"query": true}') == ['foo.com']
+    assert adstxtcrawler._weights == {'foo.com': 12}
 
 
 def test_broken_fetch_sentry_1023(adstxtcrawler, mocker, caplog):
@@ -170,6 +177,42 @@ def test_fetch_from_file(adstxtcrawler, tmpdir):
     assert expected_domains == domains
 
 
+def test_run_once_tiers_by_weight(adstxtcrawler, mocker, tmpdir):
+    domains_file = tmpdir.join('domains')
+    domains_file.write('tail.com\nlight.com,10\nheavy.com,5000\n'
+                       'bad.com,lots\n')
+    adstxtcrawler.file = True
+    adstxtcrawler.file_uri = domains_file.strpath
+    fetched = []
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        fetched.append(domain)
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             ('google.com, pub-1, DIRECT',))
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    adstxtcrawler._run_once()
+
+    # Heaviest first, then in the order of the file.
+    assert fetched == ['heavy.com', 'light.com', 'tail.com', 'bad.com']
+    session = adstxtcrawler._session()
+    assert dict(session.query(models.Domain.name, models.Domain.weight)) == {
+        'heavy.com': 5000, 'light.com': 10, 'tail.com': None,
+        'bad.com': None}
+
+    # The top tier comes due again long before the long tail.
+    mocker.patch.object(main.scheduler, 'RECRAWL_INTERVAL',
+                        datetime.timedelta(seconds=60))
+    session.query(models.Domain).update(
+        {'last_updated': datetime.datetime.utcnow() -
+         datetime.timedelta(seconds=20)})
+    session.commit()
+    domains_file.write('tail.com\nlight.com,10\nheavy.com,4000\n')
+    assert adstxtcrawler._cycle_domains() == ['heavy.com']
+    assert session.query(models.Domain.weight).filter_by(
+        name='heavy.com').scalar() == 4000
+
+
 def test_deactivate_reactivate(adstxtcrawler, caplog):
     caplog.set_level(logging.DEBUG)
     adstxtcrawler._bootstrap_db()
@@ -208,23 +251,25 @@ def test_deactivate_reactivate(adstxtcrawler, caplog):
     adstxtcrawler.process_domain(correct)
     # Assert it's inserted.
     correct_record = session.query(
-        models.Record.supplier_domain,
+        models.Supplier.domain,
         models.Record.pub_id,
         models.Record.supplier_relationship,
-        models.Record.cert_authority,
-        models.Record.active).one_or_none()
+        models.Supplier.cert_authority,
+        models.Record.active).select_from(
+            models.Record).join(models.Record.supplier).one_or_none()
     logging.info(correct_record)
     assert correct_record.active is True
 
     adstxtcrawler.process_domain(mistake)
     # Assert it's now inactive.
     mistake_record = session.query(
-        models.Record.supplier_domain,
+        models.Supplier.domain,
         models.Record.pub_id,
         models.Record.supplier_relationship,
-        models.Record.cert_authority,
-        models.Record.active).filter_by(
-            supplier_domain='amazon-adsystem.com'
+        models.Supplier.cert_authority,
+        models.Record.active).select_from(
+            models.Record).join(models.Record.supplier).filter(
+            models.Supplier.domain == 'amazon-adsystem.com'
     ).one_or_none()
     logging.info(mistake_record)
     # Record should be disable now.
@@ -233,12 +278,13 @@ def test_deactivate_reactivate(adstxtcrawler, caplog):
     adstxtcrawler.process_domain(fixed)
     # Assert it's reactivated.
     fixed_record = session.query(
-        models.Record.supplier_domain,
+        models.Supplier.domain,
         models.Record.pub_id,
         models.Record.supplier_relationship,
-        models.Record.cert_authority,
-        models.Record.active).filter_by(
-            supplier_domain='amazon-adsystem.com'
+        models.Supplier.cert_authority,
+        models.Record.active).select_from(
+            models.Record).join(models.Record.supplier).filter(
+            models.Supplier.domain == 'amazon-adsystem.com'
     ).one_or_none()
     logging.info(fixed_record)
     # Check that's again set to active.
@@ -283,23 +329,25 @@ def test_deactivate_reactivate_new_cert_authority(adstxtcrawler, caplog):
     adstxtcrawler.process_domain(correct)
     # Assert it's inserted.
     correct_record = session.query(
-        models.Record.supplier_domain,
+        models.Supplier.domain,
         models.Record.pub_id,
         models.Record.supplier_relationship,
-        models.Record.cert_authority,
-        models.Record.active).one()
+        models.Supplier.cert_authority,
+        models.Record.active).select_from(
+            models.Record).join(models.Record.supplier).one()
     logging.info('Correct Record: %r.', correct_record)
     assert correct_record.active is True
 
     adstxtcrawler.process_domain(mistake)
     # Assert it's now inactive.
     mistake_record = session.query(
-        models.Record.supplier_domain,
+        models.Supplier.domain,
         models.Record.pub_id,
         models.Record.supplier_relationship,
-        models.Record.cert_authority,
-        models.Record.active).filter_by(
-            supplier_domain='amazon-adsystem.com'
+        models.Supplier.cert_authority,
+        models.Record.active).select_from(
+            models.Record).join(models.Record.supplier).filter(
+            models.Supplier.domain == 'amazon-adsystem.com'
     ).one()
     logging.info('Mistake record: %r.', mistake_record)
     # Record should be disable now.
@@ -310,26 +358,595 @@ def test_deactivate_reactivate_new_cert_authority(adstxtcrawler, caplog):
     adstxtcrawler.process_domain(fixed)
     # Assert it's reactivated.
     fixed_record = session.query(
-        models.Record.supplier_domain,
+        models.Supplier.domain,
         models.Record.pub_id,
         models.Record.supplier_relationship,
-        models.Record.cert_authority,
-        models.Record.active).filter_by(
-            supplier_domain='amazon-adsystem.com',
-            cert_authority='asdasdasd'
+        models.Supplier.cert_authority,
+        models.Record.active).select_from(
+            models.Record).join(models.Record.supplier).filter(
+            models.Supplier.domain == 'amazon-adsystem.com',
+            models.Supplier.cert_authority == 'asdasdasd'
     ).one()
     logging.info('Fixed record: %r.', fixed_record)
     # Check that's again set to active.
     assert fixed_record.active is True
 
     fixed_record_inactive = session.query(
-        models.Record.supplier_domain,
+        models.Supplier.domain,
         models.Record.pub_id,
         models.Record.supplier_relationship,
-        models.Record.cert_authority,
-        models.Record.active).filter_by(
-            supplier_domain='amazon-adsystem.com',
-            cert_authority=None
+        models.Supplier.cert_authority,
+        models.Record.active).select_from(
+            models.Record).join(models.Record.supplier).filter(
+            models.Supplier.domain == 'amazon-adsystem.com',
+            models.Supplier.cert_authority == ''
     ).one()
     logging.info('Fixed inactive record: %r.', mistake_record)
     assert fixed_record_inactive.active is False
+
+
+def test_suppliers_shared_across_domains(adstxtcrawler):
+    scraped_at = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+    for domain in ('weather.com', 'reddit.com'):
+        adstxtcrawler._check_viability(domain)
+        adstxtcrawler.process_domain(FetchResponse(
+            domain, scraped_at, True,
+            ('google.com, pub-1, DIRECT, f08c47fec0942fa0',
+             'google.com, pub-2, RESELLER, f08c47fec0942fa0',
+             'appnexus.com, 1004, DIRECT')))
+
+    session = adstxtcrawler._session()
+    suppliers = session.query(
+        models.Supplier.domain, models.Supplier.cert_authority).all()
+    assert sorted(suppliers) == [('appnexus.com', ''),
+                                 ('google.com', 'f08c47fec0942fa0')]
+    assert session.query(models.Record).count() == 6
+
+    # A fresh crawler without the in process cache resolves the same ids.
+    adstxtcrawler._supplier_ids = {}
+    google = session.query(models.Supplier.id).filter_by(
+        domain='google.com').scalar()
+    assert adstxtcrawler._supplier_id(
+        'google.com', 'f08c47fec0942fa0') == google
+    assert session.query(models.Supplier).count() == 2
+
+
+def test_file_types_kept_apart(adstxtcrawler):
+    scraped_at = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+    adstxtcrawler._check_viability('weather.com')
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, True,
+        ('google.com, pub-1, DIRECT', 'contact=ads@weather.com')))
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, True,
+        ('google.com, pub-2, DIRECT', 'contact=apps@weather.com'),
+        file_type=models.APP_ADS_TXT))
+
+    session = adstxtcrawler._session()
+    # The app-ads.txt didn't deactivate anything from the ads.txt.
+    assert sorted(session.query(
+        models.Record.file_type, models.Record.pub_id).filter_by(
+            active=True)) == [('ads.txt', 'pub-1'), ('app-ads.txt', 'pub-2')]
+    assert sorted(session.query(
+        models.Variable.file_type, models.Variable.value)) == [
+            ('ads.txt', 'ads@weather.com'),
+            ('app-ads.txt', 'apps@weather.com')]
+
+    # A missing app-ads.txt only clears its own flag.
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, False, (), file_type=models.APP_ADS_TXT))
+    domain = session.query(models.Domain).one()
+    session.refresh(domain)
+    assert domain.adstxt_present is True
+    assert domain.app_adstxt_present is False
+
+
+def test_run_once_fetches_file_types(mocker, tmpdir):
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua', file_types=models.FILE_TYPES)
+    adstxtcrawler._bootstrap_db()
+    mocker.patch.object(adstxtcrawler, 'fetch_domains',
+                        return_value=['weather.com'])
+
+    async def fake_fetch_all(domain, user_agent, file_types, timeouts,
+                             cycle_deadline):
+        return [FetchResponse(domain, datetime.datetime.utcnow(), True,
+                              ('google.com, pub-1, DIRECT',),
+                              file_type=file_type)
+                for file_type in file_types]
+    mocker.patch.object(main.fetch, 'fetch_all', side_effect=fake_fetch_all)
+
+    adstxtcrawler._run_once()
+
+    session = adstxtcrawler._session()
+    assert sorted(session.query(models.Record.file_type)) == [
+        ('ads.txt',), ('app-ads.txt',)]
+
+
+def test_replay(tmpdir):
+    archive_path = tmpdir.join('archive').strpath
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('crawl.sqlite').strpath,
+        crawler_id='unit_test_ua', archive_path=archive_path)
+    adstxtcrawler._bootstrap_db()
+    scraped_at = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+    for domain in ('weather.com', 'reddit.com'):
+        adstxtcrawler._check_viability(domain)
+        adstxtcrawler._write(FetchResponse(
+            domain, scraped_at, True,
+            ('google.com, pub-1, DIRECT', 'contact=ads@%s' % domain)))
+    adstxtcrawler.close()
+
+    # Replaying into a fresh database gives the same records.
+    replayer = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('replay.sqlite').strpath,
+        archive_path=archive_path)
+    replayer._bootstrap_db()
+    assert replayer.replay(workers=2) == 2
+
+    session = replayer._session()
+    assert sorted(session.query(
+        models.Domain.name, models.Record.pub_id,
+        models.Record.first_seen).join(models.Record.domain)) == [
+            ('reddit.com', 'pub-1', scraped_at),
+            ('weather.com', 'pub-1', scraped_at)]
+    assert session.query(models.Variable).count() == 2
+    replayer.close()
+
+
+def test_change_feed(adstxtcrawler, tmpdir):
+    adstxtcrawler._event_sink = events.NDJSONEventSink(tmpdir.strpath)
+    scraped_at = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+    adstxtcrawler._check_viability('weather.com')
+
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, True,
+        ('amazon-adsystem.com, 1004, DIRECT',
+         'appnexus.com, 2678, RESELLER',
+         'contact=ads@weather.com')))
+    # Nothing changes, nothing is written to the feed.
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, True,
+        ('amazon-adsystem.com, 1004, DIRECT',
+         'appnexus.com, 2678, RESELLER',
+         'contact=ads@weather.com')))
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, True,
+        ('amazon-adsystem.com, 1004, DIRECT',
+         'contact=adops@weather.com')))
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, True,
+        ('amazon-adsystem.com, 1004, DIRECT',
+         'appnexus.com, 2678, RESELLER',
+         'contact=adops@weather.com')))
+
+    session = adstxtcrawler._session()
+    feed = events.read_since(session)
+    assert [(e.event, e.supplier_domain, e.key) for e in feed] == [
+        ('insert', 'amazon-adsystem.com', None),
+        ('insert', 'appnexus.com', None),
+        ('variable_insert', None, 'contact'),
+        ('variable_update', None, 'contact'),
+        ('deactivate', 'appnexus.com', None),
+        ('reactivate', 'appnexus.com', None)]
+    # Variable events keep the value as it was at the time.
+    assert feed[2].value == 'ads@weather.com'
+    assert feed[3].value == 'adops@weather.com'
+
+    # Tailing from a cursor only returns what's new.
+    cursors = [event.cursor for event in feed]
+    assert cursors == sorted(cursors)
+    assert events.read_since(session, cursors[3]) == feed[4:]
+
+    # The file sink gets the same events.
+    lines = []
+    for path in sorted(tmpdir.listdir()):
+        lines.extend(json.loads(line) for line in path.readlines())
+    assert [line['cursor'] for line in lines] == cursors
+
+
+
+def test_feed_cursor_out_of_order(adstxtcrawler):
+    adstxtcrawler._check_viability('weather.com')
+    session = adstxtcrawler._session()
+    domain_id = session.query(models.Domain.id).scalar()
+    occurred_at = datetime.datetime(2018, 3, 26, 10, 55, 59)
+
+    def commit_event(event_id):
+        writer = adstxtcrawler._session()
+        writer.add(models.RecordEvent(
+            id=event_id, domain_id=domain_id, event=events.VARIABLE_INSERT,
+            occurred_at=occurred_at))
+        writer.commit()
+        writer.close()
+
+    feed = events.FeedCursor(window=3)
+    # Two writers are handed ids 1 and 2, the second commits first.
+    commit_event(2)
+    assert [e.cursor for e in feed.read(session)] == [2]
+    commit_event(1)
+    assert [e.cursor for e in feed.read(session)] == [1]
+    assert feed.read(session) == []
+
+    # Once far enough behind, ids are settled and no longer re-read.
+    for event_id in range(3, 8):
+        commit_event(event_id)
+    assert [e.cursor for e in feed.read(session, limit=2)] == [3, 4, 5, 6, 7]
+    assert feed.watermark == 4
+    assert feed.seen == {5, 6, 7}
+    assert feed.position == 7
+
+def test_run_once_checkpoint(adstxtcrawler, mocker, tmpdir):
+    adstxtcrawler._checkpoint = Checkpoint(
+        tmpdir.join('checkpoint.sqlite').strpath)
+    # An unfinished cycle is resumed rather than asking for domains again.
+    adstxtcrawler._checkpoint.start(['reddit.com', 'ebay.co.uk'])
+    adstxtcrawler._checkpoint.mark_done('reddit.com')
+    adstxtcrawler._check_viability('ebay.co.uk')
+    mock_domains = mocker.patch.object(adstxtcrawler, 'fetch_domains')
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             ('google.com, pub-1, DIRECT',))
+    mock_fetch = mocker.patch.object(main.fetch, 'fetch',
+                                     side_effect=fake_fetch)
+
+    adstxtcrawler._run_once()
+
+    assert mock_domains.call_count == 0
+    mock_fetch.assert_called_once_with(
+        'ebay.co.uk', 'unit_test_ua', timeouts=fetch.Timeouts(),
+        cycle_deadline=None)
+    assert adstxtcrawler._checkpoint.pending() is None
+
+
+def test_mark_invalid_conflict(adstxtcrawler):
+    # Another crawler has already cached one of the domains.
+    adstxtcrawler._mark_invalid(['bad one'])
+    adstxtcrawler._invalid_domains = set()
+
+    adstxtcrawler._mark_invalid(['bad one', 'bad two', 'bad three'])
+
+    session = adstxtcrawler._session()
+    assert sorted(name for name, in session.query(
+        models.InvalidDomain.name)) == ['bad one', 'bad three', 'bad two']
+
+
+def test_run_continuous(mocker, tmpdir):
+    # Sources are refreshed and domains written from other threads, which
+    # each get their own in memory database, so use a file instead.
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua')
+    adstxtcrawler._bootstrap_db()
+    mocker.patch.object(main, 'DISPATCH_INTERVAL', 0.01)
+    mocker.patch.object(main, 'SOURCE_REFRESH_INTERVAL', 0.05)
+    sources = [['reddit.com', 'ebay.co.uk'],
+               ['reddit.com', 'ebay.co.uk', 'dailymail.co.uk']]
+    mocker.patch.object(adstxtcrawler, 'fetch_domains',
+                        side_effect=lambda: sources[0])
+    # Recently crawled domains aren't due yet.
+    adstxtcrawler._last_updated_at('ebay.co.uk')
+    session = adstxtcrawler._session()
+    session.query(models.Domain).filter_by(name='ebay.co.uk').one(
+        ).last_updated = datetime.datetime.utcnow()
+    session.commit()
+
+    fetched = []
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        fetched.append(domain)
+        if len(fetched) == 1:
+            # New domains are merged in on the next source refresh.
+            sources.pop(0)
+        elif len(fetched) == 2:
+            adstxtcrawler._stop.set()
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             ('google.com, pub-1, DIRECT',))
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    adstxtcrawler._run_continuous()
+
+    assert fetched == ['reddit.com', 'dailymail.co.uk']
+    assert session.query(models.Record).count() == 2
+
+
+def test_run_continuous_stops_on_error(mocker, tmpdir):
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua')
+    adstxtcrawler._bootstrap_db()
+    mocker.patch.object(main, 'DISPATCH_INTERVAL', 0.01)
+    mocker.patch.object(adstxtcrawler, 'fetch_domains',
+                        return_value=['reddit.com'])
+    mocker.patch.object(main.scheduler.DueScheduler, 'freshness',
+                        side_effect=RuntimeError('boom'))
+    mocker.patch.object(main, 'FRESHNESS_REPORT_INTERVAL', 0)
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             ('google.com, pub-1, DIRECT',))
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    # The error escapes, but the writer is still shut down cleanly rather
+    # than leaving the process hanging.
+    with pytest.raises(RuntimeError):
+        adstxtcrawler._run_continuous()
+    assert 'adstxt-writer' not in [
+        thread.name for thread in threading.enumerate()]
+
+
+def test_run_stream(mocker, tmpdir):
+    # No database at all, everything goes to the stream.
+    crawler = main.AdsTxtCrawler(False, False, None,
+                                 crawler_id='unit_test_ua',
+                                 stream_path=tmpdir.strpath)
+    scraped_at = datetime.datetime(2018, 3, 26, 10, 55, 59)
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        if domain == 'ebay.co.uk':
+            return FetchResponse(domain, scraped_at, False, ())
+        return FetchResponse(domain, scraped_at, True, (
+            'google.com, pub-1, DIRECT',
+            'google.com, pub-1, DIRECT',
+            'contact=ads@' + domain))
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    assert crawler.run_stream(['reddit.com', 'ebay.co.uk', 'bad one']) == 2
+
+    lines = [json.loads(line)
+             for path in tmpdir.listdir() for line in path.readlines()]
+    by_domain = sorted(lines, key=lambda line: (line['domain'],
+                                                line['type']))
+    assert [(line['domain'], line['type']) for line in by_domain] == [
+        ('ebay.co.uk', 'fetch'),
+        ('reddit.com', 'fetch'),
+        ('reddit.com', 'record'),
+        ('reddit.com', 'variable')]
+    assert by_domain[1]['records'] == 1
+    assert by_domain[2] == {
+        'type': 'record', 'domain': 'reddit.com', 'file_type': 'ads.txt',
+        'scraped_at': '2018-03-26T10:55:59', 'supplier_domain': 'google.com',
+        'pub_id': 'pub-1', 'supplier_relationship': 'direct',
+        'cert_authority': None}
+
+
+def test_process_domain_traces(adstxtcrawler):
+    scraped_at = datetime.datetime(2018, 3, 26, 10, 55, 59)
+    for domain in ('weather.com', 'reddit.com', 'ebay.co.uk'):
+        adstxtcrawler._check_viability(domain)
+
+    # Nothing is sampled, but slow domains are always kept.
+    adstxtcrawler.process_domain(FetchResponse(
+        'weather.com', scraped_at, True, ('google.com, pub-1, DIRECT',),
+        {'connect': 0.1, 'first_byte': 0.2, 'total': 0.3}))
+    adstxtcrawler.process_domain(FetchResponse(
+        'reddit.com', scraped_at, False, (),
+        {'dns': 1.0, 'total': main.SLOW_TRACE_SECONDS}))
+    adstxtcrawler.trace_sample_rate = 1.0
+    adstxtcrawler.process_domain(FetchResponse(
+        'ebay.co.uk', scraped_at, True, ('google.com, pub-1, DIRECT',),
+        {'connect': 0.1, 'first_byte': 0.2, 'body': 0.1, 'total': 0.4}))
+
+    session = adstxtcrawler._session()
+    traces = {trace.domain: trace
+              for trace in session.query(models.CrawlTrace)}
+    assert sorted(traces) == ['ebay.co.uk', 'reddit.com']
+    assert traces['reddit.com'].dns == 1.0
+    assert traces['reddit.com'].parse is None
+    assert traces['reddit.com'].commit > 0
+    assert traces['ebay.co.uk'].first_byte == 0.2
+    assert traces['ebay.co.uk'].parse > 0
+    assert traces['ebay.co.uk'].adstxt_present
+
+
+def test_run_once_records_run(mocker, tmpdir):
+    # The writer thread needs to see the same database.
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua')
+    adstxtcrawler._bootstrap_db()
+    mocker.patch.object(adstxtcrawler, 'fetch_domains', return_value=[
+        'reddit.com', 'ebay.co.uk', 'dailymail.co.uk'])
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        if domain == 'dailymail.co.uk':
+            raise RuntimeError('boom')
+        if domain == 'ebay.co.uk':
+            return FetchResponse(domain, datetime.datetime.utcnow(), False,
+                                 (), outcome=main.fetch.HTTP_ERROR)
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             ('google.com, pub-1, DIRECT',
+                              'google.com, pub-2, DIRECT'),
+                             outcome=main.fetch.OK)
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    adstxtcrawler._run_once()
+
+    session = adstxtcrawler._session()
+    run = session.query(models.CrawlRun).one()
+    assert run.crawler_tag == 'unit_test_ua'
+    assert (run.domains, run.written) == (3, 2)
+    assert json.loads(run.outcomes) == {
+        'ok': 1, 'http_error': 1, 'fetch_error': 1}
+    assert (run.records_added, run.records_removed) == (2, 0)
+    assert run.queue_high_water >= 1
+    assert run.finished_at >= run.started_at
+
+
+def test_run_once_leaves_domains_over_budget(mocker, tmpdir):
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua', cycle_budget=60)
+    adstxtcrawler._bootstrap_db()
+    mocker.patch.object(adstxtcrawler, 'fetch_domains', return_value=[
+        'reddit.com', 'ebay.co.uk'])
+    deadlines = []
+
+    async def fake_fetch(domain, user_agent, timeouts, cycle_deadline):
+        deadlines.append(cycle_deadline)
+        if domain == 'ebay.co.uk':
+            return FetchResponse(domain, datetime.datetime.utcnow(), False,
+                                 (), outcome=fetch.CYCLE_BUDGET_EXCEEDED)
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             ('google.com, pub-1, DIRECT',),
+                             outcome=fetch.OK)
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    adstxtcrawler._run_once()
+
+    assert len(set(deadlines)) == 1 and deadlines[0] is not None
+    session = adstxtcrawler._session()
+    run = session.query(models.CrawlRun).one()
+    assert (run.domains, run.written) == (2, 1)
+    assert json.loads(run.outcomes) == {'ok': 1, 'cycle_budget_exceeded': 1}
+    # Left due for the next cycle.
+    assert session.query(models.Domain).filter_by(
+        name='ebay.co.uk').one().last_updated == datetime.datetime.min
+
+def test_run_processes(mocker, tmpdir):
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua', events_path=tmpdir.join('events').strpath,
+        fetcher_processes=2, writer_processes=2)
+    adstxtcrawler._bootstrap_db()
+    domains = ['reddit.com', 'ebay.co.uk', 'dailymail.co.uk', 'bbc.co.uk']
+    mocker.patch.object(adstxtcrawler, 'fetch_domains', return_value=domains)
+    # Threads stand in for processes so the fetches can be faked.
+    mocker.patch.object(main.multiprocessing, 'get_context',
+                        return_value=multiprocessing.dummy)
+    mocker.patch.object(main, 'PROCESS_QUEUE_SIZE', 1)
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        if domain == 'ebay.co.uk':
+            raise RuntimeError('boom')
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             ('google.com, pub-1, DIRECT',),
+                             outcome=fetch.OK)
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    adstxtcrawler._run_processes()
+
+    session = adstxtcrawler._session()
+    assert sorted(name for name, in session.query(models.Domain.name).join(
+        models.Record)) == ['bbc.co.uk', 'dailymail.co.uk', 'reddit.com']
+    run = session.query(models.CrawlRun).one()
+    assert (run.domains, run.written, run.records_added) == (4, 3, 3)
+    assert json.loads(run.outcomes) == {'ok': 3, 'fetch_error': 1}
+    # Each writer has its own event files.
+    prefixes = {path.basename.rsplit('-', 1)[0]
+                for path in tmpdir.join('events').listdir()}
+    assert prefixes and prefixes <= {'events-0', 'events-1'}
+
+
+def test_run_processes_spawns(tmpdir):
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua', fetcher_processes=2, writer_processes=1,
+        timeouts=fetch.Timeouts(connect=1, domain=2))
+    adstxtcrawler._bootstrap_db()
+    # Reserved names which never resolve, the crawl can't reach anything.
+    adstxtcrawler.fetch_domains = lambda: ['one.invalid', 'two.invalid']
+
+    adstxtcrawler._run_processes()
+
+    session = adstxtcrawler._session()
+    run = session.query(models.CrawlRun).one()
+    assert (run.domains, run.written) == (2, 2)
+    assert sum(json.loads(run.outcomes).values()) == 2
+    assert {present for present, in session.query(
+        models.Domain.adstxt_present)} == {False}
+
+def test_run_once_parses_shared_bodies_once(mocker, tmpdir):
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua')
+    adstxtcrawler._bootstrap_db()
+    mocker.patch.object(adstxtcrawler, 'fetch_domains', return_value=[
+        'network-one.com', 'network-two.com', 'reddit.com'])
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        lines = ['google.com, pub-1, DIRECT', 'appnexus.com, 2, RESELLER']
+        if domain == 'reddit.com':
+            lines = lines[:1]
+        return FetchResponse(domain, datetime.datetime.utcnow(), True,
+                             lines, outcome=main.fetch.OK)
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+    parse = mocker.spy(main.transform, 'parse')
+
+    adstxtcrawler._run_once()
+
+    assert parse.call_count == 2
+    session = adstxtcrawler._session()
+    assert session.query(models.Record).count() == 5
+    run = session.query(models.CrawlRun).one()
+    assert (run.parse_cache_hits, run.parse_cache_misses) == (1, 2)
+
+
+def test_parse_large_bodies_in_processes(adstxtcrawler, mocker):
+    adstxtcrawler.parse_processes = 1
+    lines = ['google.com, pub-%d, DIRECT' % number for number in range(50)]
+    lines += ['google.com, pub-1, DIRECT, f08c47fec0942fa0',
+              'contact=ads@weather.com']
+    large = FetchResponse('weather.com', None, True, lines)
+    mocker.patch.object(main, 'PARSE_PROCESS_MIN_BYTES', len(large.body))
+    small = FetchResponse('reddit.com', None, True, lines[:-1])
+
+    try:
+        assert adstxtcrawler._parse(small) == main.transform.parse(lines[:-1])
+        # Nothing was big enough to start the parse processes.
+        assert adstxtcrawler._parse_pool is None
+
+        records, variables = adstxtcrawler._parse(large)
+        assert adstxtcrawler._parse_pool is not None
+        assert (records, variables) == main.transform.parse(lines)
+        assert all(isinstance(record, main.transform.AdsRecord)
+                   for record in records)
+    finally:
+        adstxtcrawler.close()
+    assert adstxtcrawler._parse_pool is None
+
+
+def test_sqlite_tuned(tmpdir):
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///' + tmpdir.join('adstxt.sqlite').strpath,
+        crawler_id='unit_test_ua', sqlite_tuned=True)
+    adstxtcrawler._bootstrap_db()
+    assert [adstxtcrawler.engine.execute('PRAGMA %s' % pragma).scalar()
+            for pragma in ('journal_mode', 'synchronous')] == ['wal', 1]
+
+    scraped_at = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+    domains = ['domain-%d.com' % number for number in range(20)]
+
+    def write(domain):
+        adstxtcrawler._last_updated_at(domain)
+        adstxtcrawler.process_domain(FetchResponse(
+            domain, scraped_at, True, ('google.com, pub-1, DIRECT',
+                                       'appnexus.com, 3, RESELLER')))
+
+    # Readers aren't held up by a write in progress.
+    writer = adstxtcrawler._session()
+    writer.add(models.InvalidDomain(name='bad one', first_seen=scraped_at))
+    writer.flush()
+    reader = adstxtcrawler._session()
+    assert reader.query(models.InvalidDomain).count() == 0
+    reader.close()
+    writer.commit()
+    writer.close()
+
+    # Writers wait their turn for the write lock.
+    with multiprocessing.dummy.Pool(4) as pool:
+        pool.map(write, domains)
+
+    session = adstxtcrawler._session()
+    assert session.query(models.Domain).count() == len(domains)
+    assert session.query(models.Record).count() == 2 * len(domains)
+
+
+def test_sqlite_tuned_in_memory():
+    adstxtcrawler = main.AdsTxtCrawler(False, False, 'sqlite://',
+                                       sqlite_tuned=True)
+    adstxtcrawler._bootstrap_db()
+    assert adstxtcrawler.engine.execute(
+        'PRAGMA journal_mode').scalar() == 'memory'
@@ -0,0 +1,37 @@
+import datetime
+import json
+
+from adstxt.ndjson import RotatingWriter, dumps
+
+
+def test_dumps():
+    assert dumps({'a': 1, 'at': datetime.datetime(2018, 3, 26, 10, 55)}) == (
+        '{"a":1,"at":"2018-03-26T10:55:00"}')
+
+
+def test_rotating_writer(tmpdir):
+    writer = RotatingWriter(tmpdir.strpath, 'rows', max_bytes=20)
+    writer.write({'row': i} for i in range(5))
+    writer.close()
+
+    # Each file is rotated once it's over 20 bytes, so 2 rows per file.
+    assert sorted(p.basename for p in tmpdir.listdir()) == [
+        'rows-00000001.ndjson', 'rows-00000002.ndjson',
+        'rows-00000003.ndjson']
+
+    # A new writer carries on from the last file in the directory.
+    writer = RotatingWriter(tmpdir.strpath, 'rows', max_bytes=20)
+    writer.write([{'row': 5}])
+    writer.close()
+
+    rows = []
+    for path in sorted(tmpdir.listdir()):
+        rows.extend(json.loads(line) for line in path.readlines())
+    assert rows == [{'row': i} for i in range(6)]
+
+
+def test_rotating_writer_stdout(capsys):
+    writer = RotatingWriter('-', 'rows')
+    writer.write([{'row': 1}, {'row': 2}])
+
+    assert capsys.readouterr().out == '{"row":1}\n{"row":2}\n'
@@ -0,0 +1,162 @@
+import datetime
+import json
+import threading
+from urllib.request import urlopen
+
+import pytest
+
+import adstxt.events as events
+from adstxt.fetch import FetchResponse
+import adstxt.models as models
+from adstxt.query import ReverseIndex, authorised_domains
+import adstxt.service as service
+
+
+SCRAPED_AT = datetime.datetime(2018, 3, 26, 10, 55, 59)
+
+SELLERS = [('google.com', 'pub-1'),
+           ('google.com', 'pub-2'),
+           ('appnexus.com', '1004'),
+           ('openx.com', '5'),
+           ('missing.com', '1')]
+
+
+def crawl(crawler, domain, *rows):
+    crawler._check_viability(domain)
+    crawler.process_domain(FetchResponse(domain, SCRAPED_AT, True, rows))
+
+
+@pytest.fixture
+def crawled(adstxtcrawler):
+    crawl(adstxtcrawler, 'weather.com',
+          'google.com, pub-1, DIRECT, f08c47fec0942fa0',
+          'google.com, pub-1, DIRECT',
+          'appnexus.com, 1004, RESELLER')
+    crawl(adstxtcrawler, 'reddit.com',
+          'google.com, pub-1, RESELLER',
+          'google.com, pub-2, DIRECT',
+          'appnexus.com, 1004, DIRECT')
+    return adstxtcrawler
+
+
+def assert_matches_sql(index, session):
+    for supplier_domain, pub_id in SELLERS:
+        assert index.lookup(supplier_domain, pub_id) == authorised_domains(
+            session, supplier_domain, pub_id)
+
+
+def test_build(crawled):
+    session = crawled._session()
+    index = ReverseIndex()
+    index.build(session)
+
+    assert index.lookup('google.com', 'pub-1') == [
+        ('reddit.com', 'reseller'), ('weather.com', 'direct')]
+    assert_matches_sql(index, session)
+
+
+def test_refresh_from_feed(crawled):
+    session = crawled._session()
+    index = ReverseIndex()
+    index.build(session)
+
+    # Drop one of weather.com's two google pub-1 records, it's still
+    # authorised by the other.
+    crawl(crawled, 'weather.com',
+          'google.com, pub-1, DIRECT',
+          'openx.com, 5, DIRECT')
+    crawl(crawled, 'reddit.com',
+          'google.com, pub-2, DIRECT')
+
+    index.refresh(session)
+    assert index.lookup('google.com', 'pub-1') == [('weather.com', 'direct')]
+    assert index.lookup('appnexus.com', '1004') == []
+    assert_matches_sql(index, session)
+
+    # Reactivation is picked up as well.
+    crawl(crawled, 'reddit.com',
+          'google.com, pub-1, RESELLER')
+    index.refresh(session, batch_size=1)
+    assert_matches_sql(index, session)
+
+
+
+def test_refresh_out_of_order(crawled):
+    session = crawled._session()
+    index = ReverseIndex()
+    index.build(session)
+    newest = index.cursor
+    weather = session.query(models.Domain).filter_by(
+        name='weather.com').one()
+    appnexus = session.query(models.Supplier).filter_by(
+        domain='appnexus.com').one()
+
+    # Two writers are handed the next two event ids, but the slow one holding
+    # the lower id commits last.
+    slow, fast = crawled._session(), crawled._session()
+    record = fast.query(models.Record).filter_by(
+        domain_id=weather.id, supplier_id=appnexus.id).one()
+    record.active = False
+    fast.add(models.RecordEvent(
+        id=newest + 2, domain_id=weather.id, event=events.DEACTIVATE,
+        record_id=record.id, occurred_at=SCRAPED_AT))
+    fast.commit()
+    index.refresh(session)
+    assert index.lookup('appnexus.com', '1004') == [('reddit.com', 'direct')]
+
+    openx = models.Supplier(domain='openx.com', cert_authority='')
+    slow.add(openx)
+    slow.flush()
+    added = models.Record(
+        domain_id=weather.id, supplier_id=openx.id, pub_id='5',
+        supplier_relationship='direct', first_seen=SCRAPED_AT, active=True)
+    slow.add(added)
+    slow.flush()
+    slow.add(models.RecordEvent(
+        id=newest + 1, domain_id=weather.id, event=events.INSERT,
+        record_id=added.id, occurred_at=SCRAPED_AT))
+    slow.commit()
+    index.refresh(session)
+    assert index.lookup('openx.com', '5') == [('weather.com', 'direct')]
+    assert_matches_sql(index, session)
+
+    # Nothing is applied twice.
+    assert index.refresh(session) == 0
+    assert_matches_sql(index, session)
+
+def test_snapshot(crawled, tmpdir):
+    session = crawled._session()
+    index = ReverseIndex()
+    index.build(session)
+    path = tmpdir.join('index.json.gz').strpath
+    index.save(path)
+
+    crawl(crawled, 'reddit.com', 'openx.com, 5, DIRECT')
+
+    warm = ReverseIndex.load(path)
+    assert warm.cursor == index.cursor
+    warm.refresh(session)
+    assert_matches_sql(warm, session)
+
+
+def test_service(crawled):
+    session = crawled._session()
+    index = ReverseIndex()
+    index.build(session)
+
+    server = service.make_server(index, '127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+    try:
+        with urlopen(url + '/authorised?supplier_domain=Google.com'
+                           '&pub_id=pub-2') as response:
+            body = json.loads(response.read().decode('utf-8'))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert body == {'supplier_domain': 'google.com',
+                    'pub_id': 'pub-2',
+                    'domains': [{'domain': 'reddit.com',
+                                 'relationship': 'direct'}]}
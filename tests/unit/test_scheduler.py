@@ -0,0 +1,111 @@
+import datetime
+
+from adstxt.scheduler import DueScheduler, assign_tiers
+
+
+NOW = datetime.datetime(2018, 3, 26, 12, 0, 0)
+HOUR = datetime.timedelta(hours=1)
+MINUTE = datetime.timedelta(minutes=1)
+
+
+def test_pop_due_in_due_order():
+    schedule = DueScheduler(interval=HOUR)
+    schedule.sync([('reddit.com', NOW - HOUR),
+                   ('ebay.co.uk', NOW - 2 * HOUR),
+                   ('dailymail.co.uk', NOW + HOUR)])
+
+    assert schedule.pop_due(NOW, 1) == ['ebay.co.uk']
+    assert schedule.pop_due(NOW, 10) == ['reddit.com']
+    assert schedule.next_due() == NOW + HOUR
+
+    freshness = schedule.freshness()
+    assert freshness.dispatched == 2
+    assert freshness.max_lag == 2 * HOUR
+    # Reporting resets the lags.
+    assert schedule.freshness().dispatched == 0
+
+
+def test_reschedule():
+    schedule = DueScheduler(interval=HOUR)
+    schedule.sync([('reddit.com', NOW)])
+    assert schedule.pop_due(NOW, 10) == ['reddit.com']
+    # In flight domains aren't dispatched again.
+    assert schedule.pop_due(NOW + 2 * HOUR, 10) == []
+
+    schedule.reschedule('reddit.com', NOW)
+    assert schedule.pop_due(NOW, 10) == []
+    assert schedule.pop_due(NOW + HOUR, 10) == ['reddit.com']
+
+
+def test_sync_merges_and_drops():
+    schedule = DueScheduler(interval=HOUR)
+    assert schedule.sync([('reddit.com', NOW), ('ebay.co.uk', NOW)]) == 2
+
+    # Already scheduled domains keep their place, dropped ones go.
+    assert schedule.sync([('reddit.com', NOW + HOUR),
+                          ('dailymail.co.uk', NOW)]) == 1
+    assert len(schedule) == 2
+    assert schedule.pop_due(NOW, 10) == ['dailymail.co.uk', 'reddit.com']
+
+    # A domain dropped while in flight isn't rescheduled.
+    schedule.sync([('dailymail.co.uk', NOW)])
+    schedule.reschedule('reddit.com', NOW)
+    assert 'reddit.com' not in schedule
+
+
+def test_retry_backs_off():
+    schedule = DueScheduler(interval=HOUR,
+                            retry_interval=20 * MINUTE)
+    schedule.sync([('reddit.com', NOW)])
+
+    delays = []
+    failed_at = NOW
+    for _ in range(4):
+        due_at = schedule.next_due() or NOW
+        assert schedule.pop_due(due_at, 10) == ['reddit.com']
+        schedule.retry('reddit.com', failed_at)
+        delays.append(schedule.next_due() - failed_at)
+        failed_at = schedule.next_due()
+    assert [delay.seconds // 60 for delay in delays] == [20, 40, 60, 60]
+
+    # A successful crawl resets the back off.
+    schedule.pop_due(failed_at, 10)
+    schedule.reschedule('reddit.com', failed_at)
+    schedule.pop_due(failed_at + HOUR, 10)
+    schedule.retry('reddit.com', failed_at + HOUR)
+    assert schedule.next_due() == failed_at + HOUR + 20 * MINUTE
+
+
+def test_assign_tiers():
+    weights = {'domain%d.com' % i: i for i in range(200)}
+    weights['unweighted.com'] = 0
+
+    tiers = assign_tiers(weights)
+
+    assert sorted(d for d, tier in tiers.items() if tier == 0) == [
+        'domain198.com', 'domain199.com']
+    assert sum(1 for tier in tiers.values() if tier == 1) == 20
+    # Everything else is the long tail.
+    assert 'domain177.com' not in tiers
+    assert 'unweighted.com' not in tiers
+
+
+def test_higher_tiers_first_and_more_often():
+    schedule = DueScheduler(interval=6 * HOUR)
+    schedule.sync([('tail.com', NOW - 2 * HOUR),
+                   ('top.com', NOW - HOUR),
+                   ('middle.com', NOW)],
+                  tiers={'top.com': 0, 'middle.com': 1})
+
+    # Short of capacity it's the long tail that waits, however overdue.
+    assert schedule.pop_due(NOW, 2) == ['top.com', 'middle.com']
+    assert schedule.pop_due(NOW, 2) == ['tail.com']
+    assert schedule.freshness(0).max_lag == HOUR
+    assert schedule.freshness().dispatched == 2
+
+    for domain in ('top.com', 'middle.com', 'tail.com'):
+        schedule.reschedule(domain, NOW)
+    assert schedule.pop_due(NOW + HOUR, 10) == ['top.com']
+    assert schedule.pop_due(NOW + 3 * HOUR, 10) == ['middle.com']
+    # Only the long tail is left waiting.
+    assert schedule.next_due() == NOW + 6 * HOUR
@@ -0,0 +1,106 @@
+import datetime
+import sqlite3
+import threading
+
+from adstxt.fetch import FetchResponse
+import adstxt.main as main
+import adstxt.models as models
+from adstxt.spool import Spool
+
+
+SCRAPED_AT = datetime.datetime(2018, 3, 26, 10, 55, 59, 661410)
+
+
+def response(domain, *rows):
+    return FetchResponse(domain, SCRAPED_AT, bool(rows), rows)
+
+
+def test_spool_round_trip(tmpdir):
+    spool = Spool(tmpdir.strpath)
+    spool.put(response('reddit.com', 'google.com, pub-1, DIRECT'))
+    spool.put(response('ebay.co.uk'))
+    spool.put(None)
+
+    assert spool.get() == response('reddit.com',
+                                   'google.com, pub-1, DIRECT')
+    spool.task_done()
+    assert spool.get() == response('ebay.co.uk')
+    spool.task_done()
+    assert spool.get() is None
+    spool.join()
+
+
+def test_spool_replays_after_restart(tmpdir):
+    spool = Spool(tmpdir.strpath, segment_bytes=1)
+    for domain in ('reddit.com', 'ebay.co.uk', 'dailymail.co.uk'):
+        spool.put(response(domain, 'google.com, pub-1, DIRECT'))
+    assert len(tmpdir.listdir(lambda path: path.ext == '.spool')) == 4
+
+    spool.get()
+    spool.task_done()
+    # Handed out but never marked done, so it's replayed.
+    spool.get()
+    spool.close()
+
+    # Leave a torn write on the end as if we died mid append.
+    segments = sorted(tmpdir.listdir(lambda path: path.ext == '.spool'))
+    with segments[-1].open('ab') as f:
+        f.write(b'\x00\x00\x01')
+
+    spool = Spool(tmpdir.strpath, segment_bytes=1)
+    assert spool.qsize() == 2
+    spool.put(None)
+    replayed = []
+    while True:
+        fetchdata = spool.get()
+        if fetchdata is None:
+            break
+        replayed.append(fetchdata.domain)
+        spool.task_done()
+    assert replayed == ['ebay.co.uk', 'dailymail.co.uk']
+
+    # Segments are compacted away once the writer has moved past them.
+    assert sorted(path.basename for path in tmpdir.listdir(
+        lambda path: path.ext == '.spool')) == ['00000003.spool',
+                                                '00000004.spool']
+
+
+def test_run_once_spools_while_database_down(mocker, tmpdir):
+    db_path = tmpdir.join('adstxt.sqlite').strpath
+    # Fail fast on a locked database rather than waiting on it.
+    adstxtcrawler = main.AdsTxtCrawler(
+        False, False, 'sqlite:///%s?timeout=0.01' % db_path,
+        crawler_id='unit_test_ua',
+        spool_path=tmpdir.join('spool').strpath)
+    adstxtcrawler._bootstrap_db()
+    mocker.patch.object(main, 'DB_RETRY_INTERVAL', 0.05)
+    domains = ['reddit.com', 'ebay.co.uk', 'dailymail.co.uk']
+    mocker.patch.object(adstxtcrawler, 'fetch_domains', return_value=domains)
+
+    # Another connection takes the database away once the cycle starts.
+    blocker = sqlite3.connect(db_path, check_same_thread=False)
+    fetched = []
+    fetched_while_down = []
+
+    def bring_back():
+        fetched_while_down.extend(fetched)
+        blocker.rollback()
+
+    async def fake_fetch(domain, user_agent, **kwargs):
+        if not fetched:
+            blocker.execute('BEGIN EXCLUSIVE')
+            threading.Timer(0.5, bring_back).start()
+        fetched.append(domain)
+        return response(domain, 'google.com, pub-1, DIRECT')
+    mocker.patch.object(main.fetch, 'fetch', side_effect=fake_fetch)
+
+    adstxtcrawler._run_once()
+    blocker.close()
+
+    # Fetching finished while the database was down, and every response was
+    # written once it came back.
+    assert sorted(fetched_while_down) == sorted(domains)
+    session = adstxtcrawler._session()
+    assert session.query(models.Record).count() == 3
+    assert adstxtcrawler._spool.qsize() == 0
+    adstxtcrawler.close()
@@ -103,3 +103,19 @@ def test_reseller_direct_none_extraction():
 
     assert transform.process_row(
         other_stuff) is None
+
+
+def test_parse():
+    records, variables = transform.parse([
+        DUMMY_FETCH_ROW_COMMENT,
+        DUMMY_FETCH_ROW_1,
+        DUMMY_FETCH_ROW_2,
+        'contact=ads@weather.com',
+        # Duplicates collapse, a blank cert authority is no cert authority.
+        DUMMY_FETCH_ROW_1 + ', ',
+        'contact=adops@weather.com'])
+
+    assert records == [
+        DUMMY_FETCH_ROW_1_EXPECTED._replace(cert_authority=''),
+        DUMMY_FETCH_ROW_2_EXPECTED]
+    assert variables == {'contact': 'adops@weather.com'}
@@ -0,0 +1,41 @@
+import pytest
+
+import adstxt.validate as validate
+
+
+@pytest.mark.parametrize("test_input,expected", [
+    ("ebay.co.uk", "ebay.co.uk"),
+    ("  EBay.CO.uk.", "ebay.co.uk"),
+    ("bücher.de", "xn--bcher-kva.de"),
+    ("", None),
+    ("a" * 256 + ".com", None),
+])
+def test_normalise(test_input, expected):
+    assert validate.normalise(test_input) == expected
+
+
+@pytest.mark.parametrize("test_input,expected", [
+    ("ebay.co.uk", True),
+    ("m.ebay.co.uk", True),
+    ("some_host.example.com", True),
+    ("xn--bcher-kva.de", True),
+    ("localhost", False),
+    ("-ebay.co.uk", False),
+    ("ebay..co.uk", False),
+    ("ebay.co.uk/ads.txt", False),
+    ("ebay.123", False),
+    ("a" * 64 + ".com", False),
+])
+def test_is_valid(test_input, expected):
+    assert validate.is_valid(test_input) is expected
+
+
+def test_validate_domains():
+    result = validate.validate_domains(
+        ['ebay.co.uk', 'EBAY.co.uk', 'known.bad', 'bad domain',
+         'bad domain', 'reddit.com'],
+        {'known.bad'})
+
+    assert result.valid == ['ebay.co.uk', 'reddit.com']
+    assert result.invalid == ['bad domain']
+    assert result.cached == 1